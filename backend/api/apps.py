@@ -4,3 +4,13 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "api"
+
+    def ready(self):
+        from django.conf import settings
+        from PIL import Image
+
+        from . import signals  # noqa: F401
+
+        # Pillow отказывается открывать изображения больше этого размера,
+        # защищая от файлов, разворачивающихся в гигабайты при декодировании.
+        Image.MAX_IMAGE_PIXELS = settings.IMAGE_MAX_PIXELS
@@ -0,0 +1,57 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from recipes.models import Favorite, ShoppingCart, Subscription
+from users.models import User
+
+# Счётчик в ответе -> модель связи пользователя.
+COUNTED_RELATIONS = {
+    "favorites_count": Favorite,
+    "shopping_cart_count": ShoppingCart,
+    "subscriptions_count": Subscription,
+}
+
+
+def counts_key(user_id):
+    return f"user-counts:{user_id}"
+
+
+def invalidate_user_counts(user_id):
+    cache.delete(counts_key(user_id))
+
+
+def count_subquery(model):
+    return Coalesce(
+        Subquery(
+            model.objects.filter(user_id=OuterRef("pk"))
+            .order_by()
+            .values("user_id")
+            .annotate(total=Count("pk"))
+            .values("total")
+        ),
+        Value(0),
+    )
+
+
+def user_counts(user):
+    """Число рецептов в избранном и корзине и подписок пользователя.
+
+    Считается одним запросом и кешируется до изменения этих связей.
+    """
+    key = counts_key(user.id)
+    counts = cache.get(key)
+    if counts is None:
+        counts = (
+            User.objects.filter(pk=user.pk)
+            .values(
+                **{
+                    name: count_subquery(model)
+                    for name, model in COUNTED_RELATIONS.items()
+                }
+            )
+            .get()
+        )
+        cache.set(key, counts, settings.USER_COUNTS_TIMEOUT)
+    return counts
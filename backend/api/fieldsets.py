@@ -0,0 +1,22 @@
+def parse_field_list(value):
+    return {name.strip() for name in value.split(",") if name.strip()}
+
+
+def requested_fields(request, available):
+    """Поля ответа с учётом параметров ?fields= и ?omit=.
+
+    Возвращает None, если ответ не нужно сокращать. Неизвестные имена
+    полей игнорируются, порядок полей остаётся как в сериализаторе.
+    """
+    fields = request.query_params.get("fields")
+    omit = request.query_params.get("omit")
+    if not fields and not omit:
+        return None
+    selected = list(available)
+    if fields:
+        names = parse_field_list(fields)
+        selected = [name for name in selected if name in names]
+    if omit:
+        names = parse_field_list(omit)
+        selected = [name for name in selected if name not in names]
+    return tuple(selected)
@@ -1,4 +1,24 @@
-from recipes.models import Favorite, ShoppingCart
+from django.db.models import Exists, OuterRef, Value
+from rest_framework.exceptions import ValidationError
+
+from recipes.models import Favorite, ShoppingCart, Subscription
+
+MULTI_GET_MAX_IDS = 100
+
+# Строка рейтинга есть у каждого рецепта, поэтому рецепты соединяются с
+# рейтингами через INNER JOIN, а сортировку обслуживают индексы
+# recipe_score_*_idx по (рейтинг DESC, recipe DESC).
+RECIPE_ORDERINGS = {
+    "popular": ("-score__popular", "-score__recipe_id"),
+    "trending": ("-score__trending", "-score__recipe_id"),
+}
+
+
+def apply_recipe_ordering(queryset, request):
+    ordering = RECIPE_ORDERINGS.get(request.query_params.get("ordering"))
+    if ordering is None:
+        return queryset.order_by("-id")
+    return queryset.filter(score__isnull=False).order_by(*ordering)
 
 
 def apply_recipe_filters(queryset, request):
@@ -28,3 +48,37 @@ def apply_recipe_filters(queryset, request):
             return queryset.none()
 
     return queryset
+
+
+def parse_ids(request):
+    """Список id из параметра ?ids=1,2,3 без повторов, в исходном порядке.
+
+    Возвращает None, если параметр не передан.
+    """
+    value = request.query_params.get("ids")
+    if value is None:
+        return None
+    ids = []
+    for part in value.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if not part.isdigit():
+            raise ValidationError({"ids": f"Некорректный id: {part}"})
+        if int(part) not in ids:
+            ids.append(int(part))
+    if len(ids) > MULTI_GET_MAX_IDS:
+        raise ValidationError(
+            {"ids": f"Можно запросить не более {MULTI_GET_MAX_IDS} объектов."}
+        )
+    return ids
+
+
+def annotate_is_subscribed(queryset, user):
+    if not user.is_authenticated:
+        return queryset.annotate(user_is_subscribed=Value(False))
+    return queryset.annotate(
+        user_is_subscribed=Exists(
+            Subscription.objects.filter(user=user, author_id=OuterRef("pk"))
+        )
+    )
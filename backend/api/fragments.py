@@ -0,0 +1,174 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Exists, OuterRef, Value
+
+from foodgram.singleflight import single_flight
+from recipes.models import Favorite, Recipe, ShoppingCart, Subscription
+
+# Увеличивается при изменении формата RecipeReadSerializer, чтобы старые
+# фрагменты не смешивались с новыми.
+FRAGMENT_VERSION = 1
+# Флаг пользователя -> поле ответа, в котором он отдаётся.
+USER_FLAG_FIELDS = {
+    "is_favorited": "is_favorited",
+    "is_in_shopping_cart": "is_in_shopping_cart",
+    "is_subscribed": "author",
+}
+# Столбцы Recipe, которые сериализатор отдаёт как есть.
+MODEL_FIELDS = {"id", "name", "image", "text", "cooking_time"}
+# Поля, ради которых стоит собрать и закешировать полный фрагмент.
+CACHE_FILL_FIELDS = {"author", "ingredients"}
+
+
+def fragment_key(recipe_id, version):
+    """Ключ фрагмента с версией рецепта: после изменения рецепта старый
+    фрагмент больше не читается, в каком бы кеше он ни остался."""
+    return f"recipe-fragment:v{FRAGMENT_VERSION}:{recipe_id}:{version}"
+
+
+def annotate_user_flags(queryset, user, flags=tuple(USER_FLAG_FIELDS)):
+    """Добавляет к выборке рецептов флаги текущего пользователя."""
+    if not user.is_authenticated:
+        return queryset.annotate(**{name: Value(False) for name in flags})
+    subqueries = {
+        "is_favorited": Favorite.objects.filter(
+            user=user, recipe_id=OuterRef("pk")
+        ),
+        "is_in_shopping_cart": ShoppingCart.objects.filter(
+            user=user, recipe_id=OuterRef("pk")
+        ),
+        "is_subscribed": Subscription.objects.filter(
+            user=user, author_id=OuterRef("author_id")
+        ),
+    }
+    return queryset.annotate(
+        **{name: Exists(subqueries[name]) for name in flags}
+    )
+
+
+def recipe_rows(queryset, user, fields=None):
+    """Id и версии рецептов страницы вместе с флагами пользователя одним
+    запросом.
+
+    Подзапросы для флагов, которых нет среди fields, не выполняются.
+    """
+    flags = [
+        name
+        for name, field in USER_FLAG_FIELDS.items()
+        if fields is None or field in fields
+    ]
+    return annotate_user_flags(queryset, user, flags).values(
+        "id", "version", *flags
+    )
+
+
+def build_recipes(recipe_ids, fields):
+    """Фрагменты рецептов: {id: (версия, фрагмент)}.
+
+    Версия читается тем же запросом, что и данные, поэтому фрагмент,
+    собранный по отстающей реплике, попадёт под свою, старую версию.
+    """
+    from .serializers import RecipeReadSerializer
+
+    recipes = Recipe.objects.filter(id__in=recipe_ids)
+    if fields is None or "author" in fields:
+        recipes = recipes.select_related("author")
+    if fields is None or "ingredients" in fields:
+        recipes = recipes.prefetch_related("recipe_ingredient__ingredient")
+    if fields is not None:
+        fields = ("id", *fields)
+        recipes = recipes.only("version", *(set(fields) & MODEL_FIELDS))
+    recipes = list(recipes)
+    # Без request сериализатор отдаёт относительные ссылки на файлы и
+    # False во всех флагах пользователя — такой фрагмент общий для всех.
+    data = RecipeReadSerializer(
+        recipes, many=True, context={"request": None}, fields=fields
+    ).data
+    return {
+        recipe.id: (recipe.version, item)
+        for recipe, item in zip(recipes, data)
+    }
+
+
+def load_fragments(versions, fields=None):
+    """Фрагменты рецептов по {id: версия}."""
+    keys = {
+        recipe_id: fragment_key(recipe_id, version)
+        for recipe_id, version in versions.items()
+    }
+    cached = cache.get_many(keys.values())
+    fragments = {
+        recipe_id: cached[key]
+        for recipe_id, key in keys.items()
+        if key in cached
+    }
+    missing = [
+        recipe_id for recipe_id in versions if recipe_id not in fragments
+    ]
+    if not missing:
+        return fragments
+    if fields is not None and not set(fields) & CACHE_FILL_FIELDS:
+        # Запрошены только простые поля: достаточно лёгкого запроса без
+        # автора и ингредиентов, полный фрагмент в кеш не кладём.
+        fragments.update(
+            (recipe_id, item)
+            for recipe_id, (_, item) in build_recipes(missing, fields).items()
+        )
+        return fragments
+
+    def fill():
+        built = build_recipes(missing, None)
+        cache.set_many(
+            {
+                fragment_key(recipe_id, version): item
+                for recipe_id, (version, item) in built.items()
+            },
+            settings.RECIPE_FRAGMENT_TIMEOUT,
+        )
+        return {recipe_id: item for recipe_id, (_, item) in built.items()}
+
+    # Одновременные промахи по тем же рецептам собирают фрагменты один раз.
+    flight = ",".join(
+        f"{recipe_id}:{versions[recipe_id]}" for recipe_id in sorted(missing)
+    )
+    fragments.update(single_flight(f"fragments:{flight}", fill))
+    return fragments
+
+
+def absolute_url(request, url):
+    if url and url.startswith("/"):
+        return request.build_absolute_uri(url)
+    return url
+
+
+def render_recipes(rows, request, fields=None):
+    """Собирает ответ из закешированных фрагментов и флагов пользователя.
+
+    rows — результат recipe_rows(); порядок рецептов сохраняется.
+    """
+    rows = list(rows)
+    fragments = load_fragments(
+        {row["id"]: row["version"] for row in rows}, fields
+    )
+    result = []
+    for row in rows:
+        fragment = fragments.get(row["id"])
+        if fragment is None:
+            continue
+        if fields is None:
+            item = dict(fragment)
+        else:
+            item = {name: fragment[name] for name in fields}
+        if "author" in item:
+            item["author"] = dict(
+                fragment["author"],
+                is_subscribed=row["is_subscribed"],
+                avatar=absolute_url(request, fragment["author"]["avatar"]),
+            )
+        if "image" in item:
+            item["image"] = absolute_url(request, fragment["image"])
+        for flag in ("is_favorited", "is_in_shopping_cart"):
+            if flag in item:
+                item[flag] = row[flag]
+        result.append(item)
+    return result
@@ -1,10 +1,31 @@
+from django.conf import settings
+from django.db import transaction
 from rest_framework import serializers
-from recipes.models import Recipe, Ingredients, RecipeIngredient
+from recipes.models import (
+    Recipe,
+    Ingredients,
+    IngredientStats,
+    RecipeIngredient,
+)
+from recipes.purge import cleanup_files
+from recipes.stats import recipe_ingredients, record_recipe_ingredients
 from users.models import User
-from drf_extra_fields.fields import Base64ImageField
 
+from .uploads import UploadImageField
 
-class UserProfileSerializer(serializers.ModelSerializer):
+
+class SparseFieldsMixin:
+    """Позволяет передать в сериализатор fields — набор выводимых полей."""
+
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop("fields", None)
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class UserProfileSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     is_subscribed = serializers.SerializerMethodField()
     avatar = serializers.SerializerMethodField()
 
@@ -22,16 +43,20 @@ class UserProfileSerializer(serializers.ModelSerializer):
         extra_kwargs = {"password": {"write_only": True}}
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, "user_is_subscribed"):
+            return obj.user_is_subscribed
         request = self.context["request"]
         if request and not request.user.is_anonymous:
             return obj.subscribers.filter(user=request.user).exists()
         return False
 
     def get_avatar(self, obj):
+        if not obj.avatar:
+            return None
         request = self.context["request"]
-        if obj.avatar:
-            return request.build_absolute_uri(obj.avatar.url)
-        return None
+        if settings.MEDIA_BASE_URL or request is None:
+            return obj.avatar.url
+        return request.build_absolute_uri(obj.avatar.url)
 
 
 class RecipeMiniSerializer(serializers.ModelSerializer):
@@ -44,7 +69,7 @@ class RecipeMiniSerializer(serializers.ModelSerializer):
 
 
 class AvatarUpdateSerializer(serializers.ModelSerializer):
-    avatar = Base64ImageField(required=True)
+    avatar = UploadImageField(required=True)
 
     class Meta:
         model = User
@@ -92,6 +117,9 @@ class SubscriptionSerializer(UserProfileSerializer):
 
 
 class SubscribeCreateSerializer(serializers.Serializer):
+    # Повторная подписка отсекается ограничением уникальности при вставке.
+    ALREADY_SUBSCRIBED = "Вы уже подписаны на этого автора."
+
     def validate(self, data):
         user = self.context["request"].user
         author = self.context["author"]
@@ -99,10 +127,6 @@ class SubscribeCreateSerializer(serializers.Serializer):
             raise serializers.ValidationError(
                 "Нельзя подписаться на самого себя."
             )
-        if user.subscriptions.filter(author=author).exists():
-            raise serializers.ValidationError(
-                "Вы уже подписаны на этого автора."
-            )
         return data
 
 
@@ -113,6 +137,52 @@ class IngredientSerializer(serializers.ModelSerializer):
         read_only_fields = fields
 
 
+class IngredientStatsSerializer(serializers.ModelSerializer):
+    recipes_count = serializers.SerializerMethodField()
+    average_amount = serializers.SerializerMethodField()
+    amount_stddev = serializers.SerializerMethodField()
+    shopping_cart_count = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Ingredients
+        fields = (
+            "id",
+            "name",
+            "measurement_unit",
+            "recipes_count",
+            "average_amount",
+            "amount_stddev",
+            "shopping_cart_count",
+        )
+        read_only_fields = fields
+
+    def get_stats(self, obj):
+        try:
+            return obj.stats
+        except IngredientStats.DoesNotExist:
+            return IngredientStats(ingredient=obj)
+
+    def get_recipes_count(self, obj):
+        return self.get_stats(obj).recipes_count
+
+    def get_average_amount(self, obj):
+        stats = self.get_stats(obj)
+        if not stats.recipes_count:
+            return None
+        return round(stats.amount_total / stats.recipes_count, 1)
+
+    def get_amount_stddev(self, obj):
+        stats = self.get_stats(obj)
+        if not stats.recipes_count:
+            return None
+        mean = stats.amount_total / stats.recipes_count
+        variance = stats.amount_squares / stats.recipes_count - mean**2
+        return round(max(variance, 0) ** 0.5, 1)
+
+    def get_shopping_cart_count(self, obj):
+        return self.get_stats(obj).cart_count
+
+
 class RecipeIngredientSerializer(serializers.ModelSerializer):
     id = serializers.ReadOnlyField(source="ingredient.id")
     name = serializers.ReadOnlyField(source="ingredient.name")
@@ -140,7 +210,7 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
     ingredients_read = RecipeIngredientSerializer(
         many=True, source="recipe_ingredient", read_only=True
     )
-    image = Base64ImageField(required=True, allow_null=False)
+    image = UploadImageField(required=True, allow_null=False)
     cooking_time = serializers.IntegerField(min_value=1, max_value=32000)
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
@@ -207,19 +277,38 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
             ]
         )
 
+    @transaction.atomic
     def create(self, validated_data):
         ingredients_data = validated_data.pop("ingredients")
         recipe = Recipe.objects.create(
             author=self.context["request"].user, **validated_data
         )
         self.create_ingredients(recipe, ingredients_data)
+        record_recipe_ingredients(
+            recipe.id, added=self.amounts(ingredients_data), carts=0
+        )
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         ingredients_data = validated_data.pop("ingredients")
+        removed = recipe_ingredients(instance.id)
         instance.recipe_ingredient.all().delete()
         self.create_ingredients(instance, ingredients_data)
-        return super().update(instance, validated_data)
+        record_recipe_ingredients(
+            instance.id, added=self.amounts(ingredients_data), removed=removed
+        )
+        old_image = instance.image.name
+        instance = super().update(instance, validated_data)
+        if instance.image.name != old_image:
+            cleanup_files(Recipe._meta.get_field("image"), [old_image])
+        return instance
+
+    def amounts(self, ingredients_data):
+        return [
+            (ingredient["id"].id, ingredient["amount"])
+            for ingredient in ingredients_data
+        ]
 
     def get_is_favorited(self, obj):
         request = self.context["request"]
@@ -239,7 +328,7 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
         return RecipeReadSerializer(instance, context=self.context).data
 
 
-class RecipeReadSerializer(serializers.ModelSerializer):
+class RecipeReadSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     author = UserProfileSerializer(read_only=True)
     ingredients = RecipeIngredientSerializer(
         many=True, source="recipe_ingredient"
@@ -265,13 +354,15 @@ class RecipeReadSerializer(serializers.ModelSerializer):
     def get_is_favorited(self, obj):
         request = self.context["request"]
         return (
-            request.user.is_authenticated
+            request is not None
+            and request.user.is_authenticated
             and obj.favorited_by.filter(user=request.user).exists()
         )
 
     def get_is_in_shopping_cart(self, obj):
         request = self.context["request"]
         return (
-            request.user.is_authenticated
+            request is not None
+            and request.user.is_authenticated
             and obj.in_cart.filter(user=request.user).exists()
         )
@@ -0,0 +1,80 @@
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from foodgram.events import publish_recipe
+from recipes.models import Ingredients, Recipe, RecipeIngredient, ShoppingCart
+from recipes.stats import record_removed_carts, record_removed_recipes
+from users.models import User
+
+from .streaming import invalidate_ingredient_list
+
+# Поля пользователя, которые попадают во фрагмент рецепта как автор.
+AUTHOR_FIELDS = {"username", "first_name", "last_name", "email", "avatar"}
+
+
+def bump_versions(recipes):
+    """Увеличивает версии рецептов в той же транзакции, что и изменение:
+    закешированные фрагменты прежних версий больше не читаются.
+
+    Сам рецепт увеличивает версию в Recipe.save().
+    """
+    recipes.update(version=F("version") + 1)
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_created(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(lambda: publish_recipe(instance))
+
+
+@receiver(post_save, sender=RecipeIngredient)
+@receiver(post_delete, sender=RecipeIngredient)
+def recipe_ingredient_changed(sender, instance, **kwargs):
+    bump_versions(Recipe.objects.filter(pk=instance.recipe_id))
+
+
+@receiver(post_save, sender=Ingredients)
+@receiver(post_delete, sender=Ingredients)
+def ingredient_list_changed(sender, **kwargs):
+    transaction.on_commit(invalidate_ingredient_list)
+
+
+@receiver(post_save, sender=Ingredients)
+def ingredient_changed(sender, instance, created, **kwargs):
+    if created:
+        return
+    bump_versions(
+        Recipe.objects.filter(
+            id__in=RecipeIngredient.objects.filter(
+                ingredient=instance
+            ).values("recipe_id")
+        )
+    )
+
+
+@receiver(post_save, sender=User)
+def author_changed(sender, instance, created, update_fields, **kwargs):
+    if created or (update_fields and not AUTHOR_FIELDS & set(update_fields)):
+        return
+    bump_versions(Recipe.objects.filter(author=instance))
+
+
+# Удаление через ORM (в том числе каскадом при удалении пользователя):
+# pre_delete приходит в транзакции удаления до удаления строк. Пакетное
+# удаление в recipes/purge.py снимает статистику само и сюда приходит
+# уже без состава и корзин.
+@receiver(pre_delete, sender=Recipe)
+def recipe_deleted(sender, instance, **kwargs):
+    record_removed_recipes([instance.id])
+
+
+@receiver(pre_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    # Корзины с собственными рецептами пользователя учтёт recipe_deleted.
+    record_removed_carts(
+        ShoppingCart.objects.filter(user=instance).exclude(
+            recipe__author=instance
+        )
+    )
@@ -0,0 +1,154 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import router
+from django.db.models import Count, Max, QuerySet
+from django.http import HttpResponse, StreamingHttpResponse
+from rest_framework.compat import LONG_SEPARATORS, SHORT_SEPARATORS
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework.utils.json import dumps
+
+from foodgram.compression import apply_variant, compress
+from foodgram.singleflight import single_flight
+from recipes.models import Ingredients
+
+# Сколько байт копить перед отправкой очередной части ответа.
+STREAM_BUFFER_SIZE = 64 * 1024
+STREAM_CHUNK_SIZE = 2000
+# Полный список ингредиентов со сжатыми вариантами.
+INGREDIENT_LIST_KEY = "ingredient-list:v2"
+
+
+def can_stream(request):
+    renderer = request.accepted_renderer
+    return isinstance(renderer, JSONRenderer) and (
+        renderer.get_indent(request.accepted_media_type, {}) is None
+    )
+
+
+def json_array_chunks(items, renderer):
+    """Кодирует последовательность в JSON-массив по частям.
+
+    Результат побайтно совпадает с JSONRenderer().render(list(items)).
+    """
+    separators = SHORT_SEPARATORS if renderer.compact else LONG_SEPARATORS
+
+    def encode(item):
+        text = dumps(
+            item,
+            cls=renderer.encoder_class,
+            ensure_ascii=renderer.ensure_ascii,
+            allow_nan=not renderer.strict,
+            separators=separators,
+        )
+        text = text.replace("\u2028", "\\u2028")
+        return text.replace("\u2029", "\\u2029").encode()
+
+    comma = separators[0].encode()
+    buffer, size = [b"["], 1
+    first = True
+    for item in items:
+        if not first:
+            buffer.append(comma)
+            size += len(comma)
+        encoded = encode(item)
+        buffer.append(encoded)
+        size += len(encoded)
+        # Первый элемент отправляется сразу, чтобы клиент быстрее
+        # получил начало ответа.
+        if first or size >= STREAM_BUFFER_SIZE:
+            yield b"".join(buffer)
+            buffer, size = [], 0
+        first = False
+    buffer.append(b"]")
+    yield b"".join(buffer)
+
+
+def streaming_list_response(request, rows, serializer_class):
+    """Список объектов ответом, который сериализуется по мере отправки.
+
+    Для JSON без отступов отдаёт StreamingHttpResponse, читая queryset
+    через iterator(); для остальных форматов — обычный Response.
+    """
+    serializer = serializer_class(context={"request": request})
+    if not can_stream(request):
+        return Response(
+            serializer_class(
+                rows, many=True, context={"request": request}
+            ).data
+        )
+    return StreamingHttpResponse(
+        json_array_chunks(
+            map(serializer.to_representation, iterate(rows)),
+            request.accepted_renderer,
+        ),
+        content_type=request.accepted_renderer.media_type,
+    )
+
+
+def iterate(rows):
+    if isinstance(rows, QuerySet):
+        # Ответ читается уже после выхода из view и middleware, поэтому
+        # база для чтения выбирается сейчас.
+        rows = rows.using(router.db_for_read(rows.model)).iterator(
+            chunk_size=STREAM_CHUNK_SIZE
+        )
+    return rows
+
+
+def cached_list_response(request, key, rows, serializer_class):
+    """Как streaming_list_response, но тело ответа кешируется под key
+    вместе со сжатыми вариантами; следующие запросы не обращаются к базе.
+
+    Список больше COMPRESSED_CACHE_MAX_SIZE не кешируется и отдаётся
+    потоком, собираясь заново.
+    """
+    if not can_stream(request):
+        return streaming_list_response(request, rows, serializer_class)
+    renderer = request.accepted_renderer
+    entry = cache.get(key)
+    cached = entry is not None
+    if not cached:
+
+        def fill():
+            serializer = serializer_class(context={"request": request})
+            body, size = [], 0
+            for chunk in json_array_chunks(
+                map(serializer.to_representation, iterate(rows)), renderer
+            ):
+                body.append(chunk)
+                size += len(chunk)
+                if size > settings.COMPRESSED_CACHE_MAX_SIZE:
+                    return None
+            body = b"".join(body)
+            entry = {"body": body, "variants": compress(body)}
+            cache.set(key, entry, settings.COMPRESSED_TIMEOUT)
+            return entry
+
+        # Пока один запрос собирает список, одновременные ждут его.
+        entry = single_flight(f"list:{key}", fill)
+        if entry is None:
+            return streaming_list_response(request, rows, serializer_class)
+    response = HttpResponse(entry["body"], content_type=renderer.media_type)
+    return apply_variant(
+        request, response, entry["body"], entry["variants"], cached
+    )
+
+
+def ingredient_list_key():
+    """Ключ кеша полного списка ингредиентов.
+
+    В ключ входят число ингредиентов и наибольший id, поэтому загрузка
+    и удаление ингредиентов меняют ключ во всех процессах, даже с
+    LocMemCache. Переименование ключ не меняет: с локальным кешем другие
+    процессы увидят его через COMPRESSED_TIMEOUT, сразу — только с общим
+    кешем (memcached, Redis).
+    """
+    state = Ingredients.objects.order_by().aggregate(
+        total=Count("pk"), last=Max("pk")
+    )
+    return f"{INGREDIENT_LIST_KEY}:{state['total']}:{state['last']}"
+
+
+def invalidate_ingredient_list():
+    cache.delete(ingredient_list_key())
@@ -0,0 +1,14 @@
+from recipes.models import Recipe
+from recipes.purge import purge_recipe
+from recipes.queue import task
+
+
+@task
+def delete_recipe(recipe_id):
+    """Удаляет рецепт с большим числом связей вне запроса."""
+    recipe = Recipe.objects.filter(pk=recipe_id).first()
+    if recipe is None:
+        return
+    # Статистика ингредиентов обновляется в purge_recipe вместе с
+    # удалением состава, поэтому повтор задачи не вычтет его дважды.
+    purge_recipe(recipe)
@@ -0,0 +1,468 @@
+import io
+import json
+import tempfile
+import threading
+import time
+from unittest import mock, skipUnless
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test import (
+    Client,
+    RequestFactory,
+    TransactionTestCase,
+    override_settings,
+)
+from rest_framework.test import APIClient
+
+from api import views
+from api.tasks import delete_recipe
+from foodgram.admission import client_key
+from foodgram.events import PollingBroker
+from foodgram.sse import ticket_user_id
+from recipes.models import (
+    Favorite,
+    Ingredients,
+    IngredientStats,
+    Recipe,
+    RecipeIngredient,
+    RecipeScore,
+    ShoppingCart,
+    Task,
+)
+from recipes.purge import purge_recipe, purge_user
+from recipes.queue import claim, enqueue, execute
+from recipes.relations import add_relation
+from users.models import User
+
+
+def create_user(username):
+    return User.objects.create_user(
+        email=f"{username}@example.com",
+        username=username,
+        first_name="Имя",
+        last_name="Фамилия",
+        password="password",
+    )
+
+
+def run_concurrently(target, args_list):
+    """Запускает target в потоках одновременно и ждёт их завершения."""
+
+    def run(*args):
+        try:
+            target(*args)
+        finally:
+            connections.close_all()
+
+    threads = [threading.Thread(target=run, args=args) for args in args_list]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+@override_settings(ADMISSION_CONTROL=False)
+class SingleFlightTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        author = create_user("author")
+        self.recipes = [
+            Recipe.objects.create(
+                author=author,
+                name=f"Рецепт {number}",
+                text="Описание",
+                cooking_time=10,
+            )
+            for number in range(2)
+        ]
+
+    def test_concurrent_detail_requests_get_own_recipe(self):
+        render_recipes = views.render_recipes
+
+        def slow_render_recipes(*args, **kwargs):
+            # Запросы должны пересечься по времени.
+            time.sleep(0.2)
+            return render_recipes(*args, **kwargs)
+
+        responses = {}
+
+        def fetch(recipe):
+            responses[recipe.id] = APIClient().get(
+                f"/api/recipes/{recipe.id}/"
+            )
+
+        with mock.patch.object(views, "render_recipes", slow_render_recipes):
+            run_concurrently(fetch, [(recipe,) for recipe in self.recipes])
+        for recipe in self.recipes:
+            self.assertEqual(responses[recipe.id].status_code, 200)
+            self.assertEqual(responses[recipe.id].data["id"], recipe.id)
+
+
+@override_settings(ADMISSION_CONTROL=False)
+class RecipeFragmentTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.recipe = Recipe.objects.create(
+            author=create_user("author"),
+            name="Рецепт",
+            text="Описание",
+            cooking_time=10,
+        )
+
+    def test_changed_recipe_is_not_served_from_cache(self):
+        client = APIClient()
+        url = f"/api/recipes/{self.recipe.id}/"
+        self.assertEqual(client.get(url).data["name"], "Рецепт")
+        self.recipe.name = "Новый рецепт"
+        self.recipe.save()
+        self.assertEqual(self.recipe.version, 1)
+        self.assertEqual(client.get(url).data["name"], "Новый рецепт")
+
+    def test_changed_author_is_not_served_from_cache(self):
+        client = APIClient()
+        url = f"/api/recipes/{self.recipe.id}/"
+        client.get(url)
+        author = self.recipe.author
+        author.first_name = "Другое"
+        author.save()
+        self.assertEqual(
+            client.get(url).data["author"]["first_name"], "Другое"
+        )
+
+
+@override_settings(ADMISSION_CONTROL=False)
+class MultiGetTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = create_user("author")
+        self.recipe = Recipe.objects.create(
+            author=self.author,
+            name="Рецепт",
+            text="Описание",
+            cooking_time=10,
+        )
+
+    def test_recipes_without_id_field(self):
+        client = APIClient()
+        for query in ("fields=name", "omit=id"):
+            response = client.get(
+                f"/api/recipes/?ids={self.recipe.id},0&{query}"
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn("id", response.data["results"][0])
+            self.assertEqual(response.data["results"][0]["name"], "Рецепт")
+            self.assertEqual(response.data["missing"], [0])
+
+    def test_users_without_id_field(self):
+        response = APIClient().get(
+            f"/api/users/?ids={self.author.id},0&fields=username"
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.data["results"], [{"username": "author"}]
+        )
+        self.assertEqual(response.data["missing"], [0])
+
+
+@override_settings(ADMISSION_CONTROL=False)
+class RelationTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = create_user("user")
+        self.recipe = Recipe.objects.create(
+            author=create_user("author"),
+            name="Рецепт",
+            text="Описание",
+            cooking_time=10,
+        )
+
+    def test_concurrent_add_relation_creates_one_row(self):
+        for model in (Favorite, ShoppingCart):
+            with self.subTest(model=model.__name__):
+                results = []
+                run_concurrently(
+                    lambda: results.append(
+                        add_relation(
+                            model, user=self.user.id, recipe=self.recipe.id
+                        )
+                    ),
+                    [()] * 4,
+                )
+                self.assertEqual(
+                    len([result for result in results if result]), 1
+                )
+                self.assertEqual(model.objects.count(), 1)
+
+    @skipUnless(
+        connection.vendor == "postgresql",
+        "SQLite блокирует всю базу на запись параллельных транзакций",
+    )
+    def test_concurrent_requests_count_one_event(self):
+        for url in ("favorite", "shopping_cart"):
+            with self.subTest(url=url):
+                statuses = []
+
+                def post():
+                    client = APIClient()
+                    client.force_authenticate(self.user)
+                    statuses.append(
+                        client.post(
+                            f"/api/recipes/{self.recipe.id}/{url}/"
+                        ).status_code
+                    )
+
+                run_concurrently(post, [()] * 4)
+                self.assertEqual(sorted(statuses), [201, 400, 400, 400])
+        score = RecipeScore.objects.get(recipe=self.recipe)
+        self.assertEqual(score.popular, 2)
+
+
+@override_settings(ADMISSION_CONTROL=False, PURGE_RELATIONS_THRESHOLD=1)
+class DeferredDeleteTests(TransactionTestCase):
+    def test_repeated_delete_queues_one_task(self):
+        author = create_user("author")
+        recipe = Recipe.objects.create(
+            author=author, name="Рецепт", text="Описание", cooking_time=10
+        )
+        client = APIClient()
+        client.force_authenticate(author)
+        for _ in range(2):
+            response = client.delete(f"/api/recipes/{recipe.id}/")
+            self.assertEqual(response.status_code, 202)
+        self.assertEqual(Task.objects.count(), 1)
+        for item in claim(1):
+            execute(item.name, item.payload)
+        self.assertFalse(Recipe.objects.filter(pk=recipe.pk).exists())
+
+    def test_concurrent_unique_enqueue_creates_one_task(self):
+        run_concurrently(
+            lambda: enqueue(delete_recipe, unique=True, recipe_id=1),
+            [()] * 4,
+        )
+        self.assertEqual(Task.objects.count(), 1)
+
+
+def rebuild_stats():
+    call_command(
+        "rebuild_ingredient_stats",
+        stdout=io.StringIO(),
+        stderr=io.StringIO(),
+    )
+
+
+@override_settings(ADMISSION_CONTROL=False)
+class IngredientStatsTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.users = [create_user(f"user{number}") for number in range(3)]
+        ingredients = [
+            Ingredients.objects.create(name=name, measurement_unit="г")
+            for name in ("соль", "перец", "мука")
+        ]
+        for user in self.users:
+            for number in range(2):
+                recipe = Recipe.objects.create(
+                    author=user,
+                    name=f"{user.username} {number}",
+                    text="Описание",
+                    cooking_time=10,
+                )
+                for amount, ingredient in enumerate(ingredients[number:], 2):
+                    RecipeIngredient.objects.create(
+                        recipe=recipe, ingredient=ingredient, amount=amount
+                    )
+        for user in self.users:
+            for recipe in Recipe.objects.all()[::2]:
+                ShoppingCart.objects.create(user=user, recipe=recipe)
+        rebuild_stats()
+
+    def test_dedupe_carts_before_unique_constraint(self):
+        pair = ("user", "recipe")
+        with connection.schema_editor() as editor:
+            editor.alter_unique_together(ShoppingCart, [pair], [])
+        try:
+            kept = list(ShoppingCart.objects.order_by("id"))
+            for cart in kept[:3] * 2:
+                ShoppingCart.objects.create(
+                    user=cart.user, recipe=cart.recipe
+                )
+            rebuild_stats()
+            call_command("dedupe_carts", stdout=io.StringIO())
+            self.assertEqual(list(ShoppingCart.objects.order_by("id")), kept)
+            self.assert_stats_rebuilt()
+        finally:
+            with connection.schema_editor() as editor:
+                editor.alter_unique_together(ShoppingCart, [], [pair])
+
+    def test_admin_paths_keep_stats(self):
+        admin = User.objects.create_superuser(
+            email="admin@example.com", username="admin", password="password"
+        )
+        client = Client()
+        client.force_login(admin)
+        recipe = self.users[0].recipes.first()
+        rows = list(recipe.recipe_ingredient.order_by("id"))
+        data = {
+            "name": recipe.name,
+            "text": recipe.text,
+            "cooking_time": recipe.cooking_time,
+            "author": recipe.author_id,
+            "recipe_ingredient-TOTAL_FORMS": len(rows) + 1,
+            "recipe_ingredient-INITIAL_FORMS": len(rows),
+            "recipe_ingredient-MIN_NUM_FORMS": 0,
+            "recipe_ingredient-MAX_NUM_FORMS": 1000,
+        }
+        unused = Ingredients.objects.create(name="укроп", measurement_unit="г")
+        for index, row in enumerate(rows + [None]):
+            prefix = f"recipe_ingredient-{index}-"
+            data[prefix + "recipe"] = recipe.id
+            if row is None:
+                data[prefix + "ingredient"] = unused.id
+                data[prefix + "amount"] = 7
+                continue
+            data[prefix + "id"] = row.id
+            data[prefix + "ingredient"] = row.ingredient_id
+            data[prefix + "amount"] = row.amount + 3
+            if index == 0:
+                data[prefix + "DELETE"] = "on"
+        response = client.post(
+            f"/admin/recipes/recipe/{recipe.id}/change/", data
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assert_stats_rebuilt()
+        cart = ShoppingCart.objects.first()
+        client.post(
+            f"/admin/recipes/shoppingcart/{cart.id}/delete/", {"post": "yes"}
+        )
+        self.assertFalse(ShoppingCart.objects.filter(id=cart.id).exists())
+        self.assert_stats_rebuilt()
+        client.post(
+            "/admin/recipes/shoppingcart/",
+            {
+                "action": "delete_selected",
+                "_selected_action": list(
+                    ShoppingCart.objects.values_list("id", flat=True)[:3]
+                ),
+                "post": "yes",
+            },
+        )
+        self.assertEqual(ShoppingCart.objects.count(), 5)
+        self.assert_stats_rebuilt()
+
+    def test_popular_ordering(self):
+        Ingredients.objects.create(name="базилик", measurement_unit="г")
+        response = self.client.get("/api/ingredients/?ordering=popular")
+        items = json.loads(b"".join(response.streaming_content))
+        names = [item["name"] for item in items]
+        self.assertEqual(names, ["мука", "перец", "соль", "базилик"])
+
+    def stats(self):
+        return sorted(
+            IngredientStats.objects.values_list(
+                "ingredient_id",
+                "recipes_count",
+                "amount_total",
+                "amount_squares",
+                "cart_count",
+            )
+        )
+
+    def assert_stats_rebuilt(self):
+        stats = self.stats()
+        rebuild_stats()
+        self.assertEqual(stats, self.stats())
+
+    def test_delete_paths_keep_stats(self):
+        author = self.users[0]
+        client = APIClient()
+        client.force_authenticate(author)
+        recipe = author.recipes.first()
+        self.assertEqual(
+            client.delete(f"/api/recipes/{recipe.id}/").status_code, 204
+        )
+        self.assert_stats_rebuilt()
+        purge_recipe(author.recipes.first(), batch_size=1)
+        self.assert_stats_rebuilt()
+        with override_settings(PURGE_RELATIONS_THRESHOLD=1):
+            recipe = self.users[1].recipes.first()
+            client.force_authenticate(self.users[1])
+            client.delete(f"/api/recipes/{recipe.id}/")
+            for item in claim(1):
+                execute(item.name, item.payload)
+        self.assert_stats_rebuilt()
+        purge_user(self.users[1], batch_size=1)
+        self.assert_stats_rebuilt()
+        self.users[2].delete()
+        self.assert_stats_rebuilt()
+
+
+@override_settings(ADMISSION_CONTROL=False)
+class GenerateDatasetTests(TransactionTestCase):
+    def test_small_dataset_loads(self):
+        for name in ("соль", "перец", "мука", "сахар", "масло", "яйцо"):
+            Ingredients.objects.create(name=name, measurement_unit="г")
+        with (
+            tempfile.TemporaryDirectory() as media,
+            override_settings(MEDIA_ROOT=media),
+        ):
+            call_command(
+                "generate_dataset",
+                users=5,
+                recipes=10,
+                workers=1,
+                chunk_size=4,
+                stdout=io.StringIO(),
+                stderr=io.StringIO(),
+            )
+        self.assertEqual(Recipe.objects.count(), 10)
+        self.assertFalse(Recipe.objects.exclude(version=0).exists())
+        self.assertEqual(RecipeScore.objects.count(), 10)
+        self.assertTrue(RecipeIngredient.objects.exists())
+
+
+@override_settings(ADMISSION_TRUSTED_PROXIES=["10.0.0.0/8"])
+class ClientKeyTests(TransactionTestCase):
+    def test_real_ip_only_from_trusted_proxy(self):
+        factory = RequestFactory()
+        proxied = factory.get(
+            "/", REMOTE_ADDR="10.1.2.3", HTTP_X_REAL_IP="1.2.3.4"
+        )
+        self.assertEqual(client_key(proxied), "ip:1.2.3.4")
+        direct = factory.get(
+            "/", REMOTE_ADDR="5.6.7.8", HTTP_X_REAL_IP="1.2.3.4"
+        )
+        self.assertEqual(client_key(direct), "ip:5.6.7.8")
+
+
+@override_settings(ADMISSION_CONTROL=False)
+class EventTests(TransactionTestCase):
+    def create_recipe(self, author, **fields):
+        return Recipe.objects.create(
+            author=author,
+            name="Рецепт",
+            text="Описание",
+            cooking_time=10,
+            **fields,
+        )
+
+    def test_polling_picks_up_late_lower_id(self):
+        author = create_user("author")
+        first = self.create_recipe(author)
+        broker = PollingBroker()
+        self.assertEqual(broker.fetch(), [])
+        later = self.create_recipe(author, id=first.id + 5)
+        self.assertEqual([row[0] for row in broker.fetch()], [later.id])
+        # Транзакция с меньшим id зафиксирована позже.
+        late = self.create_recipe(author, id=first.id + 2)
+        self.assertEqual([row[0] for row in broker.fetch()], [late.id])
+        self.assertEqual(broker.fetch(), [])
+
+    def test_ticket_identifies_user(self):
+        user = create_user("user")
+        client = APIClient()
+        client.force_authenticate(user)
+        response = client.post("/api/event-ticket/")
+        self.assertEqual(ticket_user_id(response.data["ticket"]), user.id)
+        self.assertIsNone(ticket_user_id(response.data["ticket"] + "x"))
@@ -0,0 +1,78 @@
+import json
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.http import QueryDict
+from drf_extra_fields.fields import Base64ImageField
+from PIL import Image
+from rest_framework import serializers
+
+
+def check_image_limits(file):
+    """Проверяет формат и размеры изображения по заголовку файла,
+    не декодируя пиксели."""
+    if file.size > settings.IMAGE_MAX_UPLOAD_SIZE:
+        raise serializers.ValidationError(
+            "Файл изображения слишком большой."
+        )
+    source = (
+        file.temporary_file_path()
+        if hasattr(file, "temporary_file_path")
+        else file
+    )
+    try:
+        with Image.open(source) as image:
+            image_format = (image.format or "").lower()
+            width, height = image.size
+    except (OSError, Image.DecompressionBombError):
+        raise serializers.ValidationError(
+            Base64ImageField.INVALID_FILE_MESSAGE
+        )
+    finally:
+        file.seek(0)
+    if image_format not in Base64ImageField.ALLOWED_TYPES:
+        raise serializers.ValidationError(
+            Base64ImageField.INVALID_TYPE_MESSAGE
+        )
+    if (
+        max(width, height) > settings.IMAGE_MAX_SIDE
+        or width * height > settings.IMAGE_MAX_PIXELS
+    ):
+        raise serializers.ValidationError(
+            "Изображение не должно превышать "
+            f"{settings.IMAGE_MAX_SIDE} пикселей по стороне."
+        )
+
+
+class UploadImageField(Base64ImageField):
+    """Изображение в Base64 (JSON) или файлом из multipart-запроса.
+
+    Файл из multipart Django пишет на диск во временный файл, поэтому
+    загрузка не держит изображение в памяти целиком.
+    """
+
+    def to_internal_value(self, data):
+        if isinstance(data, UploadedFile):
+            check_image_limits(data)
+            return serializers.ImageField.to_internal_value(self, data)
+        image = super().to_internal_value(data)
+        if image is not None:
+            check_image_limits(image)
+        return image
+
+
+def request_payload(request, json_fields=()):
+    """Данные запроса; в multipart вложенные поля передаются строкой JSON."""
+    if not isinstance(request.data, QueryDict):
+        return request.data
+    data = request.data.dict()
+    for name in json_fields:
+        if name not in data:
+            continue
+        try:
+            data[name] = json.loads(data[name])
+        except ValueError:
+            raise serializers.ValidationError(
+                {name: ["Ожидается JSON."]}
+            )
+    return data
@@ -5,10 +5,14 @@ from .views import (
     recipe_detail,
     ingredient_list,
     ingredient_detail,
+    ingredient_stats,
     add_to_favorites,
     manage_shopping_cart,
     download_cart,
     get_short_link,
+    bootstrap,
+    event_ticket,
+    metrics_view,
     UserViewSet,
 )
 
@@ -29,7 +33,15 @@ urlpatterns = [
     path("recipes/<int:id>/", recipe_detail, name="recipe-detail"),
     path("recipes/<int:id>/favorite/", add_to_favorites, name="favorite"),
     path("recipes/<int:id>/get-link/", get_short_link, name="short-link"),
+    path("bootstrap/", bootstrap, name="bootstrap"),
+    path("metrics/", metrics_view, name="metrics"),
+    path("event-ticket/", event_ticket, name="event-ticket"),
     path("ingredients/", ingredient_list, name="ingredient-list"),
     path("ingredients/<int:id>/", ingredient_detail, 
          name="ingredient-detail"),
+    path(
+        "ingredients/<int:id>/stats/",
+        ingredient_stats,
+        name="ingredient-stats",
+    ),
 ]
@@ -1,16 +1,26 @@
+import hashlib
+
 from django.shortcuts import get_object_or_404
-from django.http import HttpResponse
-from django.db.models import Exists, OuterRef
+from django.http import Http404, HttpResponse
+from django.db import transaction
+from django.db.models import Case, Exists, OuterRef, Q, When
 from django.urls import reverse
+from django.utils.http import parse_etags, quote_etag
 from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes, action
+from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import (
     AllowAny,
     IsAuthenticated,
     IsAuthenticatedOrReadOnly,
 )
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from djoser.views import UserViewSet
+from foodgram import metrics
+from foodgram.singleflight import coalesce_request
+from foodgram.sse import make_ticket
 from recipes.models import (
     Recipe,
     Ingredients,
@@ -19,19 +29,75 @@ from recipes.models import (
     ShoppingCart,
     RecipeIngredient,
 )
+from recipes.purge import cleanup_files, has_many_relations
+from recipes.queue import enqueue
+from recipes.relations import add_relation, remove_relation
+from recipes.scores import record_event
+from recipes.stats import record_cart_change
 from users.models import User
 from .serializers import (
     IngredientSerializer,
-    RecipeReadSerializer,
+    IngredientStatsSerializer,
     UserProfileSerializer,
     SubscriptionSerializer,
+    RecipeReadSerializer,
     RecipeWriteSerializer,
     AvatarUpdateSerializer,
     RecipeMiniSerializer,
     SubscribeCreateSerializer,
 )
+from .counters import invalidate_user_counts, user_counts
+from .fieldsets import requested_fields
+from .fragments import recipe_rows, render_recipes
 from .pagination import CustomPagePagination
-from .filters import apply_recipe_filters
+from .permissions import AdminOrMetricsToken
+from .filters import (
+    annotate_is_subscribed,
+    apply_recipe_filters,
+    apply_recipe_ordering,
+    parse_ids,
+)
+from .streaming import (
+    cached_list_response,
+    ingredient_list_key,
+    streaming_list_response,
+)
+from .tasks import delete_recipe
+from .uploads import request_payload
+
+
+USER_MODEL_FIELDS = {
+    "id",
+    "username",
+    "first_name",
+    "last_name",
+    "email",
+    "avatar",
+}
+
+
+def multi_get_fields(fields):
+    """Поля для запроса ?ids=: id нужен, чтобы сопоставить объекты с
+    запрошенными id, даже если его нет в ?fields= или он в ?omit=."""
+    if fields is None or "id" in fields:
+        return fields
+    return ("id", *fields)
+
+
+def multi_get_response(ids, items, fields=None):
+    """Ответ на запрос ?ids=: объекты в порядке запроса и ненайденные id.
+
+    items собраны с полями multi_get_fields(fields); id из них убирается,
+    если его не запрашивали.
+    """
+    found = {item["id"]: item for item in items}
+    if fields is not None and "id" not in fields:
+        for item in found.values():
+            del item["id"]
+    return {
+        "results": [found[id] for id in ids if id in found],
+        "missing": [id for id in ids if id not in found],
+    }
 
 
 class UserViewSet(UserViewSet):
@@ -44,10 +110,36 @@ class UserViewSet(UserViewSet):
         return [IsAuthenticated()]
 
     def list(self, request, *args, **kwargs):
-        queryset = self.filter_queryset(self.get_queryset())
+        fields = requested_fields(request, UserProfileSerializer.Meta.fields)
+        ids = parse_ids(request)
+        if ids is not None:
+            requested = fields
+            fields = multi_get_fields(fields)
+            queryset = User.objects.filter(id__in=ids)
+        else:
+            queryset = self.filter_queryset(self.get_queryset())
+        if fields is not None:
+            queryset = queryset.only(
+                "id", *(set(fields) & USER_MODEL_FIELDS)
+            )
+        if fields is None or "is_subscribed" in fields:
+            queryset = annotate_is_subscribed(queryset, request.user)
+        if ids is not None:
+            serializer = UserProfileSerializer(
+                queryset,
+                many=True,
+                context={"request": request},
+                fields=fields,
+            )
+            return Response(
+                multi_get_response(ids, serializer.data, requested)
+            )
         page = self.paginate_queryset(queryset)
         serializer = UserProfileSerializer(
-            page or queryset, many=True, context={"request": request}
+            page or queryset,
+            many=True,
+            context={"request": request},
+            fields=fields,
         )
         return self.get_paginated_response(serializer.data)
 
@@ -72,26 +164,37 @@ class UserViewSet(UserViewSet):
         permission_classes=[IsAuthenticated],
     )
     def subscribe(self, request, id=None):
-        author = get_object_or_404(User, id=id)
         user = request.user
         if request.method == "POST":
+            author = get_object_or_404(User, id=id)
             serializer = SubscribeCreateSerializer(
                 data=request.data,
                 context={"request": request, "author": author},
             )
             serializer.is_valid(raise_exception=True)
-            Subscription.objects.create(user=user, author=author)
+            created_at = add_relation(
+                Subscription, user=user.id, author=author.id
+            )
+            if created_at is None:
+                raise ValidationError(
+                    {
+                        api_settings.NON_FIELD_ERRORS_KEY: [
+                            SubscribeCreateSerializer.ALREADY_SUBSCRIBED
+                        ]
+                    }
+                )
+            invalidate_user_counts(user.id)
             serializer = SubscriptionSerializer(
                 author, context={"request": request}
             )
             return Response(serializer.data, status=status.HTTP_201_CREATED)
-        subscription = user.subscriptions.filter(author=author).first()
-        if not subscription:
+        if remove_relation(Subscription, user=user.id, author=id) is None:
+            get_object_or_404(User, id=id)
             return Response(
                 {"error": "Подписка не найдена"},
                 status=status.HTTP_400_BAD_REQUEST,
             )
-        subscription.delete()
+        invalidate_user_counts(user.id)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(
@@ -102,14 +205,18 @@ class UserViewSet(UserViewSet):
     )
     def avatar_update(self, request):
         user = request.user
+        old_avatar = user.avatar.name
+        field = User._meta.get_field("avatar")
         if request.method == "PUT":
             serializer = AvatarUpdateSerializer(user, data=request.data)
             serializer.is_valid(raise_exception=True)
             serializer.save()
+            if old_avatar != user.avatar.name:
+                cleanup_files(field, [old_avatar])
             return Response(serializer.data)
-        user.avatar.delete()
         user.avatar = None
         user.save()
+        cleanup_files(field, [old_avatar])
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(
@@ -119,10 +226,15 @@ class UserViewSet(UserViewSet):
         permission_classes=[IsAuthenticated],
     )
     def subscriptions(self, request):
-        authors = [sub.author for sub in request.user.subscriptions.all()]
+        fields = requested_fields(request, SubscriptionSerializer.Meta.fields)
+        authors = User.objects.filter(
+            subscribers__user=request.user
+        ).order_by("subscribers__created_at")
+        if fields is not None:
+            authors = authors.only("id", *(set(fields) & USER_MODEL_FIELDS))
         page = self.paginate_queryset(authors)
         serializer = SubscriptionSerializer(
-            page, many=True, context={"request": request}
+            page, many=True, context={"request": request}, fields=fields
         )
         if page:
             return self.get_paginated_response(serializer.data)
@@ -136,7 +248,8 @@ def recipe_list(request):
         if not request.user.is_authenticated:
             return Response(status=status.HTTP_401_UNAUTHORIZED)
         serializer = RecipeWriteSerializer(
-            data=request.data, context={"request": request}
+            data=request_payload(request, ("ingredients",)),
+            context={"request": request},
         )
         serializer.is_valid(raise_exception=True)
         recipe = serializer.save()
@@ -145,19 +258,47 @@ def recipe_list(request):
             status=status.HTTP_201_CREATED,
         )
 
-    recipes = Recipe.objects.all().order_by("-id")
+    ids = parse_ids(request)
+    if ids is not None:
+        requested = requested_fields(
+            request, RecipeReadSerializer.Meta.fields
+        )
+        fields = multi_get_fields(requested)
+        rows = recipe_rows(
+            Recipe.objects.filter(id__in=ids).order_by(), request.user, fields
+        )
+        data = render_recipes(rows, request, fields)
+        return Response(multi_get_response(ids, data, requested))
+
+    return Response(coalesce_request(request, lambda: recipe_page(request)))
+
+
+def recipe_page(request):
+    """Страница списка рецептов с учётом фильтров и сортировки запроса."""
+    recipes = apply_recipe_ordering(Recipe.objects.all(), request)
     recipes = apply_recipe_filters(recipes, request)
+    fields = requested_fields(request, RecipeReadSerializer.Meta.fields)
     paginator = CustomPagePagination()
-    page = paginator.paginate_queryset(recipes, request)
-    serializer = RecipeReadSerializer(
-        page, many=True, context={"request": request}
+    page = paginator.paginate_queryset(
+        recipe_rows(recipes, request.user, fields), request
     )
-    return paginator.get_paginated_response(serializer.data)
+    return paginator.get_paginated_response(
+        render_recipes(page, request, fields)
+    ).data
 
 
 @api_view(["GET", "PATCH", "DELETE"])
 @permission_classes([IsAuthenticatedOrReadOnly])
 def recipe_detail(request, id):
+    if request.method == "GET":
+        fields = requested_fields(request, RecipeReadSerializer.Meta.fields)
+        rows = recipe_rows(Recipe.objects.filter(id=id), request.user, fields)
+        data = coalesce_request(
+            request, lambda: render_recipes(rows, request, fields)
+        )
+        if not data:
+            raise Http404
+        return Response(data[0])
     recipe = get_object_or_404(Recipe, id=id)
     if request.method == "PATCH":
         if not request.user.is_authenticated:
@@ -166,7 +307,7 @@ def recipe_detail(request, id):
             return Response(status=status.HTTP_403_FORBIDDEN)
         serializer = RecipeWriteSerializer(
             recipe,
-            data=request.data,
+            data=request_payload(request, ("ingredients",)),
             partial=True,
             context={"request": request},
         )
@@ -178,10 +319,59 @@ def recipe_detail(request, id):
             return Response(status=status.HTTP_401_UNAUTHORIZED)
         if request.user != recipe.author:
             return Response(status=status.HTTP_403_FORBIDDEN)
+        if has_many_relations(recipe):
+            # Связей много: рецепт удалит воркер очереди задач, до тех пор
+            # он виден. Повторный DELETE не ставит вторую задачу.
+            enqueue(delete_recipe, unique=True, recipe_id=recipe.id)
+            return Response(status=status.HTTP_202_ACCEPTED)
+        image = recipe.image.name
+        # Состав снимается со статистики ингредиентов в pre_delete, в
+        # транзакции удаления (api/signals.py).
         recipe.delete()
+        cleanup_files(Recipe._meta.get_field("image"), [image])
         return Response(status=status.HTTP_204_NO_CONTENT)
-    serializer = RecipeReadSerializer(recipe, context={"request": request})
-    return Response(serializer.data)
+
+
+@api_view(["GET"])
+@permission_classes([AllowAny])
+def bootstrap(request):
+    """Всё, что нужно фронтенду при загрузке страницы, одним ответом."""
+    user = request.user
+    data = {"user": None, "recipes": recipe_page(request)}
+    if user.is_authenticated:
+        # На себя подписаться нельзя, отдельный запрос не нужен.
+        user.user_is_subscribed = False
+        data["user"] = UserProfileSerializer(
+            user, context={"request": request}
+        ).data
+        data.update(user_counts(user))
+    etag = quote_etag(
+        hashlib.md5(JSONRenderer().render(data)).hexdigest()
+    )
+    # Сжатый ответ отдаётся со слабым ETag, сравниваем без учёта W/.
+    if etag in [
+        tag.removeprefix("W/")
+        for tag in parse_etags(request.headers.get("If-None-Match", ""))
+    ]:
+        return Response(
+            status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag}
+        )
+    return Response(data, headers={"ETag": etag})
+
+
+@api_view(["GET"])
+@permission_classes([AdminOrMetricsToken])
+def metrics_view(request):
+    return HttpResponse(
+        metrics.render(), content_type="text/plain; version=0.0.4"
+    )
+
+
+@api_view(["POST"])
+@permission_classes([IsAuthenticated])
+def event_ticket(request):
+    """Билет для подключения EventSource к /api/events/?ticket=..."""
+    return Response({"ticket": make_ticket(request.user.id)})
 
 
 @api_view(["GET"])
@@ -247,46 +437,72 @@ def download_cart(request):
 @api_view(["POST", "DELETE"])
 @permission_classes([IsAuthenticated])
 def manage_shopping_cart(request, id):
-    recipe = get_object_or_404(Recipe, id=id)
     if request.method == "POST":
-        if request.user.shop_cart.filter(recipe=recipe).exists():
+        recipe = get_object_or_404(Recipe, id=id)
+        with transaction.atomic():
+            created_at = add_relation(
+                ShoppingCart, user=request.user.id, recipe=recipe.id
+            )
+            if created_at is not None:
+                record_event(recipe.id, created_at)
+                record_cart_change(recipe.id)
+        if created_at is None:
             return Response(
                 {"error": "Рецепт уже в корзине"},
                 status=status.HTTP_400_BAD_REQUEST,
             )
-        ShoppingCart.objects.create(user=request.user, recipe=recipe)
+        invalidate_user_counts(request.user.id)
         serializer = RecipeMiniSerializer(recipe, context={"request": request})
         return Response(serializer.data, status=status.HTTP_201_CREATED)
-    cart_item = request.user.shop_cart.filter(recipe=recipe)
-    if not cart_item.exists():
+    with transaction.atomic():
+        created_at = remove_relation(
+            ShoppingCart, user=request.user.id, recipe=id
+        )
+        if created_at is not None:
+            record_event(id, created_at, added=False)
+            record_cart_change(id, added=False)
+    if created_at is None:
+        get_object_or_404(Recipe, id=id)
         return Response(
             {"error": "Рецепт не в корзине"},
             status=status.HTTP_400_BAD_REQUEST,
         )
-    cart_item.delete()
+    invalidate_user_counts(request.user.id)
     return Response(status=status.HTTP_204_NO_CONTENT)
 
 
 @api_view(["POST", "DELETE"])
 @permission_classes([IsAuthenticated])
 def add_to_favorites(request, id):
-    recipe = get_object_or_404(Recipe, id=id)
     if request.method == "POST":
-        if request.user.favorites.filter(recipe=recipe).exists():
+        recipe = get_object_or_404(Recipe, id=id)
+        with transaction.atomic():
+            created_at = add_relation(
+                Favorite, user=request.user.id, recipe=recipe.id
+            )
+            if created_at is not None:
+                record_event(recipe.id, created_at)
+        if created_at is None:
             return Response(
                 {"error": "Рецепт уже в избранном"},
                 status=status.HTTP_400_BAD_REQUEST,
             )
-        Favorite.objects.create(user=request.user, recipe=recipe)
+        invalidate_user_counts(request.user.id)
         serializer = RecipeMiniSerializer(recipe, context={"request": request})
         return Response(serializer.data, status=status.HTTP_201_CREATED)
-    favorite = request.user.favorites.filter(recipe=recipe)
-    if not favorite.exists():
+    with transaction.atomic():
+        created_at = remove_relation(
+            Favorite, user=request.user.id, recipe=id
+        )
+        if created_at is not None:
+            record_event(id, created_at, added=False)
+    if created_at is None:
+        get_object_or_404(Recipe, id=id)
         return Response(
             {"error": "Рецепт не в избранном"},
             status=status.HTTP_400_BAD_REQUEST,
         )
-    favorite.delete()
+    invalidate_user_counts(request.user.id)
     return Response(status=status.HTTP_204_NO_CONTENT)
 
 
@@ -299,8 +515,29 @@ def ingredient_list(request):
         if name_query
         else Ingredients.objects.all()
     )
-    serializer = IngredientSerializer(ingredients, many=True)
-    return Response(serializer.data)
+    if request.query_params.get("ordering") == "popular":
+        ingredients = order_by_popularity(ingredients)
+    elif not name_query:
+        # Полный список меняется редко: он кешируется вместе со сжатыми
+        # вариантами.
+        return cached_list_response(
+            request, ingredient_list_key(), ingredients, IngredientSerializer
+        )
+    # Список не разбит на страницы: отдаём его по мере сериализации.
+    return streaming_list_response(request, ingredients, IngredientSerializer)
+
+
+def order_by_popularity(ingredients):
+    """Сначала самые частые в рецептах, затем остальные по алфавиту.
+
+    Сортирует база по JOIN с таблицей статистики.
+    """
+    used = Q(stats__recipes_count__gt=0)
+    return ingredients.order_by(
+        Case(When(used, then="stats__recipes_count")).desc(nulls_last=True),
+        Case(When(used, then="id")).desc(nulls_last=True),
+        "name",
+    )
 
 
 @api_view(["GET"])
@@ -308,3 +545,13 @@ def ingredient_detail(request, id):
     ingredient = get_object_or_404(Ingredients, id=id)
     serializer = IngredientSerializer(ingredient)
     return Response(serializer.data)
+
+
+@api_view(["GET"])
+@permission_classes([AllowAny])
+def ingredient_stats(request, id):
+    ingredient = get_object_or_404(
+        Ingredients.objects.select_related("stats"), id=id
+    )
+    serializer = IngredientStatsSerializer(ingredient)
+    return Response(serializer.data)
@@ -0,0 +1,389 @@
+"""Допуск запросов: лимиты одновременных запросов и скорости по уровням
+стоимости маршрутов, общие для всех воркеров gunicorn.
+
+Состояние лежит в файле, отображённом в память (по умолчанию в /dev/shm),
+и меняется под блокировкой flock. Каждый процесс записывает свои
+незавершённые запросы в собственный слот; слоты завершившихся процессов
+периодически освобождаются, чтобы убитый по таймауту воркер не занимал
+лимит навсегда.
+"""
+import fcntl
+import hashlib
+import ipaddress
+import math
+import mmap
+import os
+import tempfile
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import JsonResponse
+from rest_framework.permissions import SAFE_METHODS
+
+from foodgram import metrics
+
+MAX_WORKERS = 128
+ENTRIES_PER_WORKER = 16
+MAX_TIERS = 8
+USER_SLOTS = 4096
+# Сколько соседних слотов пробовать, если слот клиента занят другим.
+SLOT_PROBES = 4
+REAP_INTERVAL = 5.0
+
+# Раскладка целых (int64): pid слотов, записи о запросах (уровень + 1,
+# слот пользователя), число запросов по уровням и по пользователям,
+# владельцы слотов пользователей (хеш ключа клиента).
+PIDS = 0
+ENTRIES = PIDS + MAX_WORKERS
+TIER_IN_FLIGHT = ENTRIES + MAX_WORKERS * ENTRIES_PER_WORKER * 2
+USER_IN_FLIGHT = TIER_IN_FLIGHT + MAX_TIERS
+BUCKET_OWNERS = USER_IN_FLIGHT + USER_SLOTS
+INTS = BUCKET_OWNERS + USER_SLOTS
+# Раскладка вещественных (float64): время последней уборки, корзины
+# токенов уровней и пользователей (токены, время пополнения).
+LAST_REAP = 0
+TIER_BUCKETS = 1
+USER_BUCKETS = TIER_BUCKETS + MAX_TIERS * 2
+FLOATS = USER_BUCKETS + USER_SLOTS * 2
+SIZE = (INTS + FLOATS) * 8
+
+
+class Rejected(Exception):
+    def __init__(self, status, reason, retry_after):
+        self.status = status
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+def default_path():
+    directory = "/dev/shm" if os.path.isdir("/dev/shm") else None
+    return os.path.join(
+        directory or tempfile.gettempdir(), "foodgram-admission-v1"
+    )
+
+
+def refill(buckets, index, rate, burst, now):
+    tokens = buckets[index]
+    updated = buckets[index + 1]
+    tokens = min(burst, tokens + (now - updated) * rate)
+    buckets[index + 1] = now
+    if tokens >= 1:
+        buckets[index] = tokens - 1
+        return 0.0
+    buckets[index] = tokens
+    return (1 - tokens) / rate
+
+
+class SharedState:
+    def __init__(self, path):
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        self.thread_lock = threading.Lock()
+        with self.file_lock():
+            if os.fstat(self.fd).st_size < SIZE:
+                os.ftruncate(self.fd, SIZE)
+        self.memory = mmap.mmap(self.fd, SIZE)
+        self.ints = memoryview(self.memory)[: INTS * 8].cast("q")
+        self.floats = memoryview(self.memory)[INTS * 8:].cast("d")
+        self.slot = None
+        self.slot_pid = None
+
+    @contextmanager
+    def file_lock(self):
+        with self.thread_lock:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def own_slot(self):
+        """Слот текущего процесса; после fork процесс занимает новый."""
+        pid = os.getpid()
+        if self.slot_pid == pid:
+            return self.slot
+        ints = self.ints
+        free = None
+        for slot in range(MAX_WORKERS):
+            if ints[PIDS + slot] == pid:
+                free = slot
+                break
+            if free is None and not process_alive(ints[PIDS + slot]):
+                free = slot
+        if free is None:
+            return None
+        self.release_slot(free)
+        ints[PIDS + free] = pid
+        self.slot, self.slot_pid = free, pid
+        return free
+
+    def release_slot(self, slot):
+        """Снимает со счётчиков запросы, оставшиеся в слоте."""
+        ints = self.ints
+        for entry in range(ENTRIES_PER_WORKER):
+            base = ENTRIES + (slot * ENTRIES_PER_WORKER + entry) * 2
+            if ints[base]:
+                ints[TIER_IN_FLIGHT + ints[base] - 1] -= 1
+                ints[USER_IN_FLIGHT + ints[base + 1]] -= 1
+                ints[base] = 0
+        ints[PIDS + slot] = 0
+
+    def reap(self, now):
+        if now - self.floats[LAST_REAP] < REAP_INTERVAL:
+            return
+        self.floats[LAST_REAP] = now
+        for slot in range(MAX_WORKERS):
+            pid = self.ints[PIDS + slot]
+            if pid and not process_alive(pid):
+                self.release_slot(slot)
+
+    def user_slot(self, user_hash, tier, now):
+        """Слот клиента: его собственный или свободный из SLOT_PROBES
+        соседних.
+
+        Чужой слот считается свободным, только когда у владельца нет
+        запросов и его корзина успела наполниться, то есть сброс ничего
+        у него не отнимает. Если свободных нет, клиент делит первый слот
+        с его владельцем: лимит становится строже, но не сбрасывается.
+        """
+        ints, floats = self.ints, self.floats
+        first = user_hash % USER_SLOTS
+        for probe in range(SLOT_PROBES):
+            slot = (first + probe) % USER_SLOTS
+            if ints[BUCKET_OWNERS + slot] == user_hash:
+                return slot
+        for probe in range(SLOT_PROBES):
+            slot = (first + probe) % USER_SLOTS
+            bucket = USER_BUCKETS + slot * 2
+            elapsed = now - floats[bucket + 1]
+            tokens = floats[bucket] + elapsed * tier["user_rate"]
+            if (
+                ints[USER_IN_FLIGHT + slot] == 0
+                and tokens >= tier["user_burst"]
+            ):
+                ints[BUCKET_OWNERS + slot] = user_hash
+                floats[bucket] = tier["user_burst"]
+                floats[bucket + 1] = now
+                return slot
+        return first
+
+    def acquire(self, tier_index, tier, user_key):
+        """Занимает место под запрос или выбрасывает Rejected.
+
+        Возвращает запись, которую нужно передать в release().
+        """
+        # 0 означает свободный слот.
+        user_hash = zlib.crc32(f"{tier_index}:{user_key}".encode()) or 1
+        ints, floats = self.ints, self.floats
+        with self.file_lock():
+            now = time.time()
+            self.reap(now)
+            user_slot = self.user_slot(user_hash, tier, now)
+            if ints[USER_IN_FLIGHT + user_slot] >= tier["user_concurrency"]:
+                raise Rejected(429, "user_concurrency", 1)
+            if ints[TIER_IN_FLIGHT + tier_index] >= tier["concurrency"]:
+                raise Rejected(503, "concurrency", 1)
+            bucket = USER_BUCKETS + user_slot * 2
+            wait = refill(
+                floats, bucket, tier["user_rate"], tier["user_burst"], now
+            )
+            if wait:
+                raise Rejected(429, "user_rate", wait)
+            wait = refill(
+                floats,
+                TIER_BUCKETS + tier_index * 2,
+                tier["rate"],
+                tier["burst"],
+                now,
+            )
+            if wait:
+                # Токен пользователя уже списан: возвращаем его.
+                floats[bucket] += 1
+                raise Rejected(503, "rate", wait)
+            ints[TIER_IN_FLIGHT + tier_index] += 1
+            ints[USER_IN_FLIGHT + user_slot] += 1
+            slot = self.own_slot()
+            if slot is None:
+                return None, tier_index, user_slot
+            for entry in range(ENTRIES_PER_WORKER):
+                base = ENTRIES + (slot * ENTRIES_PER_WORKER + entry) * 2
+                if not ints[base]:
+                    ints[base] = tier_index + 1
+                    ints[base + 1] = user_slot
+                    return base, tier_index, user_slot
+            return None, tier_index, user_slot
+
+    def release(self, handle):
+        base, tier_index, user_slot = handle
+        ints = self.ints
+        with self.file_lock():
+            if base is not None:
+                if not ints[base]:
+                    # Запись уже сняли при уборке слота.
+                    return
+                ints[base] = 0
+            ints[TIER_IN_FLIGHT + tier_index] = max(
+                ints[TIER_IN_FLIGHT + tier_index] - 1, 0
+            )
+            ints[USER_IN_FLIGHT + user_slot] = max(
+                ints[USER_IN_FLIGHT + user_slot] - 1, 0
+            )
+
+    def in_flight(self, tier_index):
+        return self.ints[TIER_IN_FLIGHT + tier_index]
+
+
+def process_alive(pid):
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+_state = None
+
+
+def shared_state():
+    global _state
+    if _state is None:
+        _state = SharedState(settings.ADMISSION_SHM_PATH or default_path())
+    return _state
+
+
+@metrics.register_gauge
+def tier_gauges():
+    if _state is None:
+        return []
+    return [
+        (f'admission_in_flight{{tier="{name}"}}', _state.in_flight(index))
+        for index, name in enumerate(settings.ADMISSION_TIERS)
+    ]
+
+
+def route_tier(request, url_name):
+    if request.method not in SAFE_METHODS:
+        tier = settings.ADMISSION_WRITE_TIERS.get(url_name)
+        if tier:
+            return tier
+    return settings.ADMISSION_ROUTE_TIERS.get(
+        url_name, settings.ADMISSION_DEFAULT_TIER
+    )
+
+
+def token_user_id(key):
+    """id владельца действующего токена или None.
+
+    Найденные токены кешируются на ADMISSION_TOKEN_CACHE_SECONDS;
+    неизвестный токен каждый раз проверяется запросом по первичному
+    ключу и в кеш не попадает.
+    """
+    from rest_framework.authtoken.models import Token
+
+    cache_key = f"admission-token:{hashlib.sha256(key.encode()).hexdigest()}"
+    user_id = cache.get(cache_key)
+    if user_id is None:
+        user_id = (
+            Token.objects.filter(key=key, user__is_active=True)
+            .values_list("user_id", flat=True)
+            .first()
+        )
+        if user_id is not None:
+            cache.set(
+                cache_key, user_id, settings.ADMISSION_TOKEN_CACHE_SECONDS
+            )
+    return user_id
+
+
+def authorization_user_id(request):
+    """id пользователя по токену из заголовка Authorization до
+    аутентификации DRF или None."""
+    scheme, _, key = request.headers.get("Authorization", "").partition(" ")
+    key = key.strip()
+    if scheme == "Token" and key:
+        return token_user_id(key)
+    return None
+
+
+def trusted_proxy(address):
+    """Пришёл ли запрос от прокси из ADMISSION_TRUSTED_PROXIES."""
+    try:
+        address = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(
+        address in ipaddress.ip_network(network.strip(), strict=False)
+        for network in settings.ADMISSION_TRUSTED_PROXIES
+    )
+
+
+def client_key(request):
+    """Кто делает запрос: пользователь действующего токена или IP-адрес.
+
+    Запросы с неизвестным токеном считаются по IP-адресу, чтобы новый
+    выдуманный токен не давал новый лимит. X-Real-IP учитывается только
+    от доверенного прокси: иначе клиент выбирал бы себе адрес сам.
+    """
+    user_id = authorization_user_id(request)
+    if user_id is not None:
+        return f"user:{user_id}"
+    address = request.META.get("REMOTE_ADDR", "")
+    if trusted_proxy(address):
+        address = request.headers.get("X-Real-IP") or address
+    return f"ip:{address}"
+
+
+class AdmissionControlMiddleware:
+    """Быстро отклоняет запросы сверх лимитов уровня стоимости маршрута.
+
+    Уровень берётся по имени маршрута из api/urls.py. 429 — превышен
+    лимит пользователя, 503 — лимит уровня; в обоих случаях с
+    Retry-After. Очереди нет: лишний запрос не занимает воркер.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.admission = None
+        try:
+            return self.get_response(request)
+        finally:
+            if request.admission is not None:
+                shared_state().release(request.admission)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        url_name = request.resolver_match.url_name
+        if (
+            not settings.ADMISSION_CONTROL
+            or not request.path.startswith("/api/")
+            or url_name in settings.ADMISSION_EXEMPT_VIEWS
+        ):
+            return None
+        tier_name = route_tier(request, url_name)
+        tier_index = list(settings.ADMISSION_TIERS).index(tier_name)
+        try:
+            request.admission = shared_state().acquire(
+                tier_index,
+                settings.ADMISSION_TIERS[tier_name],
+                client_key(request),
+            )
+        except Rejected as error:
+            metrics.increment(
+                "admission_rejected_total", tier=tier_name, reason=error.reason
+            )
+            response = JsonResponse(
+                {"detail": "Сервер перегружен, повторите запрос позже."},
+                status=error.status,
+                json_dumps_params={"ensure_ascii": False},
+            )
+            response["Retry-After"] = str(error.retry_after)
+            return response
+        return None
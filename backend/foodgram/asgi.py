@@ -13,4 +13,8 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "foodgram.settings")
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from foodgram.sse import with_events  # noqa: E402
+
+application = with_events(django_application)
@@ -0,0 +1,168 @@
+"""Заранее сжатые варианты кешируемых ответов.
+
+Варианты gzip и br считаются один раз, когда ответ попадает в кеш, и
+хранятся вместе с ним; при отдаче вариант выбирается по Accept-Encoding.
+Сжатие оплачивается один раз на версию ответа, а не на каждый запрос.
+Ответы, зависящие от пользователя, одинаковыми почти не бывают: они
+сжимаются быстрым gzip без кеша.
+"""
+import gzip
+import hashlib
+import re
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import patch_vary_headers
+
+from foodgram import metrics
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Кодировки в порядке предпочтения при равном q.
+ENCODERS = {}
+if brotli is not None:
+    ENCODERS["br"] = lambda body: brotli.compress(
+        body, quality=settings.BROTLI_QUALITY
+    )
+ENCODERS["gzip"] = lambda body: gzip.compress(body, compresslevel=9, mtime=0)
+FAST_ENCODERS = {
+    "gzip": lambda body: gzip.compress(
+        body, compresslevel=settings.GZIP_FAST_LEVEL, mtime=0
+    )
+}
+
+
+def compress(body, encoders=None):
+    """Сжатые варианты тела: {кодировка: (данные, секунды процессора)}.
+
+    Варианты, которые не меньше исходного тела, не сохраняются.
+    """
+    variants = {}
+    if len(body) < settings.COMPRESSION_MIN_SIZE:
+        return variants
+    for encoding, encode in (encoders or ENCODERS).items():
+        start = time.thread_time()
+        data = encode(body)
+        spent = time.thread_time() - start
+        metrics.increment_seconds(
+            "compression_cpu_seconds_total", spent, encoding=encoding
+        )
+        if len(data) < len(body):
+            variants[encoding] = (data, spent)
+    return variants
+
+
+def cached_variants(body):
+    """Сжатые варианты тела из кеша по хешу содержимого.
+
+    Возвращает пару (варианты, взяты ли они из кеша).
+    """
+    key = f"compressed:{hashlib.sha256(body).hexdigest()}"
+    variants = cache.get(key)
+    if variants is not None:
+        return variants, True
+    variants = compress(body)
+    cache.set(key, variants, settings.COMPRESSED_TIMEOUT)
+    return variants, False
+
+
+def accepted_encodings(request):
+    """Кодировки из Accept-Encoding с их q."""
+    accepted = {}
+    for item in request.headers.get("Accept-Encoding", "").split(","):
+        encoding, _, params = item.strip().partition(";")
+        quality = 1.0
+        match = re.search(r"q=([0-9.]+)", params)
+        if match:
+            try:
+                quality = float(match.group(1))
+            except ValueError:
+                quality = 0.0
+        if encoding:
+            accepted[encoding.strip().lower()] = quality
+    return accepted
+
+
+def choose_encoding(request, variants):
+    accepted = accepted_encodings(request)
+    best, best_quality = None, 0.0
+    for encoding in ENCODERS:
+        quality = accepted.get(encoding, accepted.get("*", 0.0))
+        if encoding in variants and quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def apply_variant(request, response, body, variants, cached):
+    """Подставляет в ответ вариант тела, подходящий клиенту.
+
+    cached — варианты взяты из кеша, то есть сжатие в этом запросе не
+    понадобилось.
+    """
+    patch_vary_headers(response, ("Accept-Encoding",))
+    encoding = choose_encoding(request, variants)
+    if encoding is None:
+        return response
+    data, spent = variants[encoding]
+    response.content = data
+    response["Content-Encoding"] = encoding
+    response["Content-Length"] = str(len(data))
+    if response.has_header("ETag"):
+        # Как в GZipMiddleware: сжатое тело отличается побайтно.
+        response["ETag"] = re.sub(r'^"', 'W/"', response["ETag"])
+    metrics.increment(
+        "compression_bytes_saved_total",
+        len(body) - len(data),
+        encoding=encoding,
+    )
+    if cached:
+        metrics.increment_seconds(
+            "compression_cpu_saved_seconds_total", spent, encoding=encoding
+        )
+    return response
+
+
+def is_public(request, response):
+    """Ответ одинаков для всех, кто делает такой же запрос."""
+    user = getattr(request, "user", None)
+    return not (
+        "Authorization" in request.headers
+        or (user is not None and user.is_authenticated)
+        or "private" in response.get("Cache-Control", "")
+    )
+
+
+class PrecompressedMiddleware:
+    """Сжимает ответы маршрутов из COMPRESSED_VIEWS.
+
+    Сжатые варианты общих ответов кешируются по хешу тела, поэтому
+    одинаковые ответы, например одна и та же страница рецептов у
+    анонимных пользователей, сжимаются один раз.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        match = request.resolver_match
+        if (
+            match is None
+            or match.url_name not in settings.COMPRESSED_VIEWS
+            or response.streaming
+            or response.status_code != 200
+            or response.has_header("Content-Encoding")
+        ):
+            return response
+        body = response.content
+        if len(body) < settings.COMPRESSION_MIN_SIZE:
+            return apply_variant(request, response, body, {}, False)
+        if is_public(request, response):
+            variants, cached = cached_variants(body)
+        else:
+            variants, cached = compress(body, FAST_ENCODERS), False
+        return apply_variant(request, response, body, variants, cached)
@@ -0,0 +1,106 @@
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.permissions import SAFE_METHODS
+
+from foodgram.admission import authorization_user_id
+
+PRIMARY_DB = "default"
+
+# Реплика, выбранная для текущего запроса: все чтения запроса идут в
+# одну и ту же базу и видят один момент репликации.
+replica_alias = ContextVar("replica_alias", default=None)
+
+
+class PrimaryReplicaRouter:
+    """Запись и миграции — в основную БД, чтение — с реплик.
+
+    Реплики используются только внутри запросов, разрешённых
+    ReplicaRoutingMiddleware; management-команды (load_database, migrate)
+    и все остальные запросы работают с основной БД.
+    """
+
+    def db_for_read(self, model, **hints):
+        return replica_alias.get() or PRIMARY_DB
+
+    def db_for_write(self, model, **hints):
+        return PRIMARY_DB
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == PRIMARY_DB
+
+
+def sticky_key(user_id):
+    return f"replica-sticky:{user_id}"
+
+
+def request_user_id(request):
+    user = getattr(request, "user", None)
+    if user is not None and user.is_authenticated:
+        return user.pk
+    return authorization_user_id(request)
+
+
+class ReplicaRoutingMiddleware:
+    """Включает чтение с реплик для GET-эндпоинтов из REPLICA_READ_VIEWS.
+
+    После успешной записи клиент на время REPLICA_STICKY_SECONDS читает
+    основную БД, чтобы сразу видеть свои изменения. Клиента узнают по
+    cookie, а пользователя — и без неё, по записи в кеше: клиенты API
+    с токеном обычно не хранят cookie. Для пользователей, пишущих через
+    разные воркеры, запись видна везде только с общим кешем (memcached,
+    Redis).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.replica_token = None
+        try:
+            response = self.get_response(request)
+        finally:
+            if request.replica_token is not None:
+                replica_alias.reset(request.replica_token)
+        if (
+            request.method not in SAFE_METHODS
+            and response.status_code < 400
+            and settings.DATABASE_REPLICAS
+        ):
+            response.set_cookie(
+                settings.REPLICA_STICKY_COOKIE,
+                "1",
+                max_age=settings.REPLICA_STICKY_SECONDS,
+                httponly=True,
+                samesite="Lax",
+            )
+            # DRF уже записал в request.user пользователя токена.
+            user = getattr(request, "user", None)
+            if user is not None and user.is_authenticated:
+                cache.set(
+                    sticky_key(user.pk), True, settings.REPLICA_STICKY_SECONDS
+                )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if (
+            settings.DATABASE_REPLICAS
+            and request.method in SAFE_METHODS
+            and request.resolver_match.url_name in settings.REPLICA_READ_VIEWS
+            and settings.REPLICA_STICKY_COOKIE not in request.COOKIES
+            and not self.user_is_sticky(request)
+        ):
+            request.replica_token = replica_alias.set(
+                random.choice(settings.DATABASE_REPLICAS)
+            )
+
+    def user_is_sticky(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return False
+        user_id = request_user_id(request)
+        return user_id is not None and cache.get(sticky_key(user_id), False)
@@ -0,0 +1,206 @@
+import asyncio
+import json
+import logging
+import threading
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+CLOSE = None
+
+
+class Event:
+    """Событие о новом рецепте, уже закодированное в формат SSE.
+
+    Кодируется один раз и разделяется всеми подписчиками.
+    """
+
+    __slots__ = ("id", "author_id", "payload")
+
+    def __init__(self, recipe_id, author_id, name):
+        self.id = recipe_id
+        self.author_id = author_id
+        data = json.dumps(
+            {"id": recipe_id, "author": author_id, "name": name},
+            ensure_ascii=False,
+            separators=(",", ":"),
+        )
+        self.payload = (
+            f"id: {recipe_id}\nevent: recipe\ndata: {data}\n\n"
+        ).encode()
+
+
+class Listener:
+    """Очередь событий одного соединения ограниченного размера.
+
+    При переполнении соединение закрывается: клиент переподключится
+    с Last-Event-ID и дочитает пропущенное из базы.
+    """
+
+    __slots__ = ("author_ids", "loop", "queue", "overflowed")
+
+    def __init__(self, author_ids, loop):
+        self.author_ids = author_ids
+        self.loop = loop
+        self.queue = asyncio.Queue(settings.SSE_QUEUE_SIZE + 1)
+        self.overflowed = False
+
+    def put(self, event):
+        if self.overflowed:
+            return
+        if self.queue.qsize() >= settings.SSE_QUEUE_SIZE:
+            self.overflowed = True
+            event = CLOSE
+        self.queue.put_nowait(event)
+
+    def close(self):
+        try:
+            self.queue.put_nowait(CLOSE)
+        except asyncio.QueueFull:
+            pass
+
+    async def get(self):
+        return await self.queue.get()
+
+
+class InProcessBroker:
+    """Рассылка событий соединениям внутри текущего процесса."""
+
+    def __init__(self):
+        self.listeners = defaultdict(set)
+        self.lock = threading.Lock()
+
+    def subscribe(self, author_ids):
+        listener = Listener(frozenset(author_ids), asyncio.get_running_loop())
+        with self.lock:
+            for author_id in listener.author_ids:
+                self.listeners[author_id].add(listener)
+        return listener
+
+    def unsubscribe(self, listener):
+        with self.lock:
+            for author_id in listener.author_ids:
+                listeners = self.listeners.get(author_id)
+                if listeners is None:
+                    continue
+                listeners.discard(listener)
+                if not listeners:
+                    del self.listeners[author_id]
+
+    def publish(self, event):
+        """Можно вызывать из любого потока."""
+        with self.lock:
+            listeners = list(self.listeners.get(event.author_id, ()))
+        for listener in listeners:
+            listener.loop.call_soon_threadsafe(listener.put, event)
+
+
+class PollingBroker(InProcessBroker):
+    """Брокер, который сам находит новые рецепты в базе.
+
+    Нужен, когда рецепты создаются в другом процессе (например,
+    в WSGI-воркерах gunicorn): один запрос раз в SSE_POLL_INTERVAL секунд
+    на процесс вместо опроса API каждым клиентом.
+
+    id выдаются до фиксации транзакции, и рецепт с меньшим id может
+    появиться позже рецепта с большим. Поэтому каждый опрос перечитывает
+    последние SSE_POLL_LOOKBACK id, а уже разосланные отсекаются по seen.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.last_id = None
+        self.seen = set()
+        self.poller = None
+
+    def subscribe(self, author_ids):
+        listener = super().subscribe(author_ids)
+        if self.poller is None or self.poller.done():
+            self.poller = asyncio.get_running_loop().create_task(self.poll())
+        return listener
+
+    async def poll(self):
+        # После простоя опрос начинается с текущего конца таблицы, а не
+        # с прошлого last_id: пропущенное соединения дочитывают сами по
+        # Last-Event-ID.
+        self.last_id = None
+        failures = 0
+        while self.listeners:
+            try:
+                recipes = await sync_to_async(self.fetch)()
+            except Exception:
+                failures = min(failures + 1, 10)
+                logger.exception("Не удалось получить новые рецепты")
+            else:
+                failures = 0
+                for recipe in recipes:
+                    self.publish(Event(*recipe))
+            await asyncio.sleep(
+                min(
+                    settings.SSE_POLL_INTERVAL * 2**failures,
+                    settings.SSE_POLL_MAX_BACKOFF,
+                )
+            )
+
+    def fetch(self):
+        """Ещё не разосланные рецепты из окна перед last_id и после него,
+        не больше SSE_POLL_LIMIT.
+
+        Первый вызов только запоминает текущий конец таблицы. Соединения
+        закрываются по CONN_MAX_AGE и после ошибок, как в цикле запроса
+        Django, который здесь не работает.
+        """
+        from recipes.models import Recipe
+
+        close_old_connections()
+        try:
+            if self.last_id is None:
+                self.last_id = Recipe.objects.order_by("-id").values_list(
+                    "id", flat=True
+                ).first() or 0
+                self.seen = set(
+                    Recipe.objects.filter(
+                        id__gt=self.last_id - settings.SSE_POLL_LOOKBACK
+                    ).values_list("id", flat=True)
+                )
+                return []
+            recipes = Recipe.objects.filter(
+                id__gt=self.last_id - settings.SSE_POLL_LOOKBACK
+            ).order_by("id").values_list("id", "author_id", "name")
+            # В окне не больше SSE_POLL_LOOKBACK уже разосланных рецептов.
+            recipes = [
+                recipe
+                for recipe in recipes[
+                    : settings.SSE_POLL_LIMIT + settings.SSE_POLL_LOOKBACK
+                ]
+                if recipe[0] not in self.seen
+            ][: settings.SSE_POLL_LIMIT]
+            for recipe in recipes:
+                self.seen.add(recipe[0])
+                self.last_id = max(self.last_id, recipe[0])
+            floor = self.last_id - settings.SSE_POLL_LOOKBACK
+            self.seen = {
+                recipe_id for recipe_id in self.seen if recipe_id > floor
+            }
+            return recipes
+        finally:
+            close_old_connections()
+
+
+_broker = None
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        _broker = import_string(settings.EVENT_BROKER)()
+    return _broker
+
+
+def publish_recipe(recipe):
+    get_broker().publish(Event(recipe.id, recipe.author_id, recipe.name))
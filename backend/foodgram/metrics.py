@@ -0,0 +1,74 @@
+"""Счётчики и показатели приложения в текстовом формате Prometheus.
+
+Счётчики хранятся в кеше Django и общие для всех воркеров, если кеш
+общий (memcached, Redis); с LocMemCache каждый процесс считает своё.
+Мгновенные значения (gauge) вычисляются при каждом запросе метрик
+функциями, зарегистрированными через register_gauge.
+"""
+from django.core.cache import cache
+
+KEY_PREFIX = "metrics:"
+INDEX_KEY = f"{KEY_PREFIX}index"
+# Суммы длительностей хранятся целыми микросекундами: incr в кешах
+# работает только с целыми.
+MICROSECONDS = 1_000_000
+
+gauges = []
+
+
+def metric_key(name, labels):
+    label_text = ",".join(
+        f'{label}="{value}"' for label, value in sorted(labels.items())
+    )
+    return f"{name}{{{label_text}}}" if label_text else name
+
+
+def increment(name, value=1, **labels):
+    key = metric_key(name, labels)
+    cache_key = f"{KEY_PREFIX}{key}"
+    try:
+        cache.incr(cache_key, value)
+    except ValueError:
+        if not cache.add(cache_key, value, None):
+            cache.incr(cache_key, value)
+            return
+        index = cache.get(INDEX_KEY, set())
+        index.add(key)
+        cache.set(INDEX_KEY, index, None)
+
+
+def increment_seconds(name, seconds, **labels):
+    """Счётчик секунд; хранится в микросекундах под name_microseconds."""
+    increment(
+        f"{name}_microseconds", round(seconds * MICROSECONDS), **labels
+    )
+
+
+def observe(name, seconds, **labels):
+    """Учитывает длительность: name_count и name_sum в секундах."""
+    increment(f"{name}_count", **labels)
+    increment_seconds(f"{name}_sum", seconds, **labels)
+
+
+def register_gauge(collect):
+    """collect() возвращает пары (имя с метками, значение)."""
+    gauges.append(collect)
+    return collect
+
+
+def render():
+    lines = []
+    keys = sorted(cache.get(INDEX_KEY, set()))
+    values = cache.get_many([f"{KEY_PREFIX}{key}" for key in keys])
+    for key in keys:
+        value = values.get(f"{KEY_PREFIX}{key}")
+        if value is None:
+            continue
+        if "_microseconds" in key:
+            key = key.replace("_microseconds", "")
+            value = value / MICROSECONDS
+        lines.append(f"{key} {value}")
+    for collect in gauges:
+        for key, value in collect():
+            lines.append(f"{key} {value}")
+    return "\n".join(lines) + "\n"
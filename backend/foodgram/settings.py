@@ -50,12 +50,15 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    "foodgram.compression.PrecompressedMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "foodgram.db_router.ReplicaRoutingMiddleware",
+    "foodgram.admission.AdmissionControlMiddleware",
 ]
 
 ROOT_URLCONF = "foodgram.urls"
@@ -83,17 +86,237 @@ WSGI_APPLICATION = "foodgram.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
+DB_ENGINE = os.getenv("DB_ENGINE", "django.db.backends.postgresql")
+
+if DB_ENGINE == "django.db.backends.sqlite3":
+    DATABASES = {
+        "default": {
+            "ENGINE": DB_ENGINE,
+            "NAME": BASE_DIR / "db.sqlite3",
+        }
+    }
+else:
+    DATABASES = {
+        "default": {
+            "ENGINE": DB_ENGINE,
+            "NAME": os.getenv("POSTGRES_DB", "db_foodgram"),
+            "USER": os.getenv("POSTGRES_USER", "user_postgres"),
+            "PASSWORD": os.getenv("POSTGRES_PASSWORD", "postgres"),
+            "HOST": os.getenv("DB_HOST", "db"),
+            "PORT": os.getenv("DB_PORT", 5432),
+            # Постоянные соединения: воркер gunicorn открывает их при
+            # прогреве и не платит за подключение в каждом запросе.
+            "CONN_MAX_AGE": int(os.getenv("DB_CONN_MAX_AGE", 60)),
+            "CONN_HEALTH_CHECKS": True,
+        }
+    }
+
+# Реплики для чтения: хосты PostgreSQL или, при DB_ENGINE=sqlite3,
+# имена файлов баз данных рядом с manage.py.
+DATABASE_REPLICAS = []
+for index, replica in enumerate(
+    filter(None, os.getenv("DB_REPLICAS", "").split(",")), start=1
+):
+    alias = f"replica_{index}"
+    if DB_ENGINE == "django.db.backends.sqlite3":
+        replica_settings = {"NAME": BASE_DIR / replica.strip()}
+    else:
+        replica_settings = {"HOST": replica.strip()}
+    DATABASES[alias] = {
+        **DATABASES["default"],
+        **replica_settings,
+        "TEST": {"MIRROR": "default"},
+    }
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ["foodgram.db_router.PrimaryReplicaRouter"]
+
+# URL-имена GET-эндпоинтов, которые можно читать с реплик.
+REPLICA_READ_VIEWS = (
+    "recipe-list",
+    "recipe-detail",
+    "ingredient-list",
+    "ingredient-detail",
+    "ingredient-stats",
+    "users-list",
+    "users-detail",
+    "users-subscriptions",
+    "bootstrap",
+)
+# Сколько секунд после записи читать пользователю только с основной БД.
+REPLICA_STICKY_SECONDS = int(os.getenv("REPLICA_STICKY_SECONDS", 5))
+REPLICA_STICKY_COOKIE = "use_primary_db"
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# В production нужен кеш, общий для всех воркеров gunicorn
+# (например, django.core.cache.backends.memcached.PyMemcacheCache).
+
+CACHES = {
     "default": {
-        "ENGINE": "django.db.backends.postgresql",
-        "NAME": os.getenv("POSTGRES_DB", "db_foodgram"),
-        "USER": os.getenv("POSTGRES_USER", "user_postgres"),
-        "PASSWORD": os.getenv("POSTGRES_PASSWORD", "postgres"),
-        "HOST": os.getenv("DB_HOST", "db"),
-        "PORT": os.getenv("DB_PORT", 5432),
+        "BACKEND": os.getenv(
+            "CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"
+        ),
+        "LOCATION": os.getenv("CACHE_LOCATION", ""),
     }
 }
 
+# Время жизни закешированных фрагментов рецептов, секунды.
+RECIPE_FRAGMENT_TIMEOUT = int(os.getenv("RECIPE_FRAGMENT_TIMEOUT", 86400))
+# Время жизни закешированных счётчиков избранного, корзины и подписок.
+USER_COUNTS_TIMEOUT = int(os.getenv("USER_COUNTS_TIMEOUT", 300))
+
+# Размер пакета при удалении связей рецептов и пользователей и число
+# связей, начиная с которого рецепт удаляется пакетами.
+PURGE_BATCH_SIZE = int(os.getenv("PURGE_BATCH_SIZE", 1000))
+PURGE_RELATIONS_THRESHOLD = int(os.getenv("PURGE_RELATIONS_THRESHOLD", 5000))
+
+# Прогрев воркеров gunicorn (foodgram/warmup.py): запросы, которые воркер
+# выполняет сам себе до приёма трафика, и сериализаторы, поля которых
+# строятся заранее.
+WARMUP_URLS = tuple(
+    filter(
+        None,
+        os.getenv(
+            "WARMUP_URLS",
+            "/api/recipes/?page=1&limit=6,/api/ingredients/?name=%D0%B0,"
+            "/api/bootstrap/",
+        ).split(","),
+    )
+)
+WARMUP_SERIALIZERS = (
+    "api.serializers.RecipeReadSerializer",
+    "api.serializers.RecipeWriteSerializer",
+    "api.serializers.SubscriptionSerializer",
+    "api.serializers.IngredientSerializer",
+)
+
+# Сжатые варианты ответов (foodgram/compression.py): маршруты, ответы
+# которых сжимаются с кешированием вариантов по хешу тела, минимальный
+# размер тела для сжатия, время жизни вариантов в кеше и наибольший
+# размер полного списка ингредиентов, который кешируется целиком.
+# Качество brotli 11 сжимает лучше, но в десятки раз медленнее 9.
+# Ответы авторизованным пользователям сжимаются без кеша быстрым gzip
+# уровня GZIP_FAST_LEVEL.
+COMPRESSED_VIEWS = ("recipe-list", "bootstrap", "users-subscriptions")
+COMPRESSION_MIN_SIZE = 1024
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", 9))
+GZIP_FAST_LEVEL = int(os.getenv("GZIP_FAST_LEVEL", 1))
+COMPRESSED_TIMEOUT = int(os.getenv("COMPRESSED_TIMEOUT", 3600))
+COMPRESSED_CACHE_MAX_SIZE = int(
+    os.getenv("COMPRESSED_CACHE_MAX_SIZE", 1024 * 1024)
+)
+
+# Объединение одинаковых одновременных вычислений (foodgram/singleflight.py):
+# сколько ждать чужого результата, прежде чем считать самому, время жизни
+# блокировки и результата в кеше, период опроса кеша другими воркерами, с.
+SINGLE_FLIGHT_TIMEOUT = float(os.getenv("SINGLE_FLIGHT_TIMEOUT", 2))
+SINGLE_FLIGHT_LOCK_TTL = 5
+SINGLE_FLIGHT_RESULT_TTL = 2
+SINGLE_FLIGHT_POLL_INTERVAL = 0.02
+
+# Очередь фоновых задач (recipes/queue.py, команда run_worker): число
+# попыток, задержка первого повтора и её предел (удваивается с каждой
+# попыткой), время аренды задачи воркером и период опроса очереди, с.
+# TASK_ALWAYS_EAGER выполняет задачи сразу после фиксации транзакции,
+# без воркера.
+TASK_MAX_ATTEMPTS = int(os.getenv("TASK_MAX_ATTEMPTS", 5))
+TASK_RETRY_DELAY = float(os.getenv("TASK_RETRY_DELAY", 10))
+TASK_RETRY_MAX_DELAY = float(os.getenv("TASK_RETRY_MAX_DELAY", 3600))
+TASK_LEASE_SECONDS = int(os.getenv("TASK_LEASE_SECONDS", 600))
+TASK_POLL_INTERVAL = float(os.getenv("TASK_POLL_INTERVAL", 1))
+TASK_ALWAYS_EAGER = os.getenv("TASK_ALWAYS_EAGER", "False") == "True"
+
+# Поток событий /api/events/ (ASGI). PollingBroker сам находит новые
+# рецепты в базе и подходит, когда рецепты создаются в WSGI-процессах;
+# InProcessBroker получает события только из текущего процесса.
+EVENT_BROKER = os.getenv("EVENT_BROKER", "foodgram.events.PollingBroker")
+SSE_POLL_INTERVAL = float(os.getenv("SSE_POLL_INTERVAL", 2))
+# Сколько новых рецептов PollingBroker читает за один опрос и до какой
+# паузы увеличивает интервал, пока база недоступна.
+SSE_POLL_LIMIT = int(os.getenv("SSE_POLL_LIMIT", 500))
+# На сколько id назад перечитывать: рецепт, транзакция которого
+# зафиксирована позже соседних, всё равно будет разослан.
+SSE_POLL_LOOKBACK = int(os.getenv("SSE_POLL_LOOKBACK", 100))
+SSE_POLL_MAX_BACKOFF = float(os.getenv("SSE_POLL_MAX_BACKOFF", 60))
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", 15))
+SSE_RETRY_MS = 5000
+# Сколько секунд действует билет из /api/event-ticket/ для подключения
+# EventSource, который не умеет передавать заголовок Authorization.
+SSE_TICKET_SECONDS = int(os.getenv("SSE_TICKET_SECONDS", 60))
+# Сколько неотправленных событий держать на соединение и сколько
+# пропущенных досылать по Last-Event-ID за одно подключение.
+SSE_QUEUE_SIZE = int(os.getenv("SSE_QUEUE_SIZE", 100))
+SSE_REPLAY_LIMIT = int(os.getenv("SSE_REPLAY_LIMIT", 100))
+
+# Допуск запросов к API по уровням стоимости маршрутов. Лимиты общие
+# для всех воркеров: concurrency — одновременных запросов уровня,
+# rate/burst — корзина токенов уровня (запросов в секунду), user_* — то же
+# для одного клиента (пользователь действующего токена или IP).
+# Выключен по умолчанию. concurrency уровня heavy имеет смысл держать не
+# больше половины числа воркеров gunicorn, чтобы загрузки изображений и
+# выгрузка корзины не занимали все воркеры; при добавлении воркеров
+# увеличивайте ADMISSION_HEAVY_CONCURRENCY и rate пропорционально.
+ADMISSION_CONTROL = os.getenv("ADMISSION_CONTROL", "False") == "True"
+# Адреса или подсети прокси (nginx), которым можно верить в заголовке
+# X-Real-IP. Для остальных клиентом считается REMOTE_ADDR.
+ADMISSION_TRUSTED_PROXIES = list(
+    filter(None, os.getenv("ADMISSION_TRUSTED_PROXIES", "").split(","))
+)
+ADMISSION_SHM_PATH = os.getenv("ADMISSION_SHM_PATH", "")
+ADMISSION_TOKEN_CACHE_SECONDS = int(
+    os.getenv("ADMISSION_TOKEN_CACHE_SECONDS", 300)
+)
+ADMISSION_TIERS = {
+    "light": {
+        "concurrency": 64,
+        "rate": 500,
+        "burst": 1000,
+        "user_concurrency": 8,
+        "user_rate": 20,
+        "user_burst": 60,
+    },
+    "standard": {
+        "concurrency": 32,
+        "rate": 200,
+        "burst": 400,
+        "user_concurrency": 4,
+        "user_rate": 10,
+        "user_burst": 30,
+    },
+    "heavy": {
+        "concurrency": int(os.getenv("ADMISSION_HEAVY_CONCURRENCY", 4)),
+        "rate": int(os.getenv("ADMISSION_HEAVY_RATE", 40)),
+        "burst": 80,
+        "user_concurrency": 2,
+        "user_rate": 2,
+        "user_burst": 10,
+    },
+}
+ADMISSION_DEFAULT_TIER = "standard"
+# Имена маршрутов из api/urls.py.
+ADMISSION_ROUTE_TIERS = {
+    "download-cart": "heavy",
+    "users-avatar-update": "heavy",
+    "ingredient-detail": "light",
+    "ingredient-stats": "light",
+    "short-link": "light",
+    "favorite": "light",
+    "shopping-cart": "light",
+    "users-subscribe": "light",
+    "users-me": "light",
+}
+# Запись через эти маршруты загружает изображения.
+ADMISSION_WRITE_TIERS = {
+    "recipe-list": "heavy",
+    "recipe-detail": "heavy",
+}
+ADMISSION_EXEMPT_VIEWS = ("metrics",)
+# Если задан, /api/metrics/ доступен с заголовком
+# Authorization: Bearer <METRICS_TOKEN>, иначе только администраторам.
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -130,6 +353,30 @@ STATIC_URL = "/static/"
 STATIC_ROOT = BASE_DIR / "static"
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "media"
+# Абсолютный адрес, с которого nginx раздаёт медиафайлы,
+# например https://foodgram.example.com/media/
+MEDIA_BASE_URL = os.getenv("MEDIA_BASE_URL", "")
+# Файл, который сохраняли недавно, не удаляется даже без ссылок: запись,
+# которая на него сошлётся, может быть ещё не зафиксирована. Такие файлы
+# позже удаляет clean_media.
+MEDIA_ORPHAN_GRACE_SECONDS = int(
+    os.getenv("MEDIA_ORPHAN_GRACE_SECONDS", 600)
+)
+
+# Загрузки больше FILE_UPLOAD_MAX_MEMORY_SIZE пишутся во временный файл.
+FILE_UPLOAD_MAX_MEMORY_SIZE = 256 * 1024
+IMAGE_MAX_UPLOAD_SIZE = int(os.getenv("IMAGE_MAX_UPLOAD_SIZE", 10 * 1024 * 1024))
+IMAGE_MAX_SIDE = int(os.getenv("IMAGE_MAX_SIDE", 8000))
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", 40_000_000))
+
+STORAGES = {
+    "default": {
+        "BACKEND": "foodgram.storage.ContentAddressedStorage",
+    },
+    "staticfiles": {
+        "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage",
+    },
+}
 
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(days=1),
@@ -0,0 +1,115 @@
+"""Объединение одинаковых одновременных вычислений (single flight).
+
+Пока одно вычисление по ключу выполняется, остальные запросы с тем же
+ключом ждут его результата, а не повторяют те же запросы к базе.
+Потоки одного процесса ждут на событии; воркеры gunicorn договариваются
+через блокировку в кеше с коротким временем жизни и получают результат
+через кеш. Если результата нет за SINGLE_FLIGHT_TIMEOUT или ведущее
+вычисление упало, ожидающий считает сам.
+
+Между воркерами блокировка надёжна только с кешем, в котором add()
+атомарен (memcached, Redis); с LocMemCache объединяются лишь потоки
+одного процесса.
+"""
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.crypto import get_random_string
+
+from foodgram import metrics
+
+MISSING = object()
+
+_flights = {}
+_flights_lock = threading.Lock()
+
+
+class Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.failed = False
+
+
+def single_flight(key, compute):
+    """Результат compute(), общий для одновременных вызовов с key."""
+    key = hashlib.sha1(key.encode()).hexdigest()
+    with _flights_lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = Flight()
+    if not leader:
+        if flight.done.wait(settings.SINGLE_FLIGHT_TIMEOUT) and (
+            not flight.failed
+        ):
+            metrics.increment("single_flight_total", result="shared")
+            return flight.result
+        metrics.increment("single_flight_total", result="fallback")
+        return compute()
+    try:
+        flight.result = across_workers(key, compute)
+    except BaseException:
+        flight.failed = True
+        raise
+    finally:
+        with _flights_lock:
+            del _flights[key]
+        flight.done.set()
+    return flight.result
+
+
+def across_workers(key, compute):
+    lock_key = f"single-flight:lock:{key}"
+    result_key = f"single-flight:result:{key}"
+    token = get_random_string(12)
+    if cache.add(lock_key, token, settings.SINGLE_FLIGHT_LOCK_TTL):
+        try:
+            result = compute()
+            cache.set(result_key, result, settings.SINGLE_FLIGHT_RESULT_TTL)
+            return result
+        finally:
+            if cache.get(lock_key) == token:
+                cache.delete(lock_key)
+    deadline = time.monotonic() + settings.SINGLE_FLIGHT_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(settings.SINGLE_FLIGHT_POLL_INTERVAL)
+        result = cache.get(result_key, MISSING)
+        if result is not MISSING:
+            metrics.increment("single_flight_total", result="shared")
+            return result
+        if cache.get(lock_key) is None:
+            # Ведущий воркер завершился без результата.
+            break
+    metrics.increment("single_flight_total", result="fallback")
+    return compute()
+
+
+def request_key(request):
+    """Ключ запроса без учёта пользователя или None, если ответ зависит
+    от пользователя."""
+    if request.user.is_authenticated:
+        return None
+    match = request.resolver_match
+    params = sorted(
+        (name, value)
+        for name, values in request.GET.lists()
+        for value in values
+    )
+    # Ссылки на файлы в ответе абсолютные, поэтому важен и адрес сайта.
+    return (
+        f"{match.url_name}:{sorted(match.kwargs.items())}"
+        f":{request.build_absolute_uri('/')}:{params}"
+    )
+
+
+def coalesce_request(request, compute):
+    """Данные ответа, общие для одновременных одинаковых анонимных
+    запросов."""
+    key = request_key(request)
+    if key is None:
+        return compute()
+    return single_flight(f"request:{key}", compute)
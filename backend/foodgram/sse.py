@@ -0,0 +1,244 @@
+import asyncio
+import logging
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core import signing
+from django.db import DatabaseError, close_old_connections
+
+from .events import CLOSE, Event, get_broker
+
+logger = logging.getLogger(__name__)
+
+EVENTS_PATH = "/api/events/"
+TICKET_SALT = "foodgram.sse.ticket"
+
+
+def make_ticket(user_id):
+    """Подписанный билет на подключение к потоку событий.
+
+    Передаётся в строке запроса вместо токена: попадает в журналы
+    доступа, но через SSE_TICKET_SECONDS уже ничего не открывает.
+    """
+    return signing.dumps(user_id, salt=TICKET_SALT)
+
+
+def ticket_user_id(ticket):
+    try:
+        return signing.loads(
+            ticket, salt=TICKET_SALT, max_age=settings.SSE_TICKET_SECONDS
+        )
+    except signing.BadSignature:
+        return None
+
+
+async def database(query):
+    """Результат запроса к базе вне цикла запроса Django: соединения
+    закрываются по CONN_MAX_AGE и после ошибок, как в обычном запросе."""
+    await sync_to_async(close_old_connections)()
+    try:
+        return await query
+    finally:
+        await sync_to_async(close_old_connections)()
+
+
+async def token_user_id(key):
+    from rest_framework.authtoken.models import Token
+
+    return await Token.objects.filter(
+        key=key, user__is_active=True
+    ).values_list("user_id", flat=True).afirst()
+
+
+async def active_user_id(user_id):
+    from users.models import User
+
+    return await User.objects.filter(
+        id=user_id, is_active=True
+    ).values_list("id", flat=True).afirst()
+
+
+async def followed_author_ids(user_id):
+    from recipes.models import Subscription
+
+    return [
+        author_id
+        async for author_id in Subscription.objects.filter(
+            user_id=user_id
+        ).order_by().values_list("author_id", flat=True)
+    ]
+
+
+async def missed_events(author_ids, last_event_id):
+    from recipes.models import Recipe
+
+    return [
+        Event(*recipe)
+        async for recipe in Recipe.objects.filter(
+            author_id__in=author_ids, id__gt=last_event_id
+        )
+        .order_by("id")
+        .values_list("id", "author_id", "name")[: settings.SSE_REPLAY_LIMIT]
+    ]
+
+
+def request_params(scope):
+    headers = {
+        name.decode("latin-1"): value.decode("latin-1")
+        for name, value in scope["headers"]
+    }
+    query = {
+        name: values[-1]
+        for name, values in parse_qs(
+            scope["query_string"].decode("latin-1")
+        ).items()
+    }
+    token = headers.get("authorization", "")
+    token = token[len("Token "):] if token.startswith("Token ") else ""
+    # EventSource в браузере не умеет передавать заголовки, поэтому
+    # вместо токена — короткоживущий билет из /api/event-ticket/.
+    ticket = query.get("ticket", "")
+    last_event_id = headers.get("last-event-id") or query.get("lastEventId")
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_event_id = None
+    return token.strip(), ticket, last_event_id
+
+
+async def authenticate(token, ticket):
+    if token:
+        return await token_user_id(token)
+    user_id = ticket_user_id(ticket) if ticket else None
+    return await active_user_id(user_id) if user_id is not None else None
+
+
+async def send_status(send, status, body):
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"application/json")],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
+
+
+async def wait_disconnect(receive, listener):
+    while (await receive())["type"] != "http.disconnect":
+        pass
+    listener.close()
+
+
+async def events_app(scope, receive, send):
+    """Поток Server-Sent Events о новых рецептах авторов из подписок.
+
+    Список подписок читается при подключении; чтобы учесть новые подписки,
+    клиент переподключается. Пропущенные события досылаются по
+    Last-Event-ID (это id рецепта).
+    """
+    if scope["method"] != "GET":
+        await send_status(send, 405, b'{"detail": "Method not allowed."}')
+        return
+    token, ticket, last_event_id = request_params(scope)
+    try:
+        user_id = await database(authenticate(token, ticket))
+        if user_id is not None:
+            author_ids = await database(followed_author_ids(user_id))
+    except DatabaseError:
+        logger.exception("Не удалось прочитать подписки")
+        await send_status(send, 503, b'{"detail": "Service unavailable."}')
+        return
+    if user_id is None:
+        await send_status(
+            send, 401, b'{"detail": "Authentication credentials required."}'
+        )
+        return
+    broker = get_broker()
+    # Подписываемся до чтения пропущенного, чтобы не потерять события
+    # между запросом к базе и подпиской; повторы отсекаются по id.
+    listener = broker.subscribe(author_ids)
+    watcher = asyncio.create_task(wait_disconnect(receive, listener))
+    try:
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"text/event-stream"),
+                    (b"cache-control", b"no-cache"),
+                    (b"x-accel-buffering", b"no"),
+                ],
+            }
+        )
+        await send(
+            {
+                "type": "http.response.body",
+                "body": f"retry: {settings.SSE_RETRY_MS}\n\n".encode(),
+                "more_body": True,
+            }
+        )
+        missed = []
+        if last_event_id is not None and author_ids:
+            missed = await database(
+                missed_events(author_ids, last_event_id)
+            )
+            for event in missed:
+                await send_event(send, event)
+        # Брокер рассылает каждый рецепт один раз, но может прислать и
+        # уже дочитанный из базы, и рецепт с id меньше последнего.
+        replayed = {event.id for event in missed}
+        # Если пропущено больше SSE_REPLAY_LIMIT событий, клиент дочитает
+        # остальное, переподключившись с новым Last-Event-ID.
+        while len(missed) < settings.SSE_REPLAY_LIMIT:
+            try:
+                event = await asyncio.wait_for(
+                    listener.get(), settings.SSE_HEARTBEAT_SECONDS
+                )
+            except asyncio.TimeoutError:
+                await send(
+                    {
+                        "type": "http.response.body",
+                        "body": b": ping\n\n",
+                        "more_body": True,
+                    }
+                )
+                continue
+            if event is CLOSE:
+                break
+            if event.id not in replayed:
+                await send_event(send, event)
+        await send({"type": "http.response.body", "body": b""})
+    except DatabaseError:
+        # Клиент переподключится через SSE_RETRY_MS с тем же
+        # Last-Event-ID и дочитает пропущенное.
+        logger.exception("Не удалось прочитать пропущенные события")
+        await send({"type": "http.response.body", "body": b""})
+    except OSError:
+        pass
+    finally:
+        broker.unsubscribe(listener)
+        watcher.cancel()
+
+
+async def send_event(send, event):
+    await send(
+        {
+            "type": "http.response.body",
+            "body": event.payload,
+            "more_body": True,
+        }
+    )
+
+
+def with_events(application):
+    """Отдаёт EVENTS_PATH напрямую, минуя Django, остальное — application."""
+
+    async def app(scope, receive, send):
+        if scope["type"] == "http" and scope["path"] == EVENTS_PATH:
+            await events_app(scope, receive, send)
+        else:
+            await application(scope, receive, send)
+
+    return app
@@ -0,0 +1,120 @@
+import fcntl
+import hashlib
+import os
+import posixpath
+import time
+from contextlib import contextmanager
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.core.files.utils import validate_file_name
+from django.db import models
+from django.utils.crypto import get_random_string
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """Хранилище медиафайлов, именующее файлы по хешу содержимого.
+
+    Одинаковые загрузки сохраняются один раз, а файл удаляется только
+    тогда, когда на него не ссылается ни одна запись в базе и его давно
+    не сохраняли. Сохранение и удаление одного файла исключают друг друга
+    блокировкой flock, общей для всех процессов.
+    """
+
+    hash_chunk_size = 64 * 1024
+
+    def __init__(self, location=None, base_url=None, **kwargs):
+        if base_url is None:
+            base_url = settings.MEDIA_BASE_URL or settings.MEDIA_URL
+        super().__init__(location=location, base_url=base_url, **kwargs)
+
+    def content_name(self, name, content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks(self.hash_chunk_size):
+            digest.update(chunk)
+        content.seek(0)
+        hexdigest = digest.hexdigest()
+        directory, filename = posixpath.split(name.replace("\\", "/"))
+        extension = os.path.splitext(filename)[1].lower()
+        return posixpath.join(
+            directory, hexdigest[:2], f"{hexdigest}{extension}"
+        )
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, "chunks"):
+            content = File(content, name)
+        validate_file_name(name, allow_relative_path=True)
+        name = self.content_name(name, content)
+        validate_file_name(name, allow_relative_path=True)
+        with self.content_lock(name):
+            if self.exists(name):
+                # Свежее время изменения не даёт удалить файл, пока запись,
+                # которая на него сошлётся, не зафиксирована.
+                os.utime(self.path(name))
+                return name
+            # Файл пишется под временным именем и переименовывается
+            # целиком, чтобы чтение не увидело его частично записанным.
+            temp_name = f"{name}.{get_random_string(8)}.part"
+            temp_name = self._save(temp_name, content)
+            os.replace(self.path(temp_name), self.path(name))
+        return name
+
+    def delete(self, name):
+        if name:
+            self.delete_orphans([name])
+
+    @contextmanager
+    def content_lock(self, name):
+        """Блокировка на файлы с одинаковыми первыми символами хеша."""
+        directory = self.path(".locks")
+        os.makedirs(directory, exist_ok=True)
+        stripe = posixpath.basename(name)[:2]
+        with open(os.path.join(directory, stripe), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def recently_saved(self, name):
+        try:
+            modified = os.path.getmtime(self.path(name))
+        except FileNotFoundError:
+            return False
+        return time.time() - modified < settings.MEDIA_ORPHAN_GRACE_SECONDS
+
+    def file_fields(self):
+        return [
+            (model, field)
+            for model in apps.get_models()
+            for field in model._meta.get_fields()
+            if isinstance(field, models.FileField)
+            and isinstance(field.storage, ContentAddressedStorage)
+        ]
+
+    def referenced_names(self, names):
+        referenced = set()
+        for model, field in self.file_fields():
+            referenced.update(
+                model._default_manager.filter(
+                    **{f"{field.name}__in": names}
+                ).values_list(field.name, flat=True)
+            )
+        return referenced
+
+    def delete_orphans(self, names):
+        referenced = self.referenced_names(names)
+        orphans = []
+        for name in names:
+            if name in referenced:
+                continue
+            with self.content_lock(name):
+                if self.recently_saved(name):
+                    continue
+                super().delete(name)
+            orphans.append(name)
+        return orphans
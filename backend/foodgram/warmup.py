@@ -0,0 +1,90 @@
+"""Прогрев воркера gunicorn до первых настоящих запросов.
+
+preload() импортирует DRF, djoser и Pillow, заполняет URL-резолверы и
+строит поля сериализаторов; базу не трогает, поэтому вызывается и в
+мастере до fork (preload_app). warm_up() выполняется в каждом воркере:
+открывает соединения с базами и прогоняет через приложение запросы из
+WARMUP_URLS, заполняя кеши процесса. Хуки подключены в gunicorn.conf.py.
+"""
+import time
+from io import BytesIO
+from urllib.parse import urlsplit
+from wsgiref.util import setup_testing_defaults
+
+from django.conf import settings
+from django.db import connections
+from django.urls import get_resolver, resolve
+from django.utils.module_loading import import_string
+
+
+def preload():
+    from djoser.conf import settings as djoser_settings
+    from PIL import Image
+    from rest_framework.settings import api_settings
+
+    Image.init()
+    for name in api_settings.import_strings:
+        getattr(api_settings, name)
+    for group in (djoser_settings.SERIALIZERS, djoser_settings.PERMISSIONS):
+        for name in group:
+            getattr(group, name)
+    # Резолверы вложенных include() заполняются при первом разрешении
+    # пути, поэтому разрешаются и адреса прогрева.
+    get_resolver().reverse_dict
+    for url in settings.WARMUP_URLS:
+        resolve(urlsplit(url).path)
+    for path in settings.WARMUP_SERIALIZERS:
+        import_string(path)().fields
+
+
+def connect():
+    """Открывает соединения со всеми базами; при CONN_MAX_AGE > 0 они
+    остаются открытыми для первых запросов."""
+    for alias in connections:
+        connections[alias].ensure_connection()
+
+
+def host():
+    for allowed in settings.ALLOWED_HOSTS:
+        allowed = allowed.lstrip(".")
+        if allowed and allowed != "*":
+            return allowed
+    return "localhost"
+
+
+def request(url):
+    """GET-запрос к WSGI-приложению в текущем процессе; возвращает
+    статус ответа."""
+    from foodgram.wsgi import application
+
+    parts = urlsplit(url)
+    environ = {
+        "PATH_INFO": parts.path,
+        "QUERY_STRING": parts.query,
+        "HTTP_HOST": host(),
+        "wsgi.input": BytesIO(),
+    }
+    setup_testing_defaults(environ)
+    statuses = []
+
+    def start_response(status, headers, exc_info=None):
+        statuses.append(int(status.split()[0]))
+
+    response = application(environ, start_response)
+    try:
+        for _ in response:
+            pass
+    finally:
+        if hasattr(response, "close"):
+            response.close()
+    return statuses[0]
+
+
+def warm_up():
+    """Полный прогрев воркера; возвращает длительность в секундах."""
+    start = time.perf_counter()
+    preload()
+    connect()
+    for url in settings.WARMUP_URLS:
+        request(url)
+    return time.perf_counter() - start
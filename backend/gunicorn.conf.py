@@ -0,0 +1,31 @@
+"""Настройки gunicorn; файл читается из рабочего каталога автоматически.
+
+Приложение загружается в мастере до fork, и импорты с заполненными
+резолверами и сериализаторами достаются воркерам готовыми. Каждый воркер
+после загрузки открывает соединения с базой и прогоняет запросы прогрева
+(foodgram/warmup.py), прежде чем начать принимать трафик.
+"""
+import os
+
+preload_app = os.getenv("GUNICORN_PRELOAD", "True") == "True"
+warm_up = os.getenv("GUNICORN_WARM_UP", "True") == "True"
+
+
+def when_ready(server):
+    if warm_up and server.cfg.preload_app:
+        from foodgram import warmup
+
+        warmup.preload()
+
+
+def post_worker_init(worker):
+    if not warm_up:
+        return
+    from foodgram import warmup
+
+    try:
+        elapsed = warmup.warm_up()
+    except Exception:
+        worker.log.exception("Не удалось прогреть воркер")
+        return
+    worker.log.info("Воркер прогрет за %.0f мс", elapsed * 1000)
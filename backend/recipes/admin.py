@@ -1,5 +1,10 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
+from django.core.paginator import Paginator
+from django.db import IntegrityError, connections, transaction
+from django.db.models import Count
+from django.utils import timezone
+from django.utils.functional import cached_property
 from .models import (
     Recipe,
     Ingredients,
@@ -7,55 +12,180 @@ from .models import (
     Favorite,
     Subscription,
     ShoppingCart,
+    Task,
+)
+from .stats import (
+    record_cart_change,
+    record_recipe_ingredients,
+    record_removed_carts,
+    recipe_ingredients,
 )
 from users.models import User
 
 
+class EstimatedCountPaginator(Paginator):
+    """Пагинатор, берущий число строк из статистики PostgreSQL.
+
+    Точный COUNT(*) выполняется только для отфильтрованных выборок
+    и для небольших таблиц.
+    """
+
+    exact_count_threshold = 10000
+
+    @cached_property
+    def count(self):
+        query = getattr(self.object_list, "query", None)
+        if query is None or query.where:
+            return super().count
+        model = self.object_list.model
+        connection = connections[self.object_list.db]
+        if connection.vendor != "postgresql":
+            return super().count
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT reltuples::bigint FROM pg_class WHERE relname = %s",
+                [model._meta.db_table],
+            )
+            row = cursor.fetchone()
+        estimate = row[0] if row else -1
+        if estimate < self.exact_count_threshold:
+            return super().count
+        return estimate
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
 @admin.register(User)
 class UserAdminPanel(UserAdmin):
     list_display = ("first_name", "last_name", "username", 
                     "email", "is_staff")
-    search_fields = ("email", "username")
+    search_fields = ("email__startswith", "username__startswith")
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 
 class RecipeIngredientInline(admin.TabularInline):
     model = RecipeIngredient
     extra = 1
+    autocomplete_fields = ("ingredient",)
 
 
 @admin.register(Recipe)
-class RecipeAdminPanel(admin.ModelAdmin):
+class RecipeAdminPanel(LargeTableAdmin):
     list_display = ("name", "author", "favorite_count")
-    search_fields = ("name", "author__username")
+    list_select_related = ("author",)
+    search_fields = (
+        "name__startswith",
+        "author__username__startswith",
+    )
     list_filter = ("cooking_time",)
+    raw_id_fields = ("author",)
     inlines = [RecipeIngredientInline]
 
+    def get_queryset(self, request):
+        return (
+            super()
+            .get_queryset(request)
+            .annotate(favorite_total=Count("favorited_by", distinct=True))
+        )
+
     def favorite_count(self, obj):
-        return obj.favorited_by.count()
+        return obj.favorite_total
+
+    def save_related(self, request, form, formsets, change):
+        # Состав рецепта меняют инлайны: статистика ингредиентов
+        # учитывает разницу до и после, как при записи через API.
+        recipe_id = form.instance.id
+        before = recipe_ingredients(recipe_id) if change else []
+        super().save_related(request, form, formsets, change)
+        record_recipe_ingredients(
+            recipe_id, added=recipe_ingredients(recipe_id), removed=before
+        )
 
     favorite_count.short_description = "В избранном"
+    favorite_count.admin_order_field = "favorite_total"
 
 
 @admin.register(Ingredients)
 class IngredientAdminPanel(admin.ModelAdmin):
     list_display = ("name", "measurement_unit")
-    search_fields = ("name",)
+    search_fields = ("name__startswith",)
     list_filter = ("measurement_unit",)
 
 
 @admin.register(Favorite)
-class FavoriteAdminPanel(admin.ModelAdmin):
+class FavoriteAdminPanel(LargeTableAdmin):
     list_display = ("user", "recipe")
-    search_fields = ("user__username", "recipe__name")
+    list_select_related = ("user", "recipe")
+    search_fields = (
+        "user__username__startswith",
+        "recipe__name__startswith",
+    )
+    raw_id_fields = ("user", "recipe")
 
 
 @admin.register(Subscription)
-class SubscriptionAdminPanel(admin.ModelAdmin):
+class SubscriptionAdminPanel(LargeTableAdmin):
     list_display = ("user", "author")
-    search_fields = ("user__username", "author__username")
+    list_select_related = ("user", "author")
+    search_fields = (
+        "user__username__startswith",
+        "author__username__startswith",
+    )
+    raw_id_fields = ("user", "author")
 
 
 @admin.register(ShoppingCart)
-class ShoppingCartAdminPanel(admin.ModelAdmin):
+class ShoppingCartAdminPanel(LargeTableAdmin):
     list_display = ("user", "recipe")
-    search_fields = ("user__username", "recipe__name")
+    list_select_related = ("user", "recipe")
+    search_fields = (
+        "user__username__startswith",
+        "recipe__name__startswith",
+    )
+    raw_id_fields = ("user", "recipe")
+
+    # Счётчики корзин в статистике ингредиентов меняются вместе со
+    # строками корзины.
+    def save_model(self, request, obj, form, change):
+        with transaction.atomic():
+            if change and "recipe" in form.changed_data:
+                record_cart_change(form.initial["recipe"], added=False)
+            super().save_model(request, obj, form, change)
+            if not change or "recipe" in form.changed_data:
+                record_cart_change(obj.recipe_id)
+
+    def delete_model(self, request, obj):
+        with transaction.atomic():
+            record_cart_change(obj.recipe_id, added=False)
+            super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic():
+            record_removed_carts(queryset)
+            super().delete_queryset(request, queryset)
+
+
+@admin.register(Task)
+class TaskAdminPanel(admin.ModelAdmin):
+    list_display = ("name", "status", "attempts", "run_at", "created_at")
+    list_filter = ("status", "name")
+    readonly_fields = ("created_at",)
+    actions = ("retry",)
+
+    @admin.action(description="Повторить выбранные задачи")
+    def retry(self, request, queryset):
+        for item in queryset:
+            # Такая же уникальная задача может уже ждать выполнения.
+            try:
+                with transaction.atomic():
+                    Task.objects.filter(pk=item.pk).update(
+                        status=Task.PENDING,
+                        attempts=0,
+                        run_at=timezone.now(),
+                    )
+            except IntegrityError:
+                pass
@@ -0,0 +1,57 @@
+from contextlib import contextmanager
+
+from recipes.models import (
+    Favorite,
+    Ingredients,
+    Recipe,
+    RecipeIngredient,
+    ShoppingCart,
+    Subscription,
+)
+from users.models import User
+
+# Порядок важен: модели идут после тех, на кого ссылаются.
+CATALOG_MODELS = (
+    User,
+    Ingredients,
+    Recipe,
+    RecipeIngredient,
+    Favorite,
+    ShoppingCart,
+    Subscription,
+)
+
+
+def model_label(model):
+    return model._meta.label_lower
+
+
+def catalog_fields(model):
+    """Конкретные поля модели без первичного ключа и M2M-связей.
+
+    Внешние ключи выгружаются как id, файлы — как путь в хранилище.
+    """
+    return [
+        field
+        for field in model._meta.concrete_fields
+        if not field.primary_key
+    ]
+
+
+@contextmanager
+def preserve_timestamps(models):
+    """Отключает auto_now/auto_now_add, чтобы сохранить даты из выгрузки."""
+    changed = []
+    for model in models:
+        for field in model._meta.concrete_fields:
+            if getattr(field, "auto_now", False) or getattr(
+                field, "auto_now_add", False
+            ):
+                changed.append((field, field.auto_now, field.auto_now_add))
+                field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in changed:
+            field.auto_now = auto_now
+            field.auto_now_add = auto_now_add
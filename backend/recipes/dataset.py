@@ -0,0 +1,195 @@
+"""Генерация синтетических данных для нагрузочного тестирования.
+
+Функции этого модуля выполняются в процессах-воркерах и не обращаются
+к базе: всё нужное передаётся в config. Каждая порция строк генерируется
+своим генератором случайных чисел, засеянным от seed и начала порции,
+поэтому результат не зависит от числа воркеров.
+"""
+import itertools
+import random
+from datetime import timedelta
+
+from recipes.models import MAX_VALUE, MIN_VALUE
+
+# Популярность авторов, рецептов и ингредиентов убывает по закону Ципфа.
+ZIPF_EXPONENT = 1.1
+# Насколько в прошлое разносятся даты избранного, корзин и подписок.
+HISTORY = timedelta(days=30)
+
+# Поля, которые заполняет генератор, в порядке значений в строке.
+COLUMNS = {
+    "user": (
+        "id",
+        "password",
+        "is_superuser",
+        "is_staff",
+        "is_active",
+        "date_joined",
+        "username",
+        "email",
+        "first_name",
+        "last_name",
+        "avatar",
+    ),
+    "recipe": (
+        "id", "author_id", "name", "image", "text", "cooking_time", "version"
+    ),
+    "recipe_ingredient": ("recipe_id", "ingredient_id", "amount"),
+    "favorite": ("user_id", "recipe_id", "created_at"),
+    "cart": ("user_id", "recipe_id", "created_at"),
+    "subscription": ("user_id", "author_id", "created_at"),
+}
+
+FIRST_NAMES = (
+    "Анна", "Иван", "Мария", "Пётр", "Ольга", "Сергей", "Елена", "Дмитрий",
+)
+LAST_NAMES = (
+    "Иванова", "Петров", "Смирнова", "Кузнецов", "Попова", "Соколов",
+)
+DISHES = (
+    "Суп", "Салат", "Пирог", "Запеканка", "Омлет", "Каша", "Рагу", "Паста",
+)
+ADJECTIVES = (
+    "домашний", "быстрый", "праздничный", "летний", "острый", "нежный",
+)
+
+config = {}
+weights = {}
+
+
+def zipf_weights(size):
+    return list(
+        itertools.accumulate(
+            1 / rank ** ZIPF_EXPONENT for rank in range(1, size + 1)
+        )
+    )
+
+
+def init_worker(worker_config):
+    config.update(worker_config)
+    weights["author"] = zipf_weights(config["users"])
+    weights["recipe"] = zipf_weights(config["recipes"])
+    weights["ingredient"] = zipf_weights(len(config["ingredient_ids"]))
+
+
+def sample_distinct(rng, population, cum_weights, count, exclude=None):
+    """count разных значений из population с весами Ципфа."""
+    count = min(count, len(population) // 2)
+    chosen = set()
+    while len(chosen) < count:
+        for value in rng.choices(
+            population, cum_weights=cum_weights, k=count - len(chosen)
+        ):
+            if value != exclude:
+                chosen.add(value)
+    return sorted(chosen)
+
+
+def per_user(rng, mean):
+    return int(rng.expovariate(1 / mean)) if mean else 0
+
+
+def user_ids():
+    start = config["user_start"]
+    return range(start, start + config["users"])
+
+
+def recipe_ids():
+    start = config["recipe_start"]
+    return range(start, start + config["recipes"])
+
+
+def past_moment(rng):
+    return config["now"] - HISTORY * rng.random()
+
+
+def generate_users(rng, ids):
+    for user_id in ids:
+        yield (
+            user_id,
+            config["password"],
+            False,
+            False,
+            True,
+            past_moment(rng),
+            f"user{user_id}",
+            f"user{user_id}@example.com",
+            rng.choice(FIRST_NAMES),
+            rng.choice(LAST_NAMES),
+            "",
+        )
+
+
+def generate_recipes(rng, ids):
+    authors = rng.choices(
+        user_ids(), cum_weights=weights["author"], k=len(ids)
+    )
+    for recipe_id, author_id in zip(ids, authors):
+        name = f"{rng.choice(DISHES)} {rng.choice(ADJECTIVES)} №{recipe_id}"
+        yield (
+            recipe_id,
+            author_id,
+            name,
+            config["image"],
+            f"{name}. Смешать, довести до готовности и подать.",
+            rng.randint(MIN_VALUE, 180),
+            0,
+        )
+
+
+def generate_recipe_ingredients(rng, ids):
+    for recipe_id in ids:
+        count = round(rng.gauss(config["ingredients_per_recipe"], 2))
+        for ingredient_id in sample_distinct(
+            rng, config["ingredient_ids"], weights["ingredient"], max(count, 1)
+        ):
+            yield recipe_id, ingredient_id, rng.randint(MIN_VALUE, MAX_VALUE)
+
+
+def generate_user_links(rng, ids, mean, population, cum_weights):
+    for user_id in ids:
+        for target_id in sample_distinct(
+            rng,
+            population,
+            cum_weights,
+            per_user(rng, mean),
+            exclude=user_id,
+        ):
+            yield user_id, target_id, past_moment(rng)
+
+
+def generate_chunk(task):
+    kind, start, count = task
+    rng = random.Random(f"{config['seed']}:{kind}:{start}")
+    ids = range(start, start + count)
+    if kind == "user":
+        rows = generate_users(rng, ids)
+    elif kind == "recipe":
+        rows = generate_recipes(rng, ids)
+    elif kind == "recipe_ingredient":
+        rows = generate_recipe_ingredients(rng, ids)
+    elif kind == "favorite":
+        rows = generate_user_links(
+            rng,
+            ids,
+            config["favorites_per_user"],
+            recipe_ids(),
+            weights["recipe"],
+        )
+    elif kind == "cart":
+        rows = generate_user_links(
+            rng,
+            ids,
+            config["carts_per_user"],
+            recipe_ids(),
+            weights["recipe"],
+        )
+    else:
+        rows = generate_user_links(
+            rng,
+            ids,
+            config["subscriptions_per_user"],
+            user_ids(),
+            weights["author"],
+        )
+    return kind, list(rows)
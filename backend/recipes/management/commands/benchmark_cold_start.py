@@ -0,0 +1,96 @@
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from foodgram import warmup
+
+
+class Command(BaseCommand):
+    help = (
+        "Время до первого ответа у свежезапущенных воркеров с прогревом "
+        "и без него"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=4,
+            help="Сколько воркеров запустить в каждом режиме",
+        )
+        parser.add_argument(
+            "--url",
+            default=settings.WARMUP_URLS[0] if settings.WARMUP_URLS else "/",
+            help="Адрес первого запроса",
+        )
+        parser.add_argument("--child", action="store_true", help="Служебный")
+        parser.add_argument(
+            "--warm-up", action="store_true", help="Служебный"
+        )
+
+    def handle(self, *args, **options):
+        if options["child"]:
+            self.child(options["url"], options["warm_up"])
+            return
+        self.stdout.write(
+            f"{'режим':<14}{'воркер':>7}{'запуск, мс':>12}{'прогрев, мс':>13}"
+            f"{'1-й ответ, мс':>15}{'2-й ответ, мс':>15}"
+        )
+        for mode, warm in (("без прогрева", False), ("с прогревом", True)):
+            first = []
+            for number in range(1, options["workers"] + 1):
+                result = self.spawn(options["url"], warm)
+                first.append(result["first"])
+                self.stdout.write(
+                    f"{mode:<14}{number:>7}{result['started'] * 1000:>12.0f}"
+                    f"{result['warm_up'] * 1000:>13.0f}"
+                    f"{result['first'] * 1000:>15.1f}"
+                    f"{result['second'] * 1000:>15.1f}"
+                )
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"{mode}: медиана первого ответа "
+                    f"{statistics.median(first) * 1000:.1f} мс"
+                )
+            )
+
+    def spawn(self, url, warm):
+        command = [sys.argv[0], "benchmark_cold_start", "--child"]
+        command += ["--url", url]
+        if warm:
+            command.append("--warm-up")
+        launched = time.time()
+        output = subprocess.run(
+            [sys.executable, *command],
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout
+        result = json.loads(output.splitlines()[-1])
+        result["started"] = result.pop("ready_at") - launched
+        return result
+
+    def child(self, url, warm):
+        """Воркер: время прогрева и двух первых ответов на url."""
+        ready_at = time.time()
+        warm_up = warmup.warm_up() if warm else 0.0
+        timings = []
+        for _ in range(2):
+            start = time.perf_counter()
+            warmup.request(url)
+            timings.append(time.perf_counter() - start)
+        self.stdout.write(
+            json.dumps(
+                {
+                    "ready_at": ready_at,
+                    "warm_up": warm_up,
+                    "first": timings[0],
+                    "second": timings[1],
+                }
+            )
+        )
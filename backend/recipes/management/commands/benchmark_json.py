@@ -0,0 +1,80 @@
+import hashlib
+import itertools
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+
+from api.serializers import IngredientSerializer
+from api.streaming import STREAM_CHUNK_SIZE, json_array_chunks
+from recipes.models import Ingredients
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнение обычного и потокового JSON-ответа списка ингредиентов: "
+        "пиковая память, время до первого байта и общее время"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=1,
+            help="Сколько раз повторить список, чтобы увеличить ответ",
+        )
+
+    def handle(self, *args, **options):
+        if not Ingredients.objects.exists():
+            raise CommandError("Нет ингредиентов: выполните load_database")
+        repeat = options["repeat"]
+        results = [
+            ("JSONRenderer", self.run(self.buffered, repeat)),
+            ("streaming", self.run(self.streaming, repeat)),
+        ]
+        self.stdout.write(
+            f"{'режим':<14}{'память, КБ':>12}{'TTFB, мс':>12}"
+            f"{'всего, мс':>12}{'размер, КБ':>12}"
+        )
+        for name, (peak, ttfb, total, size, _) in results:
+            self.stdout.write(
+                f"{name:<14}{peak / 1024:>12.0f}{ttfb * 1000:>12.1f}"
+                f"{total * 1000:>12.1f}{size / 1024:>12.0f}"
+            )
+        if results[0][1][4] != results[1][1][4]:
+            raise CommandError("Ответы различаются")
+        self.stdout.write(self.style.SUCCESS("Ответы побайтно совпадают"))
+
+    def rows(self, repeat):
+        return itertools.chain.from_iterable(
+            Ingredients.objects.iterator(chunk_size=STREAM_CHUNK_SIZE)
+            for _ in range(repeat)
+        )
+
+    def buffered(self, repeat):
+        data = IngredientSerializer(list(self.rows(repeat)), many=True).data
+        yield JSONRenderer().render(data)
+
+    def streaming(self, repeat):
+        serializer = IngredientSerializer()
+        yield from json_array_chunks(
+            map(serializer.to_representation, self.rows(repeat)),
+            JSONRenderer(),
+        )
+
+    def run(self, render, repeat):
+        digest = hashlib.sha256()
+        size = 0
+        ttfb = None
+        tracemalloc.start()
+        start = time.perf_counter()
+        for chunk in render(repeat):
+            if ttfb is None:
+                ttfb = time.perf_counter() - start
+            digest.update(chunk)
+            size += len(chunk)
+        total = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return peak, ttfb, total, size, digest.hexdigest()
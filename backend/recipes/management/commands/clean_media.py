@@ -0,0 +1,66 @@
+import os
+import time
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "Удаление медиафайлов, на которые не ссылается ни одна запись"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--min-age",
+            type=int,
+            default=3600,
+            help="Не трогать файлы моложе указанного числа секунд",
+        )
+        parser.add_argument("--dry-run", action="store_true")
+
+    def handle(self, *args, **options):
+        storage = default_storage
+        batch_size = options["batch_size"]
+        deadline = time.time() - options["min_age"]
+        directories = {
+            field.upload_to
+            for _, field in storage.file_fields()
+            if isinstance(field.upload_to, str)
+        }
+        checked = removed = 0
+        batch = []
+        for directory in sorted(directories):
+            for name in self.walk(storage, directory, deadline):
+                batch.append(name)
+                if len(batch) >= batch_size:
+                    checked += len(batch)
+                    removed += self.remove_orphans(storage, batch, options)
+                    batch = []
+        if batch:
+            checked += len(batch)
+            removed += self.remove_orphans(storage, batch, options)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Проверено файлов: {checked}, удалено: {removed}"
+            )
+        )
+
+    def walk(self, storage, directory, deadline):
+        root = storage.path(directory)
+        for dirpath, _, filenames in os.walk(root):
+            for filename in filenames:
+                full_path = os.path.join(dirpath, filename)
+                try:
+                    if os.path.getmtime(full_path) > deadline:
+                        continue
+                except FileNotFoundError:
+                    continue
+                yield os.path.relpath(full_path, storage.location).replace(
+                    os.sep, "/"
+                )
+
+    def remove_orphans(self, storage, names, options):
+        if options["dry_run"]:
+            referenced = storage.referenced_names(names)
+            return len(set(names) - referenced)
+        return len(storage.delete_orphans(names))
@@ -0,0 +1,130 @@
+import math
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from recipes.models import Favorite, Recipe, RecipeScore, ShoppingCart
+from recipes.scores import (
+    NO_TRENDING,
+    TRENDING_DECAY,
+    TRENDING_WINDOW,
+    event_log_weight,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Пересчёт рейтинга trending по событиям за последнюю неделю "
+        "и, по запросу, точный пересчёт popular"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--recount-popular",
+            action="store_true",
+            help=(
+                "Пересчитать popular по всем рецептам и создать "
+                "недостающие строки рейтинга"
+            ),
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        if options["recount_popular"]:
+            self.recount_popular(batch_size)
+        self.compact_trending(batch_size)
+
+    def compact_trending(self, batch_size):
+        now = timezone.now()
+        since = now - TRENDING_WINDOW
+        # Веса считаются относительно текущего момента, чтобы сумма не
+        # переполнялась, и переводятся в общую шкалу при записи.
+        sums = defaultdict(float)
+        for model in (Favorite, ShoppingCart):
+            events = (
+                model.objects.filter(created_at__gte=since)
+                .order_by()
+                .values_list("recipe_id", "created_at")
+                .iterator(chunk_size=batch_size)
+            )
+            for recipe_id, created_at in events:
+                age = (created_at - now) / TRENDING_DECAY
+                sums[recipe_id] += math.exp(age)
+        offset = event_log_weight(now)
+        with transaction.atomic():
+            RecipeScore.objects.exclude(trending=NO_TRENDING).update(
+                trending=NO_TRENDING
+            )
+            recipe_ids = list(sums)
+            for start in range(0, len(recipe_ids), batch_size):
+                batch = recipe_ids[start:start + batch_size]
+                RecipeScore.objects.bulk_create(
+                    [RecipeScore(recipe_id=recipe_id) for recipe_id in batch],
+                    ignore_conflicts=True,
+                )
+                RecipeScore.objects.bulk_update(
+                    [
+                        RecipeScore(
+                            recipe_id=recipe_id,
+                            trending=math.log(sums[recipe_id]) + offset,
+                        )
+                        for recipe_id in batch
+                    ],
+                    ["trending"],
+                )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Рейтинг trending пересчитан для {len(sums)} рецептов"
+            )
+        )
+
+    def recount_popular(self, batch_size):
+        recipe_ids = (
+            Recipe.objects.order_by("id")
+            .values_list("id", flat=True)
+            .iterator(chunk_size=batch_size)
+        )
+        batch, total = [], 0
+        for recipe_id in recipe_ids:
+            batch.append(recipe_id)
+            if len(batch) >= batch_size:
+                total += self.recount_batch(batch)
+                batch = []
+        if batch:
+            total += self.recount_batch(batch)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Рейтинг popular пересчитан для {total} рецептов"
+            )
+        )
+
+    def recount_batch(self, recipe_ids):
+        favorites = dict(
+            Favorite.objects.filter(recipe_id__in=recipe_ids)
+            .order_by()
+            .values("recipe_id")
+            .annotate(total=Count("id"))
+            .values_list("recipe_id", "total")
+        )
+        carts = dict(
+            ShoppingCart.objects.filter(recipe_id__in=recipe_ids)
+            .order_by()
+            .values("recipe_id")
+            .annotate(total=Count("id"))
+            .values_list("recipe_id", "total")
+        )
+        scores = [
+            RecipeScore(
+                recipe_id=recipe_id,
+                popular=favorites.get(recipe_id, 0) + carts.get(recipe_id, 0),
+            )
+            for recipe_id in recipe_ids
+        ]
+        with transaction.atomic():
+            RecipeScore.objects.bulk_create(scores, ignore_conflicts=True)
+            RecipeScore.objects.bulk_update(scores, ["popular"])
+        return len(scores)
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef
+
+from recipes.models import ShoppingCart
+from recipes.stats import record_removed_carts
+
+
+class Command(BaseCommand):
+    help = (
+        "Удаление повторных строк корзины (остаётся самая ранняя) "
+        "перед миграцией с уникальностью пары пользователь-рецепт"
+    )
+
+    def handle(self, *args, **options):
+        table = ShoppingCart._meta.db_table
+        if table not in connection.introspection.table_names():
+            self.stdout.write("Таблицы корзины ещё нет, чистить нечего")
+            return
+        duplicates = ShoppingCart.objects.filter(
+            Exists(
+                ShoppingCart.objects.filter(
+                    user=OuterRef("user"),
+                    recipe=OuterRef("recipe"),
+                    id__lt=OuterRef("id"),
+                )
+            )
+        )
+        with transaction.atomic():
+            duplicates = ShoppingCart.objects.filter(
+                id__in=list(duplicates.values_list("id", flat=True))
+            )
+            record_removed_carts(duplicates)
+            deleted = duplicates.delete()[0]
+        self.stdout.write(
+            self.style.SUCCESS(f"Удалено повторов в корзинах: {deleted}")
+        )
@@ -0,0 +1,88 @@
+import gzip
+import sys
+
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from recipes.catalog import CATALOG_MODELS, catalog_fields, model_label
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = "Потоковая выгрузка каталога рецептов в NDJSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "output",
+            help="Путь к файлу (.ndjson или .ndjson.gz), '-' — stdout",
+        )
+        parser.add_argument("--chunk-size", type=int, default=2000)
+        parser.add_argument(
+            "--database",
+            default=DEFAULT_DB_ALIAS,
+            help="База, из которой выгружать (по умолчанию основная)",
+        )
+        parser.add_argument(
+            "--with-passwords",
+            action="store_true",
+            help="Выгрузить хеши паролей пользователей",
+        )
+
+    def handle(self, *args, **options):
+        output = options["output"]
+        if output == "-":
+            stream = sys.stdout.buffer
+        elif output.endswith(".gz"):
+            stream = gzip.open(output, "wb")
+        else:
+            stream = open(output, "wb")
+        encoder = DjangoJSONEncoder(ensure_ascii=False)
+        database = options["database"]
+        try:
+            # Все модели читаются из одного снимка базы, иначе в выгрузку
+            # попадут связи со строками, созданными во время выгрузки.
+            with transaction.atomic(using=database):
+                if connections[database].vendor == "postgresql":
+                    with connections[database].cursor() as cursor:
+                        cursor.execute(
+                            "SET TRANSACTION ISOLATION LEVEL "
+                            "REPEATABLE READ READ ONLY"
+                        )
+                for model in CATALOG_MODELS:
+                    count = self.export_model(
+                        model._default_manager.using(database),
+                        stream,
+                        encoder,
+                        options["chunk_size"],
+                        options["with_passwords"],
+                    )
+                    self.stderr.write(f"{model_label(model)}: {count}")
+        finally:
+            if stream is not sys.stdout.buffer:
+                stream.close()
+        self.stderr.write(self.style.SUCCESS("Выгрузка завершена"))
+
+    def export_model(self, queryset, stream, encoder, chunk_size, passwords):
+        model = queryset.model
+        fields = catalog_fields(model)
+        if model is User and not passwords:
+            fields = [field for field in fields if field.name != "password"]
+        names = [field.name for field in fields]
+        label = model_label(model)
+        rows = (
+            queryset.order_by("pk")
+            .values_list("pk", *(field.attname for field in fields))
+            .iterator(chunk_size=chunk_size)
+        )
+        count = 0
+        for pk, *values in rows:
+            record = {
+                "model": label,
+                "pk": pk,
+                "fields": dict(zip(names, values)),
+            }
+            stream.write(encoder.encode(record).encode())
+            stream.write(b"\n")
+            count += 1
+        return count
@@ -0,0 +1,190 @@
+import csv
+import io
+import os
+import random
+from multiprocessing import Pool
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from PIL import Image
+
+from recipes.catalog import preserve_timestamps
+from recipes.dataset import COLUMNS, generate_chunk, init_worker
+from recipes.models import (
+    Favorite,
+    Ingredients,
+    Recipe,
+    RecipeIngredient,
+    ShoppingCart,
+    Subscription,
+)
+from recipes.scores import ensure_scores
+from users.models import User
+
+# Что генерировать и в каком порядке: модель и чьи id делятся на порции.
+KINDS = (
+    ("user", User, "user"),
+    ("recipe", Recipe, "recipe"),
+    ("recipe_ingredient", RecipeIngredient, "recipe"),
+    ("favorite", Favorite, "user"),
+    ("cart", ShoppingCart, "user"),
+    ("subscription", Subscription, "user"),
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Генерация воспроизводимого синтетического набора данных "
+        "для нагрузочного тестирования"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=10000)
+        parser.add_argument("--recipes", type=int, default=50000)
+        parser.add_argument(
+            "--ingredients-per-recipe", type=float, default=6
+        )
+        parser.add_argument("--favorites-per-user", type=float, default=20)
+        parser.add_argument("--carts-per-user", type=float, default=3)
+        parser.add_argument(
+            "--subscriptions-per-user", type=float, default=5
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count(),
+            help="Число процессов, генерирующих строки",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=2000,
+            help="Сколько пользователей или рецептов в одной порции",
+        )
+        parser.add_argument(
+            "--password",
+            default="password",
+            help="Пароль всех сгенерированных пользователей",
+        )
+
+    def handle(self, *args, **options):
+        if not Ingredients.objects.exists():
+            call_command("load_database")
+        config = {
+            "seed": options["seed"],
+            "users": options["users"],
+            "recipes": options["recipes"],
+            "user_start": self.next_id(User),
+            "recipe_start": self.next_id(Recipe),
+            "ingredient_ids": list(
+                Ingredients.objects.order_by("id").values_list(
+                    "id", flat=True
+                )
+            ),
+            "ingredients_per_recipe": options["ingredients_per_recipe"],
+            "favorites_per_user": options["favorites_per_user"],
+            "carts_per_user": options["carts_per_user"],
+            "subscriptions_per_user": options["subscriptions_per_user"],
+            "now": timezone.now(),
+            # Один хеш на всех: хеширование пароля для каждого
+            # пользователя заняло бы больше времени, чем вся вставка.
+            "password": make_password(options["password"]),
+            "image": self.placeholder_image(),
+        }
+        # Популярность ингредиентов не должна зависеть от алфавита.
+        random.Random(options["seed"]).shuffle(
+            config["ingredient_ids"]
+        )
+        chunk_size = options["chunk_size"]
+        tasks = []
+        for kind, _, parent in KINDS:
+            start = config[f"{parent}_start"]
+            end = start + config[f"{parent}s"]
+            tasks.extend(
+                (kind, offset, min(chunk_size, end - offset))
+                for offset in range(start, end, chunk_size)
+            )
+        models = {kind: model for kind, model, _ in KINDS}
+        counts = dict.fromkeys(models, 0)
+        workers = max(options["workers"], 1)
+        with preserve_timestamps(models.values()):
+            if workers == 1:
+                init_worker(config)
+                chunks = map(generate_chunk, tasks)
+                self.insert_all(chunks, models, counts)
+            else:
+                with Pool(workers, init_worker, (config,)) as pool:
+                    chunks = pool.imap(generate_chunk, tasks)
+                    self.insert_all(chunks, models, counts)
+        self.reset_sequences([model for _, model, _ in KINDS])
+        created = ", ".join(
+            f"{kind} {count}" for kind, count in counts.items()
+        )
+        self.stdout.write(self.style.SUCCESS(f"Создано: {created}"))
+        self.stdout.write(
+            "Для сортировок по популярности выполните "
+            "compact_recipe_scores --recount-popular"
+        )
+
+    def insert_all(self, chunks, models, counts):
+        for kind, rows in chunks:
+            self.insert(models[kind], COLUMNS[kind], rows)
+            counts[kind] += len(rows)
+            self.stderr.write(f"{kind}: {counts[kind]}")
+
+    def next_id(self, model):
+        return (model.objects.aggregate(last=Max("id"))["last"] or 0) + 1
+
+    def placeholder_image(self):
+        buffer = io.BytesIO()
+        Image.new("RGB", (64, 64), (230, 230, 230)).save(buffer, "PNG")
+        return default_storage.save(
+            "recipes/images/placeholder.png", ContentFile(buffer.getvalue())
+        )
+
+    def insert(self, model, columns, rows):
+        if not rows:
+            return
+        with transaction.atomic():
+            if connection.vendor == "postgresql":
+                self.copy(model, columns, rows)
+            else:
+                model.objects.bulk_create(
+                    [model(**dict(zip(columns, row))) for row in rows],
+                    batch_size=1000,
+                )
+            if model is Recipe:
+                ensure_scores([row[columns.index("id")] for row in rows])
+
+    def copy(self, model, columns, rows):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            writer.writerow(
+                ["\\N" if value is None else value for value in row]
+            )
+        buffer.seek(0)
+        quote = connection.ops.quote_name
+        db_columns = ", ".join(
+            quote(model._meta.get_field(name).column) for name in columns
+        )
+        with connection.cursor() as cursor:
+            cursor.copy_expert(
+                f"COPY {quote(model._meta.db_table)} ({db_columns}) "
+                "FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+                buffer,
+            )
+
+    def reset_sequences(self, models):
+        statements = connection.ops.sequence_reset_sql(no_style(), models)
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
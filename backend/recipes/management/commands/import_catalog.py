@@ -0,0 +1,122 @@
+import gzip
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+
+from recipes.catalog import (
+    CATALOG_MODELS,
+    catalog_fields,
+    model_label,
+    preserve_timestamps,
+)
+from recipes.models import Recipe
+from recipes.scores import ensure_scores
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = "Загрузка каталога рецептов из NDJSON с контрольными точками"
+
+    def add_arguments(self, parser):
+        parser.add_argument("input", help="Файл .ndjson или .ndjson.gz")
+        parser.add_argument("--chunk-size", type=int, default=2000)
+        parser.add_argument(
+            "--checkpoint",
+            help="Файл контрольной точки (по умолчанию <input>.checkpoint)",
+        )
+        parser.add_argument(
+            "--restart",
+            action="store_true",
+            help="Игнорировать контрольную точку и начать сначала",
+        )
+
+    def handle(self, *args, **options):
+        path = options["input"]
+        checkpoint_path = options["checkpoint"] or f"{path}.checkpoint"
+        models = {model_label(model): model for model in CATALOG_MODELS}
+        fields = {
+            label: {field.name: field for field in catalog_fields(model)}
+            for label, model in models.items()
+        }
+
+        offset = lines = 0
+        if not options["restart"] and os.path.exists(checkpoint_path):
+            with open(checkpoint_path) as file:
+                checkpoint = json.load(file)
+            offset, lines = checkpoint["offset"], checkpoint["lines"]
+            self.stderr.write(f"Продолжение со строки {lines}")
+
+        opener = gzip.open if path.endswith(".gz") else open
+        chunk, chunk_label = [], None
+        previous = (offset, lines)
+        with opener(path, "rb") as stream, preserve_timestamps(
+            CATALOG_MODELS
+        ):
+            stream.seek(offset)
+            for line in stream:
+                offset += len(line)
+                lines += 1
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                label = record["model"]
+                if label not in models:
+                    raise CommandError(
+                        f"Строка {lines}: неизвестная модель {label}"
+                    )
+                if chunk and (
+                    label != chunk_label or len(chunk) >= options["chunk_size"]
+                ):
+                    self.flush(models[chunk_label], chunk)
+                    self.save_checkpoint(checkpoint_path, previous)
+                    chunk = []
+                chunk_label = label
+                chunk.append(self.build(models[label], fields[label], record))
+                previous = (offset, lines)
+            if chunk:
+                self.flush(models[chunk_label], chunk)
+                self.save_checkpoint(checkpoint_path, previous)
+
+        self.reset_sequences()
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        self.stderr.write(
+            self.style.SUCCESS(f"Загрузка завершена, строк: {lines}")
+        )
+
+    def build(self, model, fields, record):
+        instance = model(pk=record["pk"])
+        for name, value in record["fields"].items():
+            field = fields[name]
+            setattr(instance, field.attname, field.to_python(value))
+        if model is User and "password" not in record["fields"]:
+            # Выгрузка без --with-passwords: войти можно после сброса.
+            instance.set_unusable_password()
+        return instance
+
+    def flush(self, model, chunk):
+        # Повторная загрузка уже записанной порции безопасна: строки с
+        # существующим первичным ключом пропускаются.
+        with transaction.atomic():
+            model._default_manager.bulk_create(chunk, ignore_conflicts=True)
+            if model is Recipe:
+                ensure_scores([recipe.pk for recipe in chunk])
+
+    def save_checkpoint(self, path, position):
+        offset, lines = position
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w") as file:
+            json.dump({"offset": offset, "lines": lines}, file)
+        os.replace(temp_path, path)
+        self.stderr.write(f"Записано строк: {lines}")
+
+    def reset_sequences(self):
+        statements = connection.ops.sequence_reset_sql(
+            no_style(), CATALOG_MODELS
+        )
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
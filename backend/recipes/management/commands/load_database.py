@@ -1,6 +1,7 @@
 import csv
 import os
 from django.core.management.base import BaseCommand
+from api.streaming import invalidate_ingredient_list
 from recipes.models import Ingredients
 from foodgram import settings
 
@@ -32,6 +33,7 @@ class Command(BaseCommand):
             Ingredients.objects.bulk_create(
                 ingredients_to_add, batch_size=1000
             )
+            invalidate_ingredient_list()
             self.stdout.write(
                 self.style.SUCCESS(
                     f"Загружено {len(ingredients_to_add)} ингредиентов"
@@ -0,0 +1,58 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.models import Recipe
+from recipes.purge import purge_recipe, purge_user
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Удаление пользователей и рецептов со всеми связями пакетами "
+        "в коротких транзакциях"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--user",
+            nargs="+",
+            default=[],
+            help="id или username удаляемых пользователей",
+        )
+        parser.add_argument(
+            "--recipe",
+            nargs="+",
+            type=int,
+            default=[],
+            help="id удаляемых рецептов",
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=settings.PURGE_BATCH_SIZE
+        )
+
+    def handle(self, *args, **options):
+        if not options["user"] and not options["recipe"]:
+            raise CommandError("Укажите --user или --recipe")
+        batch_size = options["batch_size"]
+        for value in options["user"]:
+            lookup = {"id": value} if value.isdigit() else {"username": value}
+            user = User.objects.filter(**lookup).first()
+            if user is None:
+                self.stderr.write(f"Пользователь {value} не найден")
+                continue
+            purge_user(user, batch_size, self.report)
+            self.stdout.write(
+                self.style.SUCCESS(f"Пользователь {user.username} удалён")
+            )
+        for recipe_id in options["recipe"]:
+            recipe = Recipe.objects.filter(id=recipe_id).first()
+            if recipe is None:
+                self.stderr.write(f"Рецепт {recipe_id} не найден")
+                continue
+            purge_recipe(recipe, batch_size, self.report)
+            self.stdout.write(
+                self.style.SUCCESS(f"Рецепт {recipe_id} удалён")
+            )
+
+    def report(self, label, total):
+        self.stdout.write(f"  {label}: удалено {total}")
@@ -0,0 +1,81 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, Sum
+
+from recipes.models import IngredientStats, Ingredients, RecipeIngredient
+from recipes.stats import ensure_stats
+
+
+class Command(BaseCommand):
+    help = (
+        "Полный пересчёт статистики ингредиентов пакетами, "
+        "не останавливая запись рецептов"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=200)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        ingredient_ids = list(
+            Ingredients.objects.order_by("id").values_list("id", flat=True)
+        )
+        for start in range(0, len(ingredient_ids), batch_size):
+            self.rebuild_batch(ingredient_ids[start:start + batch_size])
+            self.stderr.write(
+                f"Пересчитано {min(start + batch_size, len(ingredient_ids))}"
+                f" из {len(ingredient_ids)}"
+            )
+        self.stdout.write(
+            self.style.SUCCESS("Статистика ингредиентов пересчитана")
+        )
+
+    def rebuild_batch(self, ingredient_ids):
+        ensure_stats(ingredient_ids)
+        with transaction.atomic():
+            # Блокировка строк пакета: инкрементальные обновления из
+            # записи рецептов и корзин дождутся пересчёта и лягут поверх
+            # него, а не потеряются.
+            list(
+                IngredientStats.objects.select_for_update()
+                .filter(ingredient_id__in=ingredient_ids)
+                .values_list("ingredient_id", flat=True)
+            )
+            usage = RecipeIngredient.objects.filter(
+                ingredient_id__in=ingredient_ids
+            ).order_by().values("ingredient_id")
+            amounts = {
+                row["ingredient_id"]: row
+                for row in usage.annotate(
+                    recipes=Count("id"),
+                    total=Sum("amount"),
+                    squares=Sum(F("amount") * F("amount")),
+                )
+            }
+            carts = dict(
+                usage.annotate(carts=Count("recipe__in_cart")).values_list(
+                    "ingredient_id", "carts"
+                )
+            )
+            unused = {"recipes": 0, "total": 0, "squares": 0}
+            stats = []
+            for ingredient_id in ingredient_ids:
+                row = amounts.get(ingredient_id, unused)
+                stats.append(
+                    IngredientStats(
+                        ingredient_id=ingredient_id,
+                        recipes_count=row["recipes"],
+                        amount_total=row["total"],
+                        amount_squares=row["squares"],
+                        cart_count=carts.get(ingredient_id, 0),
+                    )
+                )
+            IngredientStats.objects.bulk_update(
+                stats,
+                [
+                    "recipes_count",
+                    "amount_total",
+                    "amount_squares",
+                    "cart_count",
+                ],
+            )
@@ -0,0 +1,119 @@
+import multiprocessing
+import signal
+import time
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, close_old_connections
+
+from recipes.queue import claim, complete, discover, execute, fail
+
+
+class Command(BaseCommand):
+    help = "Выполнение фоновых задач из очереди в базе данных"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--mode",
+            choices=("thread", "process"),
+            default="thread",
+            help="Пул потоков (задачи ждут ввода-вывода) или процессов "
+            "(задачи нагружают процессор)",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=4,
+            help="Сколько задач выполнять одновременно",
+        )
+        parser.add_argument(
+            "--burst",
+            action="store_true",
+            help="Выполнить готовые задачи и завершиться",
+        )
+
+    def handle(self, *args, **options):
+        discover()
+        self.verbosity = options["verbosity"]
+        concurrency = options["concurrency"]
+        if options["mode"] == "process":
+            # Процессы запускаются заново, а не через fork, чтобы не
+            # унаследовать соединения с базой; Django настраивается в них
+            # при старте.
+            executor = ProcessPoolExecutor(
+                concurrency,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=django.setup,
+            )
+        else:
+            executor = ThreadPoolExecutor(
+                concurrency, thread_name_prefix="task"
+            )
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        running = {}
+        with executor:
+            while running or not self.stopping:
+                # Как в цикле запроса: разорванное или устаревшее
+                # соединение заменяется перед каждой итерацией.
+                close_old_connections()
+                try:
+                    busy = self.step(executor, running, concurrency)
+                except DatabaseError as error:
+                    # Задача, на которой случилась ошибка, снова станет
+                    # доступной, когда истечёт её аренда.
+                    self.stderr.write(f"Ошибка базы данных: {error!r}")
+                    time.sleep(settings.TASK_POLL_INTERVAL)
+                    continue
+                if not busy:
+                    if options["burst"]:
+                        break
+                    time.sleep(settings.TASK_POLL_INTERVAL)
+
+    def step(self, executor, running, concurrency):
+        """Забирает готовые задачи и ждёт завершения выполняемых.
+
+        Возвращает False, если выполнять нечего.
+        """
+        free = 0 if self.stopping else concurrency - len(running)
+        for item in claim(free) if free else ():
+            future = executor.submit(execute, item.name, item.payload)
+            running[future] = item
+        if not running:
+            return False
+        done, _ = wait(
+            running,
+            timeout=settings.TASK_POLL_INTERVAL,
+            return_when=FIRST_COMPLETED,
+        )
+        for future in done:
+            self.finish(running.pop(future), future)
+        return True
+
+    def stop(self, signum, frame):
+        # Новые задачи не забираются, начатые выполняются до конца.
+        self.stopping = True
+
+    def finish(self, item, future):
+        error = future.exception()
+        if error is None:
+            duration = future.result()
+            complete(item, duration)
+            if self.verbosity > 1:
+                self.stdout.write(
+                    f"{item} выполнена за {duration * 1000:.0f} мс"
+                )
+            return
+        retried = fail(item, error)
+        self.stderr.write(
+            f"{item}: {error!r}, "
+            + ("повтор позже" if retried else "попытки исчерпаны")
+        )
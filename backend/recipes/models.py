@@ -1,4 +1,6 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, Q
+from django.utils import timezone
 from django.core.validators import MinValueValidator, MaxValueValidator
 from users.models import User
 
@@ -8,7 +10,9 @@ MAX_VALUE = 32000
 
 
 class Ingredients(models.Model):
-    name = models.CharField("Название", max_length=128, default="неизвестно")
+    name = models.CharField(
+        "Название", max_length=128, default="неизвестно", db_index=True
+    )
     measurement_unit = models.CharField(
         "Единица измерения", max_length=64, default="г"
     )
@@ -29,9 +33,15 @@ class Recipe(models.Model):
         related_name="recipes",
         verbose_name="Автор",
     )
-    name = models.CharField("Название", max_length=256)
+    name = models.CharField("Название", max_length=256, db_index=True)
+    # Индекс нужен хранилищу: файл удаляется, только если на него не
+    # ссылается ни одна запись.
     image = models.ImageField(
-        "Изображение", upload_to="recipes/images/", null=True, blank=True
+        "Изображение",
+        upload_to="recipes/images/",
+        null=True,
+        blank=True,
+        db_index=True,
     )
     text = models.TextField("Описание")
     ingredients = models.ManyToManyField(
@@ -47,6 +57,11 @@ class Recipe(models.Model):
             MaxValueValidator(MAX_VALUE),
         ],
     )
+    # Растёт при каждом изменении рецепта, его состава, ингредиентов и
+    # автора; входит в ключ закешированного фрагмента рецепта.
+    version = models.PositiveIntegerField(
+        "Версия", default=0, editable=False
+    )
 
     class Meta:
         verbose_name = "рецепт"
@@ -56,6 +71,22 @@ class Recipe(models.Model):
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            # Рейтинг есть у каждого рецепта: сортировки popular и trending
+            # соединяют таблицы через INNER JOIN.
+            with transaction.atomic(using=kwargs.get("using")):
+                super().save(*args, **kwargs)
+                RecipeScore.objects.get_or_create(recipe=self)
+            return
+        # Версия увеличивается в базе, а не по значению в памяти, чтобы
+        # одновременные правки не получили одну и ту же версию.
+        self.version = F("version") + 1
+        if kwargs.get("update_fields") is not None:
+            kwargs["update_fields"] = {*kwargs["update_fields"], "version"}
+        super().save(*args, **kwargs)
+        self.refresh_from_db(fields=["version"])
+
 
 class RecipeIngredient(models.Model):
     recipe = models.ForeignKey(
@@ -129,9 +160,118 @@ class ShoppingCart(models.Model):
     created_at = models.DateTimeField("Дата добавления", auto_now_add=True)
 
     class Meta:
+        unique_together = ("user", "recipe")
         verbose_name = "корзина"
         verbose_name_plural = "корзины"
         ordering = ["created_at", "recipe__name"]
 
     def __str__(self):
         return f"{self.recipe} в корзине {self.user}"
+
+
+class RecipeScore(models.Model):
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="score",
+    )
+    popular = models.PositiveIntegerField(
+        "Избранное и корзины за всё время", default=0
+    )
+    trending = models.FloatField(
+        "Популярность за неделю (логарифм)", default=0.0
+    )
+
+    class Meta:
+        verbose_name = "рейтинг рецепта"
+        verbose_name_plural = "рейтинги рецептов"
+        indexes = [
+            models.Index(
+                F("popular").desc(),
+                F("recipe").desc(),
+                name="recipe_score_popular_idx",
+            ),
+            models.Index(
+                F("trending").desc(),
+                F("recipe").desc(),
+                name="recipe_score_trending_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.recipe}: {self.popular}"
+
+
+class IngredientStats(models.Model):
+    ingredient = models.OneToOneField(
+        Ingredients,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="stats",
+    )
+    recipes_count = models.PositiveIntegerField(
+        "Число рецептов с ингредиентом", default=0
+    )
+    amount_total = models.PositiveBigIntegerField(
+        "Сумма количеств", default=0
+    )
+    amount_squares = models.PositiveBigIntegerField(
+        "Сумма квадратов количеств", default=0
+    )
+    cart_count = models.PositiveIntegerField(
+        "Добавлений рецептов с ингредиентом в корзины", default=0
+    )
+
+    class Meta:
+        verbose_name = "статистика ингредиента"
+        verbose_name_plural = "статистика ингредиентов"
+        indexes = [
+            models.Index(
+                F("recipes_count").desc(),
+                F("ingredient").desc(),
+                name="ingredient_stats_popular_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.ingredient}: {self.recipes_count}"
+
+
+class Task(models.Model):
+    PENDING = "pending"
+    FAILED = "failed"
+    STATUSES = ((PENDING, "ожидает"), (FAILED, "не выполнена"))
+
+    name = models.CharField("Задача", max_length=128)
+    payload = models.JSONField("Аргументы", default=dict)
+    status = models.CharField(
+        "Статус", max_length=16, choices=STATUSES, default=PENDING
+    )
+    attempts = models.PositiveSmallIntegerField("Попыток", default=0)
+    run_at = models.DateTimeField("Выполнить не раньше", default=timezone.now)
+    created_at = models.DateTimeField("Поставлена", auto_now_add=True)
+    last_error = models.TextField("Последняя ошибка", blank=True)
+    # Хеш имени и аргументов задач, поставленных с unique=True.
+    unique_key = models.CharField(
+        "Ключ уникальности", max_length=64, null=True, editable=False
+    )
+
+    class Meta:
+        verbose_name = "фоновая задача"
+        verbose_name_plural = "фоновые задачи"
+        ordering = ["run_at"]
+        indexes = [
+            models.Index(fields=["status", "run_at"], name="task_queue_idx"),
+        ]
+        constraints = [
+            # Одинаковая задача ждёт или выполняется не больше одной.
+            models.UniqueConstraint(
+                fields=["unique_key"],
+                condition=Q(status="pending"),
+                name="task_unique_pending",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.name} #{self.pk}"
@@ -0,0 +1,189 @@
+from django.conf import settings
+from django.db import connections, router, transaction
+
+from recipes.models import (
+    Favorite,
+    Recipe,
+    RecipeIngredient,
+    RecipeScore,
+    ShoppingCart,
+    Subscription,
+)
+from recipes.queue import enqueue
+from recipes.stats import record_removed_carts, record_removed_ingredients
+from recipes.tasks import delete_files
+from users.models import User
+
+# Связи рецепта, которые удаляются пакетами до удаления самого рецепта.
+RECIPE_DEPENDENTS = (
+    (RecipeIngredient, "recipe_id"),
+    (Favorite, "recipe_id"),
+    (ShoppingCart, "recipe_id"),
+    (RecipeScore, "recipe_id"),
+)
+# Связи пользователя, не относящиеся к его рецептам.
+USER_DEPENDENTS = (
+    (Subscription, "user_id"),
+    (Subscription, "author_id"),
+    (Favorite, "user_id"),
+    (ShoppingCart, "user_id"),
+)
+
+
+def raw_delete(queryset):
+    """DELETE ... WHERE pk IN (SELECT pk ...) без загрузки строк и без
+    сигналов delete. Возвращает число удалённых строк."""
+    model = queryset.model
+    connection = connections[router.db_for_write(model)]
+    quote = connection.ops.quote_name
+    sql, params = queryset.values("pk").query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {quote(model._meta.db_table)} "
+            f"WHERE {quote(model._meta.pk.column)} IN ({sql})",
+            params,
+        )
+        return cursor.rowcount
+
+
+def delete_in_batches(queryset, batch_size, progress=None):
+    """Удаляет строки выборки пакетами по batch_size.
+
+    Каждый пакет — отдельный запрос raw_delete в своей короткой
+    транзакции, поэтому блокировки держатся недолго, а строки не
+    загружаются в память.
+    """
+    model = queryset.model
+    using = router.db_for_write(model)
+    batch = queryset.order_by()[:batch_size]
+    total = 0
+    while True:
+        with transaction.atomic(using=using):
+            deleted = raw_delete(batch)
+        total += deleted
+        if progress and deleted:
+            progress(model._meta.label, total)
+        if deleted < batch_size:
+            return total
+
+
+def cleanup_files(field, names):
+    """Ставит в очередь удаление файлов, на которые больше нет ссылок."""
+    names = [name for name in names if name]
+    if names:
+        enqueue(
+            delete_files,
+            model=field.model._meta.label,
+            field=field.name,
+            names=names,
+        )
+
+
+def delete_recording(queryset, record, batch_size, progress=None):
+    """Удаляет строки выборки пакетами, как delete_in_batches, но перед
+    удалением каждого пакета вызывает record(пакет) в той же короткой
+    транзакции: статистика меняется вместе со строками, а повтор после
+    сбоя не учтёт их второй раз."""
+    model = queryset.model
+    total = 0
+    while True:
+        with transaction.atomic():
+            pks = list(
+                queryset.select_for_update()
+                .order_by("pk")
+                .values_list("pk", flat=True)[:batch_size]
+            )
+            if not pks:
+                return total
+            batch = model.objects.filter(pk__in=pks)
+            record(batch)
+            total += raw_delete(batch)
+        if progress:
+            progress(model._meta.label, total)
+        if len(pks) < batch_size:
+            return total
+
+
+def record_removed_composition(batch):
+    record_removed_ingredients(
+        batch.values_list("recipe_id", "ingredient_id", "amount")
+    )
+
+
+def purge_recipe_relations(recipe_ids, batch_size, progress=None):
+    # Состав удаляется первым, пока корзины рецептов на месте: их число
+    # нужно, чтобы снять состав со счётчиков корзин.
+    delete_recording(
+        RecipeIngredient.objects.filter(recipe_id__in=recipe_ids),
+        record_removed_composition,
+        batch_size,
+        progress,
+    )
+    for model, field in RECIPE_DEPENDENTS:
+        if model is RecipeIngredient:
+            continue
+        delete_in_batches(
+            model.objects.filter(**{f"{field}__in": recipe_ids}),
+            batch_size,
+            progress,
+        )
+
+
+def purge_recipe(recipe, batch_size=None, progress=None):
+    """Удаляет рецепт, предварительно удалив его связи пакетами."""
+    batch_size = batch_size or settings.PURGE_BATCH_SIZE
+    purge_recipe_relations([recipe.id], batch_size, progress)
+    image = recipe.image.name
+    recipe.delete()
+    cleanup_files(Recipe._meta.get_field("image"), [image])
+
+
+def purge_user(user, batch_size=None, progress=None):
+    """Удаляет пользователя вместе с рецептами, подписками, избранным
+    и корзиной, не собирая связанные строки в памяти."""
+    batch_size = batch_size or settings.PURGE_BATCH_SIZE
+    # Корзина удаляется до рецептов пользователя, поэтому снимается со
+    # статистики целиком, включая его собственные рецепты.
+    delete_recording(
+        ShoppingCart.objects.filter(user_id=user.id),
+        record_removed_carts,
+        batch_size,
+        progress,
+    )
+    for model, field in USER_DEPENDENTS:
+        delete_in_batches(
+            model.objects.filter(**{field: user.id}), batch_size, progress
+        )
+    images, total = [], 0
+    while True:
+        batch = list(
+            Recipe.objects.filter(author_id=user.id)
+            .order_by("id")
+            .values_list("id", "image")[:batch_size]
+        )
+        if not batch:
+            break
+        recipe_ids = [recipe_id for recipe_id, _ in batch]
+        purge_recipe_relations(recipe_ids, batch_size, progress)
+        total += delete_in_batches(
+            Recipe.objects.filter(id__in=recipe_ids), batch_size
+        )
+        if progress:
+            progress(Recipe._meta.label, total)
+        images.extend(image for _, image in batch)
+    avatar = user.avatar.name
+    user.delete()
+    cleanup_files(Recipe._meta.get_field("image"), images)
+    cleanup_files(User._meta.get_field("avatar"), [avatar])
+
+
+def has_many_relations(recipe, threshold=None):
+    """Превышает ли число связей рецепта порог, после которого его
+    лучше удалять через purge_recipe."""
+    threshold = threshold or settings.PURGE_RELATIONS_THRESHOLD
+    total = 0
+    for model, field in RECIPE_DEPENDENTS:
+        total += model.objects.filter(**{field: recipe.id}).count()
+        if total >= threshold:
+            return True
+    return False
@@ -0,0 +1,195 @@
+"""Очередь фоновых задач в базе данных.
+
+Задача ставится в очередь после фиксации транзакции (enqueue) и
+выполняется командой run_worker. Воркеры забирают задачи запросом
+SELECT ... FOR UPDATE SKIP LOCKED и продлевают run_at на время аренды:
+если воркер упадёт, задача снова станет доступной, когда аренда истечёт.
+Выполненные задачи удаляются, упавшие повторяются с растущей задержкой,
+а после TASK_MAX_ATTEMPTS попыток остаются в таблице со статусом failed.
+
+Счётчики task_* пишет процесс run_worker; в /api/metrics/ веб-процессов
+они попадают только с общим кешем (memcached, Redis). Размер очереди и
+возраст самой старой задачи считаются по таблице задач при каждом
+запросе метрик и видны при любом кеше.
+"""
+import hashlib
+import json
+import random
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import Count, F, Min
+from django.utils import timezone
+from django.utils.module_loading import autodiscover_modules
+
+from foodgram import metrics
+from recipes.models import Task
+
+TASKS = {}
+
+
+def task(function=None, *, max_attempts=None):
+    """Регистрирует функцию как задачу очереди.
+
+    Аргументы задачи передаются именованными и должны сериализоваться
+    в JSON.
+    """
+
+    def register(function):
+        function.task_name = f"{function.__module__}.{function.__name__}"
+        function.max_attempts = max_attempts
+        TASKS[function.task_name] = function
+        return function
+
+    return register(function) if function else register
+
+
+def discover():
+    """Импортирует модули tasks всех приложений."""
+    autodiscover_modules("tasks")
+
+
+def unique_key(name, kwargs):
+    data = json.dumps([name, kwargs], sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def enqueue(function, *, unique=False, **kwargs):
+    """Ставит задачу в очередь после фиксации текущей транзакции.
+
+    unique — не ставить задачу, если такая же (с теми же аргументами)
+    уже ждёт или выполняется; это проверяет уникальный индекс.
+    """
+    name = function.task_name
+    if settings.TASK_ALWAYS_EAGER:
+        transaction.on_commit(lambda: function(**kwargs))
+        return
+
+    def create():
+        try:
+            with transaction.atomic():
+                Task.objects.create(
+                    name=name,
+                    payload=kwargs,
+                    unique_key=unique_key(name, kwargs) if unique else None,
+                )
+        except IntegrityError:
+            if not unique:
+                raise
+
+    transaction.on_commit(create)
+
+
+def claim(limit):
+    """Забирает до limit готовых к выполнению задач."""
+    now = timezone.now()
+    lease = now + timedelta(seconds=settings.TASK_LEASE_SECONDS)
+    claimed = []
+    with transaction.atomic():
+        ready = (
+            Task.objects.select_for_update(skip_locked=True)
+            .filter(status=Task.PENDING, run_at__lte=now)
+            .order_by("run_at")[:limit]
+        )
+        for item in ready:
+            # Условие на run_at защищает от двойного захвата в базах без
+            # SELECT ... FOR UPDATE (SQLite).
+            if Task.objects.filter(
+                pk=item.pk, status=Task.PENDING, run_at=item.run_at
+            ).update(run_at=lease, attempts=F("attempts") + 1):
+                metrics.observe(
+                    "task_wait_seconds",
+                    (now - item.run_at).total_seconds(),
+                    task=item.name,
+                )
+                item.attempts += 1
+                claimed.append(item)
+    return claimed
+
+
+def execute(name, payload):
+    """Выполняет задачу и возвращает её длительность в секундах.
+
+    Вызывается в потоке или процессе пула воркера.
+    """
+    if not TASKS:
+        discover()
+    function = TASKS.get(name)
+    if function is None:
+        raise LookupError(f"Неизвестная задача: {name}")
+    close_old_connections()
+    start = time.perf_counter()
+    try:
+        function(**payload)
+    finally:
+        close_old_connections()
+    return time.perf_counter() - start
+
+
+def retry_delay(attempts):
+    delay = min(
+        settings.TASK_RETRY_DELAY * 2 ** (attempts - 1),
+        settings.TASK_RETRY_MAX_DELAY,
+    )
+    # Случайный разброс, чтобы задачи, упавшие вместе, не повторялись
+    # одновременно.
+    return delay * random.uniform(0.5, 1)
+
+
+def complete(item, duration):
+    Task.objects.filter(pk=item.pk).delete()
+    metrics.observe("task_duration_seconds", duration, task=item.name)
+    metrics.observe(
+        "task_latency_seconds",
+        (timezone.now() - item.created_at).total_seconds(),
+        task=item.name,
+    )
+    metrics.increment("tasks_total", task=item.name, status="done")
+
+
+def fail(item, error):
+    """Откладывает повтор задачи или помечает её невыполненной."""
+    function = TASKS.get(item.name)
+    max_attempts = (
+        getattr(function, "max_attempts", None) or settings.TASK_MAX_ATTEMPTS
+    )
+    message = "".join(traceback.format_exception(error))
+    if item.attempts >= max_attempts:
+        Task.objects.filter(pk=item.pk).update(
+            status=Task.FAILED, last_error=message
+        )
+        metrics.increment("tasks_total", task=item.name, status="failed")
+        return False
+    Task.objects.filter(pk=item.pk).update(
+        run_at=timezone.now()
+        + timedelta(seconds=retry_delay(item.attempts)),
+        last_error=message,
+    )
+    metrics.increment("tasks_total", task=item.name, status="retried")
+    return True
+
+
+@metrics.register_gauge
+def queue_gauges():
+    now = timezone.now()
+    gauges = []
+    for row in (
+        Task.objects.order_by()
+        .values("name", "status")
+        .annotate(total=Count("pk"), oldest=Min("created_at"))
+    ):
+        name, status = row["name"], row["status"]
+        gauges.append(
+            (f'tasks_queued{{task="{name}",status="{status}"}}', row["total"])
+        )
+        if status == Task.PENDING:
+            gauges.append(
+                (
+                    f'task_oldest_age_seconds{{task="{name}"}}',
+                    (now - row["oldest"]).total_seconds(),
+                )
+            )
+    return gauges
@@ -0,0 +1,81 @@
+"""Связи пользователя с рецептами и авторами одним SQL-запросом.
+
+Запросы идут мимо ORM, поэтому сигналы post_save и post_delete для
+Favorite, ShoppingCart и Subscription не отправляются. Обработчиков этих
+сигналов в проекте нет: всё, что зависит от связей, вызывающий код
+обновляет сам после успешного запроса:
+
+- рейтинги рецептов — recipes.scores.record_event (избранное и корзина);
+- число корзин по ингредиентам — recipes.stats.record_cart_change;
+- кеш счётчиков пользователя — api.counters.invalidate_user_counts.
+
+Фрагменты рецептов от связей не зависят: флаги is_favorited и
+is_in_shopping_cart читаются на каждый запрос.
+"""
+from django.db import connections, router
+from django.utils import timezone
+
+
+def relation_sql(model, values):
+    connection = connections[router.db_for_write(model)]
+    quote = connection.ops.quote_name
+    columns = [model._meta.get_field(name).column for name in values]
+    return connection, quote, columns
+
+
+def convert_created_at(model, connection, value):
+    field = model._meta.get_field("created_at")
+    column = field.cached_col
+    converters = connection.ops.get_db_converters(
+        column
+    ) + column.get_db_converters(connection)
+    for converter in converters:
+        value = converter(value, column, connection)
+    return value
+
+
+def add_relation(model, **values):
+    """Создаёт связь одним запросом INSERT ... ON CONFLICT DO NOTHING.
+
+    Возвращает created_at новой строки или None, если такая связь уже
+    есть. Опирается на ограничение уникальности модели.
+    """
+    connection, quote, columns = relation_sql(model, values)
+    created_at = timezone.now()
+    field = model._meta.get_field("created_at")
+    params = [
+        *values.values(),
+        field.get_db_prep_value(created_at, connection),
+    ]
+    placeholders = ", ".join(["%s"] * len(params))
+    column_list = ", ".join(quote(column) for column in columns)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {quote(model._meta.db_table)} "
+            f"({column_list}, {quote(field.column)}) "
+            f"VALUES ({placeholders}) "
+            f"ON CONFLICT DO NOTHING RETURNING {quote(model._meta.pk.column)}",
+            params,
+        )
+        if cursor.fetchone() is None:
+            return None
+    return created_at
+
+
+def remove_relation(model, **values):
+    """Удаляет связь одним запросом DELETE ... RETURNING.
+
+    Возвращает created_at удалённой строки или None, если связи не было.
+    """
+    connection, quote, columns = relation_sql(model, values)
+    condition = " AND ".join(f"{quote(column)} = %s" for column in columns)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {quote(model._meta.db_table)} WHERE {condition} "
+            f"RETURNING {quote(model._meta.get_field('created_at').column)}",
+            list(values.values()),
+        )
+        row = cursor.fetchone()
+    if row is None:
+        return None
+    return convert_created_at(model, connection, row[0])
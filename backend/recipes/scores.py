@@ -0,0 +1,82 @@
+"""Инкрементальные рейтинги рецептов для сортировок popular и trending.
+
+popular — число добавлений рецепта в избранное и корзины.
+trending — сумма весов exp((t - TRENDING_EPOCH) / TRENDING_DECAY) по
+событиям за последние TRENDING_WINDOW, хранится в логарифмической
+шкале: так вес нового события можно прибавить, не пересчитывая
+остальные строки, а значения не переполняются со временем. Порядок по
+логарифму совпадает с порядком по самой сумме. Вес любого события после
+TRENDING_EPOCH положителен, поэтому 0 означает «событий за неделю нет».
+"""
+
+from datetime import datetime, timedelta, timezone
+
+from django.db.models import Case, F, FloatField, Value, When
+from django.db.models.functions import Exp, Greatest, Least, Ln
+from django.utils import timezone as django_timezone
+
+from .models import RecipeScore
+
+TRENDING_EPOCH = datetime(2025, 1, 1, tzinfo=timezone.utc)
+TRENDING_DECAY = timedelta(days=2)
+TRENDING_WINDOW = timedelta(days=7)
+NO_TRENDING = 0.0
+
+
+def event_log_weight(moment):
+    return (moment - TRENDING_EPOCH) / TRENDING_DECAY
+
+
+def log_add(total, value):
+    """SQL-выражение log(exp(total) + exp(value)) для поля total."""
+    value = Value(value, output_field=FloatField())
+    high, low = Greatest(F(total), value), Least(F(total), value)
+    return Case(
+        When(**{f"{total}__lte": NO_TRENDING}, then=value),
+        default=high + Ln(1 + Exp(low - high)),
+    )
+
+
+def log_subtract(total, value):
+    """SQL-выражение log(exp(total) - exp(value)) для поля total."""
+    return Case(
+        When(**{f"{total}__lte": value + 1e-9}, then=Value(NO_TRENDING)),
+        default=F(total) + Ln(1 - Exp(Value(value) - F(total))),
+        output_field=FloatField(),
+    )
+
+
+def in_trending_window(moment, now=None):
+    now = now or django_timezone.now()
+    return now - moment <= TRENDING_WINDOW
+
+
+def ensure_scores(recipe_ids):
+    """Создаёт недостающие строки рейтинга для рецептов."""
+    RecipeScore.objects.bulk_create(
+        [RecipeScore(recipe_id=recipe_id) for recipe_id in recipe_ids],
+        ignore_conflicts=True,
+    )
+
+
+def record_event(recipe_id, created_at, added=True):
+    """Учитывает добавление или удаление рецепта из избранного/корзины.
+
+    Вызывается в транзакции, которая добавила или удалила связь: строка
+    рейтинга меняется одним UPDATE без чтения и блокируется лишь до
+    конца этой транзакции.
+    """
+    if added:
+        changes = {"popular": F("popular") + 1}
+    else:
+        changes = {"popular": Greatest(F("popular") - 1, Value(0))}
+    if in_trending_window(created_at):
+        weight = event_log_weight(created_at)
+        if added:
+            changes["trending"] = log_add("trending", weight)
+        else:
+            changes["trending"] = log_subtract("trending", weight)
+    scores = RecipeScore.objects.filter(recipe_id=recipe_id)
+    if not scores.update(**changes):
+        ensure_scores([recipe_id])
+        scores.update(**changes)
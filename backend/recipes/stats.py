@@ -0,0 +1,160 @@
+from collections import defaultdict
+
+from django.db.models import Case, Count, F, IntegerField, Value, When
+from django.db.models.functions import Greatest
+
+from recipes.models import IngredientStats, RecipeIngredient, ShoppingCart
+
+
+def ensure_stats(ingredient_ids):
+    IngredientStats.objects.bulk_create(
+        [
+            IngredientStats(ingredient_id=ingredient_id)
+            for ingredient_id in ingredient_ids
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def per_ingredient(field, deltas):
+    """F(field) + своя добавка для каждого ингредиента, не ниже нуля."""
+    return Greatest(
+        F(field)
+        + Case(
+            *[
+                When(ingredient_id=ingredient_id, then=Value(delta))
+                for ingredient_id, delta in deltas.items()
+            ],
+            default=Value(0),
+            output_field=IntegerField(),
+        ),
+        Value(0),
+    )
+
+
+def record_recipe_ingredients(recipe_id, added=(), removed=(), carts=None):
+    """Учитывает изменение состава рецепта одним UPDATE.
+
+    added и removed — пары (ingredient_id, amount). carts — сколько раз
+    рецепт лежит в корзинах; если не передано, считается запросом.
+    """
+    changes = defaultdict(lambda: [0, 0, 0])
+    for sign, items in ((1, added), (-1, removed)):
+        for ingredient_id, amount in items:
+            change = changes[ingredient_id]
+            change[0] += sign
+            change[1] += sign * amount
+            change[2] += sign * amount * amount
+    changes = {
+        ingredient_id: change
+        for ingredient_id, change in changes.items()
+        if any(change)
+    }
+    if not changes:
+        return
+    if carts is None:
+        carts = ShoppingCart.objects.filter(recipe_id=recipe_id).count()
+    ensure_stats(changes)
+    updates = {
+        "recipes_count": {key: value[0] for key, value in changes.items()},
+        "amount_total": {key: value[1] for key, value in changes.items()},
+        "amount_squares": {key: value[2] for key, value in changes.items()},
+    }
+    if carts:
+        updates["cart_count"] = {
+            key: value[0] * carts for key, value in changes.items()
+        }
+    IngredientStats.objects.filter(ingredient_id__in=changes).update(
+        **{
+            field: per_ingredient(field, deltas)
+            for field, deltas in updates.items()
+        }
+    )
+
+
+def recipe_ingredients(recipe_id):
+    return list(
+        RecipeIngredient.objects.filter(recipe_id=recipe_id)
+        .order_by()
+        .values_list("ingredient_id", "amount")
+    )
+
+
+def record_cart_change(recipe_id, added=True):
+    """Учитывает добавление рецепта в корзину или удаление из неё."""
+    delta = 1 if added else -1
+    IngredientStats.objects.filter(
+        ingredient_id__in=RecipeIngredient.objects.filter(
+            recipe_id=recipe_id
+        ).values("ingredient_id")
+    ).update(cart_count=Greatest(F("cart_count") + delta, Value(0)))
+
+
+def record_removed_recipes(recipe_ids):
+    """Снимает со статистики состав удаляемых рецептов и их места в
+    корзинах."""
+    record_removed_ingredients(
+        RecipeIngredient.objects.filter(recipe_id__in=recipe_ids)
+        .order_by()
+        .values_list("recipe_id", "ingredient_id", "amount")
+    )
+
+
+def record_removed_ingredients(rows):
+    """Снимает со статистики удаляемые строки состава — тройки
+    (recipe_id, ingredient_id, amount) — вместе с местами их рецептов
+    в корзинах.
+
+    Вызывается в транзакции, которая удаляет эти строки, чтобы повтор
+    после сбоя не вычел их второй раз.
+    """
+    rows = list(rows)
+    carts = dict(
+        ShoppingCart.objects.filter(
+            recipe_id__in={recipe_id for recipe_id, _, _ in rows}
+        )
+        .order_by()
+        .values("recipe_id")
+        .annotate(total=Count("pk"))
+        .values_list("recipe_id", "total")
+    )
+    changes = defaultdict(lambda: [0, 0, 0, 0])
+    for recipe_id, ingredient_id, amount in rows:
+        change = changes[ingredient_id]
+        change[0] -= 1
+        change[1] -= amount
+        change[2] -= amount * amount
+        change[3] -= carts.get(recipe_id, 0)
+    if not changes:
+        return
+    fields = ("recipes_count", "amount_total", "amount_squares", "cart_count")
+    IngredientStats.objects.filter(ingredient_id__in=changes).update(
+        **{
+            field: per_ingredient(
+                field,
+                {key: value[index] for key, value in changes.items()},
+            )
+            for index, field in enumerate(fields)
+        }
+    )
+
+
+def record_removed_carts(carts):
+    """Снимает со статистики удаляемые строки корзины (queryset
+    ShoppingCart): каждая строка — одно добавление рецепта."""
+    removed = dict(
+        RecipeIngredient.objects.filter(
+            recipe__in_cart__in=carts.values("pk")
+        )
+        .order_by()
+        .values("ingredient_id")
+        .annotate(total=Count("pk"))
+        .values_list("ingredient_id", "total")
+    )
+    if removed:
+        IngredientStats.objects.filter(ingredient_id__in=removed).update(
+            cart_count=per_ingredient(
+                "cart_count",
+                {key: -total for key, total in removed.items()},
+            )
+        )
@@ -0,0 +1,14 @@
+from django.apps import apps
+
+from recipes.queue import task
+
+
+@task
+def delete_files(model, field, names):
+    """Удаляет файлы, на которые больше нет ссылок."""
+    storage = apps.get_model(model)._meta.get_field(field).storage
+    if hasattr(storage, "delete_orphans"):
+        storage.delete_orphans(names)
+    else:
+        for name in names:
+            storage.delete(name)
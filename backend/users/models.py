@@ -27,6 +27,7 @@ class User(AbstractUser):
         upload_to="users/images/",
         null=True,
         blank=True,
+        db_index=True,
         verbose_name="Аватар",
     )
 
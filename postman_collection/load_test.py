@@ -0,0 +1,635 @@
+"""Нагрузочное тестирование по сценариям postman-коллекции.
+
+Запросы берутся из foodgram.postman_collection.json и собираются во
+взвешенные сценарии, которые параллельно выполняют виртуальные
+пользователи. По итогам выводятся пропускная способность, задержки
+p50/p95/p99 и доля ошибок по каждому маршруту.
+
+Пример:
+    python load_test.py --start-server --workers 3 --users 50 --duration 60
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import time
+import uuid
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+COLLECTION_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    "foodgram.postman_collection.json",
+)
+BACKEND_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"
+)
+VARIABLE_RE = re.compile(r"{{(\w+)}}")
+ROUTE_ID_RE = re.compile(r"/\d+(?=/)")
+
+# Переменные, которые коллекция сохраняет из ответов в тестовых скриптах:
+# имя запроса -> {переменная: путь в JSON-ответе}.
+CAPTURES = {
+    "create_first_user": {"userId": "id"},
+    "get_token_for_first_user": {"userToken": "auth_token"},
+    "get_ingredients_list // User": {
+        "firstIndredientId": "0.id",
+        "secondIndredientId": "1.id",
+        "ingredientNameFirstLatter": "0.name",
+    },
+    "create_first_recipe // Second User": {"firstRecipeId": "id"},
+}
+
+# Сценарий: вес и последовательность запросов коллекции. Анонимные
+# сценарии отправляют запросы без заголовка Authorization.
+SCENARIOS = {
+    "browse": {
+        "weight": 6,
+        "anonymous": True,
+        "steps": [
+            "get_recipes_list // No Auth",
+            "get_recipes_list_with_limit_param // User",
+            "get_recipe_detail // No Auth",
+            "get_ingredients_list_with_name_filter // User",
+            "get_recipe_short_link // No Auth",
+        ],
+    },
+    "shopper": {
+        "weight": 3,
+        "steps": [
+            "get_recipe_detail // User",
+            "add_to_favorite // User",
+            "add_to_shopping_cart // User",
+            "get_recipes_list_with_is_in_shopping_cart_param // User",
+            "download_shopping_cart // User",
+            "remove_from_shopping_cart // User",
+            "get_recipes_list_with_is_favorited_param // User",
+            "remove_from_favorite // User",
+        ],
+    },
+    "follower": {
+        "weight": 1,
+        "steps": [
+            "create_subscription_with_recipes_limit_param // User",
+            "get_subscription_list // User",
+            "get_recipes_list_with_author_param // User",
+            "delete_second_subscription // User",
+        ],
+    },
+    "author": {
+        "weight": 1,
+        "steps": [
+            "create_first_recipe // Second User",
+            "update_recipe // Second User",
+            "get_recipe_detail // User",
+            "delete_first_recipe // Second User",
+        ],
+    },
+    "profile": {
+        "weight": 1,
+        "steps": [
+            "users_me // User",
+            "get_user_list_with_limit_param // User",
+            "set_avatar // User",
+            "delete_avatar // User",
+        ],
+    },
+}
+
+
+# Шаги, создающие данные, и шаги, которые их удаляют: прерванная
+# итерация откатывает сделанное, чтобы не копить рецепты и связи.
+UNDO_STEPS = {
+    "create_first_recipe // Second User": "delete_first_recipe // Second User",
+    "add_to_favorite // User": "remove_from_favorite // User",
+    "add_to_shopping_cart // User": "remove_from_shopping_cart // User",
+    "create_subscription_with_recipes_limit_param // User": (
+        "delete_second_subscription // User"
+    ),
+    "set_avatar // User": "delete_avatar // User",
+}
+
+
+class RequestFailed(Exception):
+    pass
+
+
+def load_collection(path):
+    with open(path, encoding="utf-8") as file:
+        collection = json.load(file)
+    variables = {
+        item["key"]: item["value"] for item in collection.get("variable", [])
+    }
+    requests = {}
+
+    def walk(items, inherited_auth):
+        for item in items:
+            auth = item.get("auth", inherited_auth)
+            if "item" in item:
+                walk(item["item"], auth)
+                continue
+            request = item["request"]
+            request_auth = request.get("auth", auth)
+            headers = {
+                header["key"]: header["value"]
+                for header in request.get("header", [])
+                if not header.get("disabled")
+            }
+            if request_auth and request_auth.get("type") == "apikey":
+                params = {p["key"]: p["value"] for p in request_auth["apikey"]}
+                headers[params["key"]] = params["value"]
+            url = request["url"]
+            requests[item["name"]] = {
+                "method": request["method"],
+                "url": url["raw"] if isinstance(url, dict) else url,
+                "headers": headers,
+                "body": request.get("body", {}).get("raw") or None,
+            }
+
+    walk(collection["item"], collection.get("auth"))
+    return variables, requests
+
+
+def substitute(template, variables):
+    return VARIABLE_RE.sub(
+        lambda match: str(variables.get(match.group(1), match.group(0))),
+        template,
+    )
+
+
+def extract(data, path):
+    for key in path.split("."):
+        data = data[int(key)] if isinstance(data, list) else data[key]
+    return data
+
+
+def route_of(method, path):
+    return f"{method} {ROUTE_ID_RE.sub('/{id}', path.split('?')[0])}"
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    index = max(0, min(len(values) - 1, round(fraction * len(values)) - 1))
+    return values[index]
+
+
+class HttpConnection:
+    """Минимальный HTTP/1.1-клиент поверх asyncio с keep-alive."""
+
+    def __init__(self, host, port, timeout):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.reader = None
+        self.writer = None
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except OSError:
+                pass
+        self.reader = self.writer = None
+
+    async def request(self, method, path, headers, body):
+        for attempt in range(2):
+            if self.writer is None:
+                self.reader, self.writer = await asyncio.open_connection(
+                    self.host, self.port
+                )
+                fresh = True
+            else:
+                fresh = False
+            try:
+                return await asyncio.wait_for(
+                    self._exchange(method, path, headers, body), self.timeout
+                )
+            except (ConnectionError, asyncio.IncompleteReadError):
+                await self.close()
+                # Сервер мог закрыть простаивающее соединение — пробуем
+                # ещё раз на новом.
+                if fresh or attempt:
+                    raise
+            except BaseException:
+                await self.close()
+                raise
+
+    async def _exchange(self, method, path, headers, body):
+        payload = body.encode() if body is not None else b""
+        lines = [f"{method} {path} HTTP/1.1", f"Host: {self.host}"]
+        lines += [f"{key}: {value}" for key, value in headers.items()]
+        if payload or method in ("POST", "PUT", "PATCH"):
+            lines.append(f"Content-Length: {len(payload)}")
+        self.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode() + payload)
+        await self.writer.drain()
+
+        status_line = await self.reader.readuntil(b"\r\n")
+        status = int(status_line.split()[1])
+        response_headers = {}
+        while True:
+            line = await self.reader.readuntil(b"\r\n")
+            if line == b"\r\n":
+                break
+            key, _, value = line.decode("latin-1").partition(":")
+            response_headers[key.strip().lower()] = value.strip()
+
+        if response_headers.get("transfer-encoding") == "chunked":
+            chunks = []
+            while True:
+                line = await self.reader.readuntil(b"\r\n")
+                size = int(line.split(b";")[0], 16)
+                chunk = await self.reader.readexactly(size + 2)
+                if not size:
+                    break
+                chunks.append(chunk[:-2])
+            data = b"".join(chunks)
+        elif "content-length" in response_headers:
+            data = await self.reader.readexactly(
+                int(response_headers["content-length"])
+            )
+        elif status in (204, 304) or method == "HEAD":
+            data = b""
+        else:
+            data = await self.reader.read()
+            response_headers["connection"] = "close"
+        if response_headers.get("connection", "").lower() == "close":
+            await self.close()
+        return status, data
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.throttled = defaultdict(int)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+
+    def record(self, route, latency, status):
+        self.latencies[route].append(latency)
+        self.statuses[route][status] += 1
+        # 429 — отказ ограничения нагрузки, а не ошибка приложения.
+        if status == 429:
+            self.throttled[route] += 1
+        elif status is None or status >= 400:
+            self.errors[route] += 1
+
+    def report(self, elapsed):
+        rows = []
+        for route in sorted(self.latencies):
+            values = sorted(self.latencies[route])
+            rows.append(
+                {
+                    "route": route,
+                    "requests": len(values),
+                    "rps": len(values) / elapsed,
+                    "p50_ms": percentile(values, 0.50) * 1000,
+                    "p95_ms": percentile(values, 0.95) * 1000,
+                    "p99_ms": percentile(values, 0.99) * 1000,
+                    "error_rate": self.errors[route] / len(values),
+                    "throttled_rate": self.throttled[route] / len(values),
+                    "statuses": {
+                        str(key): value
+                        for key, value in self.statuses[route].items()
+                    },
+                }
+            )
+        total = sum(row["requests"] for row in rows)
+        errors = sum(self.errors.values())
+        throttled = sum(self.throttled.values())
+        return {
+            "elapsed_s": elapsed,
+            "requests": total,
+            "rps": total / elapsed if elapsed else 0.0,
+            "error_rate": errors / total if total else 0.0,
+            "throttled_rate": throttled / total if total else 0.0,
+            "routes": rows,
+        }
+
+
+class VirtualUser:
+    def __init__(self, runner, index):
+        self.runner = runner
+        self.index = index
+        self.connection = runner.connect()
+        suffix = f"{runner.run_id}-{index}"
+        runner.usernames.append(f"load-{suffix}")
+        self.variables = dict(runner.variables)
+        self.variables.update(
+            {
+                "email": json.dumps(f"load-{suffix}@foodgram.test"),
+                "username": json.dumps(f"load-{suffix}"),
+            }
+        )
+
+    async def call(self, name, variables, anonymous=False, record=True):
+        template = self.runner.requests[name]
+        url = urlsplit(substitute(template["url"], variables))
+        path = url.path + (f"?{url.query}" if url.query else "")
+        headers = {"Content-Type": "application/json"}
+        if not anonymous:
+            headers.update(
+                {
+                    key: substitute(value, variables)
+                    for key, value in template["headers"].items()
+                }
+            )
+        body = template["body"]
+        if body is not None:
+            body = substitute(body, variables)
+        route = route_of(template["method"], path)
+        started = time.perf_counter()
+        try:
+            status, data = await self.connection.request(
+                template["method"], path, headers, body
+            )
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+            status, data = None, b""
+        if record:
+            self.runner.stats.record(
+                route, time.perf_counter() - started, status
+            )
+        if status is None or status >= 400:
+            raise RequestFailed(f"{name}: {status}")
+        for variable, path in CAPTURES.get(name, {}).items():
+            variables[variable] = extract(json.loads(data), path)
+        return data
+
+    async def sign_up(self):
+        await self.call("create_first_user", self.variables, record=False)
+        await self.call(
+            "get_token_for_first_user", self.variables, record=False
+        )
+        self.variables["secondUserToken"] = self.variables["userToken"]
+
+    async def run_iteration(self, scenario):
+        variables = dict(self.variables)
+        variables["firstRecipeId"] = random.choice(self.runner.recipe_ids)
+        variables["secondUserId"] = random.choice(self.runner.author_ids)
+        done = []
+        try:
+            for step in scenario["steps"]:
+                await self.call(
+                    step,
+                    variables,
+                    anonymous=scenario.get("anonymous", False),
+                )
+                done.append(step)
+        except RequestFailed:
+            await self.undo(done, variables)
+            raise
+
+    async def undo(self, done, variables):
+        """Удаляет то, что успела создать прерванная итерация."""
+        for step in reversed(done):
+            undo_step = UNDO_STEPS.get(step)
+            if undo_step is None or undo_step in done:
+                continue
+            try:
+                await self.call(undo_step, variables, record=False)
+            except RequestFailed:
+                pass
+
+    async def run(self, deadline):
+        names = list(SCENARIOS)
+        weights = [SCENARIOS[name]["weight"] for name in names]
+        while time.monotonic() < deadline:
+            scenario = random.choices(names, weights)[0]
+            try:
+                await self.run_iteration(SCENARIOS[scenario])
+                self.runner.iterations[scenario] += 1
+            except RequestFailed:
+                self.runner.failed_iterations[scenario] += 1
+            if self.runner.think_time:
+                await asyncio.sleep(random.uniform(0, self.runner.think_time))
+        await self.connection.close()
+
+
+class LoadRunner:
+    def __init__(self, options):
+        self.options = options
+        self.variables, self.requests = load_collection(options.collection)
+        base_url = urlsplit(options.base_url)
+        self.host = base_url.hostname
+        self.port = base_url.port or 80
+        self.variables["baseUrl"] = options.base_url.rstrip("/")
+        self.run_id = uuid.uuid4().hex[:8]
+        self.think_time = options.think_time
+        self.stats = Stats()
+        self.iterations = defaultdict(int)
+        self.failed_iterations = defaultdict(int)
+        self.recipe_ids = []
+        self.author_ids = []
+        self.usernames = []
+
+    def connect(self):
+        return HttpConnection(self.host, self.port, self.options.timeout)
+
+    async def prepare(self):
+        """Создаёт авторов с рецептами, с которыми работают сценарии."""
+        for index in range(self.options.authors):
+            author = VirtualUser(self, f"author-{index}")
+            await author.sign_up()
+            if not self.recipe_ids:
+                await author.call(
+                    "get_ingredients_list // User",
+                    author.variables,
+                    record=False,
+                )
+                for name in CAPTURES["get_ingredients_list // User"]:
+                    self.variables[name] = author.variables[name]
+                self.variables["ingredientNameFirstLatter"] = self.variables[
+                    "ingredientNameFirstLatter"
+                ][:1]
+                author.variables.update(self.variables)
+            for _ in range(self.options.recipes_per_author):
+                await author.call(
+                    "create_first_recipe // Second User",
+                    author.variables,
+                    record=False,
+                )
+                self.recipe_ids.append(author.variables["firstRecipeId"])
+            self.author_ids.append(author.variables["userId"])
+            await author.connection.close()
+
+    async def run(self):
+        await self.prepare()
+        users = [
+            VirtualUser(self, index) for index in range(self.options.users)
+        ]
+        for offset in range(0, len(users), 20):
+            await asyncio.gather(
+                *(user.sign_up() for user in users[offset:offset + 20])
+            )
+        started = time.monotonic()
+        deadline = started + self.options.duration
+        ramp_step = self.options.ramp_up / max(len(users), 1)
+
+        async def start(user, delay):
+            await asyncio.sleep(delay)
+            await user.run(deadline)
+
+        await asyncio.gather(
+            *(
+                start(user, index * ramp_step)
+                for index, user in enumerate(users)
+            )
+        )
+        return self.stats.report(time.monotonic() - started)
+
+
+def wait_for_port(host, port, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Сервер {host}:{port} не запустился за {timeout} с")
+
+
+def server_env(options):
+    """Окружение локального сервера: его адрес в ALLOWED_HOSTS и без
+    ограничения нагрузки, которое мерило бы свои лимиты, а не сервер."""
+    hosts = os.environ.get("ALLOWED_HOSTS", "localhost").split(",")
+    hostname = urlsplit(options.base_url).hostname
+    if hostname not in hosts:
+        hosts.append(hostname)
+    return dict(
+        os.environ, ALLOWED_HOSTS=",".join(hosts), ADMISSION_CONTROL="False"
+    )
+
+
+def start_server(options):
+    base_url = urlsplit(options.base_url)
+    bind = f"{base_url.hostname}:{base_url.port or 80}"
+    if options.server == "gunicorn":
+        command = [
+            sys.executable, "-m", "gunicorn",
+            "--bind", bind,
+            "--workers", str(options.workers),
+            "foodgram.wsgi",
+        ]
+    else:
+        command = [
+            sys.executable, "manage.py", "runserver", "--noreload", bind,
+        ]
+    process = subprocess.Popen(
+        command,
+        cwd=BACKEND_DIR,
+        env=server_env(options),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_for_port(base_url.hostname, base_url.port or 80, 30)
+    except RuntimeError:
+        process.terminate()
+        raise
+    return process
+
+
+def purge_users(options, usernames):
+    """Удаляет созданных тестом пользователей вместе с их рецептами."""
+    if usernames:
+        subprocess.run(
+            [sys.executable, "manage.py", "purge", "--user", *usernames],
+            cwd=BACKEND_DIR,
+            env=server_env(options),
+            stdout=subprocess.DEVNULL,
+            check=False,
+        )
+
+
+def print_report(report, runner):
+    print(
+        f"\n{'Маршрут':<48}{'запр.':>8}{'rps':>9}"
+        f"{'p50 мс':>10}{'p95 мс':>10}{'p99 мс':>10}{'ошибки':>9}"
+        f"{'429':>8}"
+    )
+    for row in report["routes"]:
+        print(
+            f"{row['route']:<48}{row['requests']:>8}{row['rps']:>9.1f}"
+            f"{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}"
+            f"{row['p99_ms']:>10.1f}{row['error_rate']:>9.1%}"
+            f"{row['throttled_rate']:>8.1%}"
+        )
+    print(
+        f"\nВсего: {report['requests']} запросов за "
+        f"{report['elapsed_s']:.1f} с, {report['rps']:.1f} rps, "
+        f"ошибок {report['error_rate']:.1%}, "
+        f"отклонено (429) {report['throttled_rate']:.1%}"
+    )
+    for name in SCENARIOS:
+        print(
+            f"  {name}: успешно {runner.iterations[name]}, "
+            f"прервано {runner.failed_iterations[name]}"
+        )
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--collection", default=COLLECTION_PATH)
+    parser.add_argument(
+        "--users", type=int, default=20, help="Число виртуальных пользователей"
+    )
+    parser.add_argument(
+        "--duration", type=float, default=30, help="Длительность, секунды"
+    )
+    parser.add_argument(
+        "--ramp-up", type=float, default=5, help="Время разгона, секунды"
+    )
+    parser.add_argument(
+        "--think-time",
+        type=float,
+        default=0,
+        help="Максимальная пауза между сценариями, секунды",
+    )
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--authors", type=int, default=5)
+    parser.add_argument("--recipes-per-author", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument(
+        "--start-server",
+        action="store_true",
+        help="Запустить локальный сервер из backend/ на время теста",
+    )
+    parser.add_argument(
+        "--server", choices=("gunicorn", "runserver"), default="gunicorn"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=2, help="Число воркеров gunicorn"
+    )
+    parser.add_argument("--json", help="Сохранить отчёт в JSON-файл")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    options = parse_args(argv)
+    random.seed(options.seed)
+    server = start_server(options) if options.start_server else None
+    runner = LoadRunner(options)
+    try:
+        report = asyncio.run(runner.run())
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+            purge_users(options, runner.usernames)
+    print_report(report, runner)
+    if options.json:
+        with open(options.json, "w", encoding="utf-8") as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()